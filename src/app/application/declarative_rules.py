@@ -0,0 +1,182 @@
+
+# core python
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import datetime
+import operator
+from typing import Any, Callable, Dict, FrozenSet, List, Literal, Union
+
+# pypi
+import pandas as pd
+
+# native
+from application.validation_contexts import TransactionValidationContext
+from application.validation_rules import TransactionValidationRule, as_float
+from domain.models import Transaction
+from domain.services import AlertService
+
+
+COMPARISONS = {'gt': operator.gt, 'ge': operator.ge, 'lt': operator.lt, 'le': operator.le, 'eq': operator.eq, 'ne': operator.ne}
+ORDERINGS = ('gt', 'ge', 'lt', 'le')
+MEMBERSHIPS = ('in', 'not_in')
+
+
+def parse_value(value: str) -> Union[int, float, datetime.date, str]:
+    """ Parse a config value as an int, float or (ISO format, e.g. 2024-01-31) date if it looks like one, otherwise a string """
+    value = value.strip()
+    for convert in (int, float, datetime.date.fromisoformat):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value.strip('\'"')
+
+
+def as_date(value: Any) -> Any:
+    """ Dates from the database may come as datetimes (or Timestamps), which don't compare with dates """
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+@dataclass(frozen=True)
+class RuleDefinition:
+    """
+    A rule declared as data rather than code: the rule is broken when field_name's value <broken_when> value(s), e.g.
+    Quantity gt 100, PortfolioID not_in {1, 2, 3} or TransactionCode in {'dp', 'wd'}.
+    """
+    name: str
+    field_name: str
+    broken_when: Literal['gt', 'ge', 'lt', 'le', 'eq', 'ne', 'in', 'not_in']
+    value: Any = None  # For comparisons
+    values: FrozenSet = frozenset()  # For in / not_in
+
+    @classmethod
+    def from_options(cls, name: str, options: Dict[str, str]):
+        """ Create from string options, as read from config: field, broken_when, and value or (comma-separated) values """
+        broken_when = options['broken_when'].strip()
+        if broken_when in COMPARISONS:
+            value = parse_value(options['value'])
+            if broken_when in ORDERINGS and isinstance(value, str):
+                raise ValueError(f'Rule {name}: {broken_when} needs a number or date (e.g. 2024-01-31) value, not {value!r}')
+            return cls(name=name, field_name=options['field'].strip(), broken_when=broken_when, value=value)
+        elif broken_when in MEMBERSHIPS:
+            values = frozenset([parse_value(v) for v in options['values'].split(',') if v.strip()])
+            return cls(name=name, field_name=options['field'].strip(), broken_when=broken_when, values=values)
+        raise ValueError(f'Rule {name}: unrecognized broken_when {broken_when}')
+
+    def __str__(self):
+        target = self.value if self.broken_when in COMPARISONS else sorted(self.values, key=str)
+        return f'{self.name}: broken when {self.field_name} {self.broken_when} {target}'
+
+
+def compile_predicate(definition: RuleDefinition) -> Callable[[Transaction], bool]:
+    """ Compile the definition into a closure specialised for its operator, for the per-event path """
+    field_name = definition.field_name
+    if definition.broken_when in COMPARISONS:
+        compare, threshold = COMPARISONS[definition.broken_when], definition.value
+        if isinstance(threshold, datetime.date):
+            def is_broken(transaction: Transaction) -> bool:
+                value = getattr(transaction, field_name, None)
+                return value is not None and compare(as_date(value), threshold)
+            return is_broken
+
+        if isinstance(threshold, str):
+            # APX codes may be space-padded
+            def is_broken(transaction: Transaction) -> bool:
+                value = getattr(transaction, field_name, None)
+                return value is not None and compare(value.strip() if isinstance(value, str) else value, threshold)
+            return is_broken
+
+        def is_broken(transaction: Transaction) -> bool:
+            value = getattr(transaction, field_name, None)
+            return value is not None and compare(value, threshold)
+        return is_broken
+
+    values = definition.values
+    is_in = definition.broken_when == 'in'
+    if all([isinstance(v, str) for v in values]):
+        # APX codes may be space-padded
+        def is_broken(transaction: Transaction) -> bool:
+            value = getattr(transaction, field_name, None)
+            return ((value.strip() if isinstance(value, str) else value) in values) == is_in
+        return is_broken
+
+    def is_broken(transaction: Transaction) -> bool:
+        return (getattr(transaction, field_name, None) in values) == is_in
+    return is_broken
+
+
+def compile_mask(definition: RuleDefinition) -> Callable[[pd.DataFrame], pd.Series]:
+    """ Compile the definition into a vectorized mask function, for the batch path """
+    field_name = definition.field_name
+
+    def column(frame: pd.DataFrame) -> pd.Series:
+        if field_name in frame.columns:
+            return frame[field_name]
+        return pd.Series(None, index=frame.index, dtype=object)
+
+    if definition.broken_when in COMPARISONS:
+        compare, threshold = COMPARISONS[definition.broken_when], definition.value
+        if isinstance(threshold, datetime.date):
+            threshold = pd.Timestamp(threshold)
+
+            def mask(frame: pd.DataFrame) -> pd.Series:
+                col = column(frame)
+                if isinstance(col.dtype, pd.CategoricalDtype):
+                    col = col.astype(object)
+                values = pd.to_datetime(col, errors='coerce')
+                return (compare(values, threshold) & values.notna()).astype(bool)
+            return mask
+
+        if isinstance(threshold, str):
+            def mask(frame: pd.DataFrame) -> pd.Series:
+                col = column(frame)
+                if not pd.api.types.is_numeric_dtype(col):
+                    col = col.astype(object).str.strip()  # APX codes may be space-padded
+                return (compare(col, threshold) & col.notna()).astype(bool)
+            return mask
+
+        def mask(frame: pd.DataFrame) -> pd.Series:
+            values = as_float(column(frame))
+            return (compare(values, threshold) & values.notna()).astype(bool)
+        return mask
+
+    values = definition.values
+    is_in = definition.broken_when == 'in'
+    strip = all([isinstance(v, str) for v in values])
+
+    def mask(frame: pd.DataFrame) -> pd.Series:
+        col = column(frame)
+        if strip and not pd.api.types.is_numeric_dtype(col):
+            col = col.str.strip()
+        matches = col.isin(list(values))
+        return matches if is_in else ~matches
+    return mask
+
+
+class DeclarativeRule(TransactionValidationRule):
+    """ A rule compiled from a RuleDefinition, once, into a predicate and a vectorized mask """
+
+    def __init__(self, definition: RuleDefinition, fail_alert_services: Union[List[AlertService],None] = None):
+        super().__init__(name=definition.name, fail_alert_services=fail_alert_services)
+        self.definition = definition
+        self.required_fields = (definition.field_name,)
+        self.predicate = compile_predicate(definition)
+        self.mask = compile_mask(definition)
+
+    def is_broken(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None) -> bool:
+        return self.predicate(transaction)
+
+    def is_broken_batch(self, frame: pd.DataFrame) -> pd.Series:
+        return self.mask(frame)
+
+
+class TransactionValidationRuleSource(ABC):
+    """ Supplies rules which may change while running, e.g. declared in a config file """
+
+    @abstractmethod
+    def get_rules_if_changed(self) -> Union[List[TransactionValidationRule], None]:
+        """ Returns the current rules on the first call and whenever they have changed since, otherwise None """
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
@@ -50,7 +50,8 @@ class TransactionEventHandler(EventHandler):
                 return True
 
         except TransactionValidationRuleBrokenException as e:
-            e.rule.send_alert_for_transaction(e.transaction)
+            for rule in (e.broken_rules or [e.rule]):
+                rule.send_alert_for_transaction(e.transaction, e.context)
 
             # Commit offset
             return True
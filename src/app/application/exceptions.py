@@ -1,9 +1,10 @@
 
 from dataclasses import dataclass, field
 import datetime
-from typing import Dict
+from typing import Dict, List, Union
 
 # native
+from application.validation_contexts import TransactionValidationContext
 from application.validation_rules import TransactionValidationRule
 from domain.models import Transaction, BlotterTradeSettlementCriteria, BlotterType
 from domain.repositories import TransactionRepository
@@ -13,6 +14,8 @@ from domain.repositories import TransactionRepository
 class TransactionValidationRuleBrokenException(Exception):
     rule: TransactionValidationRule
     transaction: Transaction
+    context: Union[TransactionValidationContext, None] = None
+    broken_rules: List[TransactionValidationRule] = field(default_factory=list)  # Every broken rule, when collecting all failures
 
 
 # @dataclass
@@ -26,3 +29,9 @@ class TransactionValidationRuleBrokenException(Exception):
 class TransactionCountMismatchException(Exception):
     repos_counts: Dict[TransactionRepository, int]
 
+
+@dataclass
+class TransactionCountQueryFailedException(Exception):
+    repos_counts: Dict[TransactionRepository, int]  # Repos which could be counted
+    repos_errors: Dict[TransactionRepository, str]  # Repos which failed or timed out, with why
+
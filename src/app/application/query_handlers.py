@@ -1,16 +1,64 @@
 
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass, field
 import datetime
-from typing import List, Union
+import logging
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
 
-from application.exceptions import TransactionCountMismatchException
+from application.exceptions import TransactionCountMismatchException, TransactionCountQueryFailedException
 from domain.models import Transaction, BlotterTradeSettlementCriteria, BlotterType
 from domain.repositories import TransactionRepository
 
 
+@dataclass
+class TransactionCountComparison:
+    """ One cell of a date range comparison: each repo's count for a trade date and settlement criteria """
+    trade_date: datetime.date
+    settlement_criteria: BlotterTradeSettlementCriteria
+    repos_counts: Dict[TransactionRepository, int] = field(default_factory=dict)
+    repos_errors: Dict[TransactionRepository, str] = field(default_factory=dict)  # Repos which couldn't be counted
+
+    @property
+    def passed(self) -> bool:
+        """ Only if every repo was counted, and the counts agree """
+        return not self.repos_errors and len(set(self.repos_counts.values())) <= 1
+
+    @property
+    def status(self) -> str:
+        """ 'ERROR' if any repo couldn't be counted, else 'PASS' or 'FAIL' """
+        if self.repos_errors:
+            return 'ERROR'
+        return 'PASS' if self.passed else 'FAIL'
+
+
+@dataclass
+class TransactionCountMatrix:
+    """ Per-date, per-settlement criteria comparisons, plus any repos which couldn't be counted """
+    comparisons: List[TransactionCountComparison]
+    repos_errors: Dict[TransactionRepository, str] = field(default_factory=dict)
+
+    @property
+    def failed(self) -> List[TransactionCountComparison]:
+        """ Comparisons whose counts differ. Those with repos which couldn't be counted are errored instead. """
+        return [c for c in self.comparisons if c.status == 'FAIL']
+
+    @property
+    def errored(self) -> List[TransactionCountComparison]:
+        return [c for c in self.comparisons if c.status == 'ERROR']
+
+
 @dataclass
 class TransactionCountComparator:
+    """
+    Compares transaction counts across repositories, querying them concurrently (they are usually on different servers).
+    Each repository gets timeout_seconds from when querying starts. Failed or timed out repositories are reported
+    along with the counts of the others. A timed out query can't be cancelled from here, so the process may not exit
+    until it returns: set the database's query_timeout_seconds to bound that.
+    """
     repos: List[TransactionRepository]
+    max_workers: int = 4
+    timeout_seconds: float = 300.0
 
     def compare(self, trade_date: Union[datetime.date,None]=None, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None):
         """ Handle the query """
@@ -21,20 +69,70 @@ class TransactionCountComparator:
         if not settlement_criteria:
             settlement_criteria = payload.get('settlement_criteria') or BlotterTradeSettlementCriteria.t_plus_one
 
-        # Query counts from each repo; save to dict
-        repos_counts = {}
-        for repo in self.repos:
-            all_txns = repo.get(trade_date=trade_date)
-            if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_one:
-                relevant_txns = [t for t in all_txns if t.TradeDate != t.SettleDate]
-            else:
-                relevant_txns = [t for t in all_txns if t.TradeDate == t.SettleDate]
-
-            repos_counts[repo] = len(relevant_txns)
+        # Query counts from each repo concurrently; save to dict
+        repos_counts, repos_errors = self.query_concurrently(lambda repo: repo.count(trade_date=trade_date, settlement_criteria=settlement_criteria))
+        if repos_errors:
+            raise TransactionCountQueryFailedException(repos_counts=repos_counts, repos_errors=repos_errors)
 
         # Check if all counts are identical
         counts = [v for k, v in repos_counts.items()]
         if len(set(counts)) > 1:
             raise TransactionCountMismatchException(repos_counts=repos_counts)
 
+    def compare_range(self, start_date: datetime.date, end_date: datetime.date
+                        , settlement_criterias: Tuple[BlotterTradeSettlementCriteria, ...]=tuple(BlotterTradeSettlementCriteria)) -> TransactionCountMatrix:
+        """
+        Compare counts for every trade date from start_date to end_date (inclusive) and each of settlement_criterias,
+        with one query per repo rather than one per repo per date per settlement criteria
+        """
+        repos_counts_by_date, repos_errors = self.query_concurrently(lambda repo: repo.count_by_trade_date(start_date=start_date, end_date=end_date))
+
+        comparisons = []
+        trade_date = start_date
+        while trade_date <= end_date:
+            for settlement_criteria in settlement_criterias:
+                comparisons.append(TransactionCountComparison(
+                    trade_date=trade_date, settlement_criteria=settlement_criteria,
+                    repos_counts={repo: counts.get((trade_date, settlement_criteria), 0) for repo, counts in repos_counts_by_date.items()},
+                    repos_errors=dict(repos_errors)
+                ))
+            trade_date += datetime.timedelta(days=1)
+        return TransactionCountMatrix(comparisons=comparisons, repos_errors=repos_errors)
+
+    def query_concurrently(self, query: Callable[[TransactionRepository], Any]):
+        """
+        Call query(repo) for every repo concurrently
+
+        :returns: (repo -> result for those which succeeded, repo -> error description for those which failed or timed out)
+        """
+        def timed_query(repo):
+            start = time.perf_counter()
+            result = query(repo)
+            return result, time.perf_counter() - start
+
+        repos_results, repos_errors = {}, {}
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.repos)) or 1, thread_name_prefix=self.cn)
+        try:
+            deadline = time.monotonic() + self.timeout_seconds
+            futures = {repo: executor.submit(timed_query, repo) for repo in self.repos}
+            for repo, future in futures.items():
+                try:
+                    result, seconds = future.result(timeout=max(deadline - time.monotonic(), 0))
+                    repos_results[repo] = result
+                    logging.info(f'{self.cn}: {repo} queried in {seconds:.2f}s')
+                except TimeoutError:
+                    repos_errors[repo] = f'timed out after {self.timeout_seconds}s'
+                    logging.error(f'{self.cn}: {repo} {repos_errors[repo]}')
+                except Exception as e:
+                    repos_errors[repo] = f'{type(e).__name__}: {e}'
+                    logging.exception(f'{self.cn}: {repo} query failed: {e}')
+        finally:
+            # Don't wait for timed out queries here. Their threads still run until the query returns, and are joined at exit.
+            executor.shutdown(wait=False, cancel_futures=True)
+        return repos_results, repos_errors
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
 
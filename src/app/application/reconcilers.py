@@ -0,0 +1,110 @@
+
+# core python
+from dataclasses import dataclass, field
+import datetime
+from decimal import Decimal
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+# native
+from domain.models import Transaction, BlotterTradeSettlementCriteria
+from domain.repositories import TransactionRepository
+
+
+def normalize(value: Any) -> str:
+    """ Render a value the same way whichever repository it came from, e.g. Decimal('1.50') and 1.5 """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat() if value.time() == datetime.time() else value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return repr(round(float(value), 8))
+    return str(value)
+
+
+@dataclass
+class ReconciliationDifference:
+    key: Tuple[str, ...]
+    status: str  # 'missing' or 'mismatched'
+    missing_from: List[str] = field(default_factory=list)
+    mismatched_in: List[str] = field(default_factory=list)
+    counts: Dict[str, int] = field(default_factory=dict)  # repo -> number of transactions with this key
+
+
+@dataclass
+class TransactionReconciler:
+    """
+    Finds which transactions are missing from, or differ in, each repository. Each transaction is reduced to its
+    key_fields plus a hash of its compare_fields as soon as it is read, so memory is proportional to the number of keys
+    rather than to full rows. The diff is then a single pass over the union of keys (a hash join).
+    Repositories may hold several transactions with the same key; they then must agree on how many, and on their hashes.
+    Transactions are streamed from each repository chunk_size at a time, so full rows are never all held at once.
+    """
+    repos: List[TransactionRepository]
+    key_fields: Tuple[str, ...] = ('PortfolioCode', 'TradeDate', 'Quantity')
+    compare_fields: Tuple[str, ...] = ('SettleDate',)
+    chunk_size: int = 10000
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """ The only fields needed from each repository: the key and compare fields, plus those is_relevant checks """
+        return tuple(dict.fromkeys(self.key_fields + self.compare_fields + ('TradeDate', 'SettleDate')))
+
+    def reduce(self, transaction: Transaction) -> Tuple[Tuple[str, ...], bytes]:
+        key = tuple([normalize(getattr(transaction, f, None)) for f in self.key_fields])
+        content = '\x1f'.join([normalize(getattr(transaction, f, None)) for f in self.compare_fields])
+        return key, hashlib.blake2b(content.encode(), digest_size=8).digest()
+
+    def is_relevant(self, transaction: Transaction, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]) -> bool:
+        if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_one:
+            return transaction.TradeDate != transaction.SettleDate
+        elif settlement_criteria == BlotterTradeSettlementCriteria.t_plus_zero:
+            return transaction.TradeDate == transaction.SettleDate
+        return True
+
+    def digest(self, transactions: Iterable[Transaction], settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> Dict[Tuple[str, ...], List[bytes]]:
+        """ key -> content hashes of the transactions with that key """
+        hashes = {}
+        for t in transactions:
+            if not self.is_relevant(t, settlement_criteria):
+                continue
+            key, content_hash = self.reduce(t)
+            hashes.setdefault(key, []).append(content_hash)
+        for v in hashes.values():
+            v.sort()
+        return hashes
+
+    def reconcile(self, trade_date: datetime.date, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> List[ReconciliationDifference]:
+        repos_hashes = {}
+        for repo in self.repos:
+            repos_hashes[str(repo)] = self.digest(repo.iter_get(trade_date=trade_date, columns=self.columns, chunk_size=self.chunk_size), settlement_criteria)
+            logging.info(f'{self.cn}: {repo} has {sum([len(v) for v in repos_hashes[str(repo)].values()])} transactions under {len(repos_hashes[str(repo)])} keys')
+        return self.diff(repos_hashes)
+
+    def diff(self, repos_hashes: Dict[str, Dict[Tuple[str, ...], List[bytes]]]) -> List[ReconciliationDifference]:
+        all_keys = set()
+        for hashes in repos_hashes.values():
+            all_keys.update(hashes)
+
+        differences = []
+        for key in sorted(all_keys):
+            present = {repo: hashes[key] for repo, hashes in repos_hashes.items() if key in hashes}
+            missing_from = [repo for repo in repos_hashes if repo not in present]
+            reference = next(iter(present.values()))
+            mismatched_in = [repo for repo, h in present.items() if h != reference]
+            if missing_from or mismatched_in:
+                differences.append(ReconciliationDifference(
+                    key=key, status='missing' if missing_from else 'mismatched', missing_from=missing_from,
+                    mismatched_in=mismatched_in, counts={repo: len(present.get(repo, [])) for repo in repos_hashes}
+                ))
+        logging.info(f'{self.cn}: {len(differences)} of {len(all_keys)} keys differ')
+        return differences
@@ -0,0 +1,53 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable
+
+from domain.models import Transaction, BlotterTradeSettlementCriteria
+from domain.repositories import IdentifierRepository
+
+
+@dataclass
+class TransactionValidationContext:
+    """
+    Facts derived while validating one transaction (e.g. its relevant blotter), memoized for the lifetime of
+    that one event so each lookup happens at most once, however many rules or alerts need it
+    """
+    transaction: Transaction
+    facts: Dict[Hashable, Any] = field(default_factory=dict)
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """ Return the fact stored under key, computing and storing it first if needed """
+        try:
+            return self.facts[key]
+        except KeyError:
+            value = self.facts[key] = compute()
+            return value
+
+    @property
+    def settlement_criteria(self) -> BlotterTradeSettlementCriteria:
+        # TODO_EH: Asusmption: T+1 if TD != SD ... is this assumption desirable?
+        return self.get_or_compute('settlement_criteria', lambda: (
+            BlotterTradeSettlementCriteria.t_plus_zero if self.transaction.TradeDate == self.transaction.SettleDate
+            else BlotterTradeSettlementCriteria.t_plus_one
+        ))
+
+    def with_identifiers(self, identifier_repo: IdentifierRepository) -> Transaction:
+        """
+        The transaction plus its PortfolioCode and ProprietarySymbol (how systems outside APX, e.g. the landing zone,
+        identify its portfolio and security), resolved from PortfolioID and SecurityID1 if it lacks them
+        """
+        def resolve() -> Transaction:
+            fields = self.transaction.to_dict()
+            if fields.get('PortfolioCode') is None and fields.get('PortfolioID') is not None:
+                fields['PortfolioCode'] = identifier_repo.get_portfolio_code(fields['PortfolioID'])
+            if fields.get('ProprietarySymbol') is None and fields.get('SecurityID1') is not None:
+                fields['ProprietarySymbol'] = identifier_repo.get_proprietary_symbol(fields['SecurityID1'])
+            return Transaction(**fields)
+        return self.get_or_compute('with_identifiers', resolve)
+
+    def __str__(self):
+        return f"{self.cn} for {self.transaction}, with facts: {', '.join([str(k) for k in self.facts])}"
+
@@ -1,19 +1,34 @@
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+import datetime
 import logging
 from typing import Any, List, Union
 
+import pandas as pd
+
+from application.validation_contexts import TransactionValidationContext
 from domain.models import Alert, Transaction, Blotter, BlotterTradeSettlementCriteria, BlotterType, BlotterSendStatus
-from domain.repositories import BlotterRepository
+from domain.repositories import BlotterRepository, IdentifierRepository, TransactionIndex
 from domain.services import AlertService
 
 
 
+def as_float(values: pd.Series) -> pd.Series:
+    """
+    Values as float64, NaN where NULL or not a number. Numeric columns of columnar frames (including Arrow decimals)
+    are cast directly, since pd.to_numeric mishandles Arrow columns with NULLs.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype('float64')
+    return pd.to_numeric(values.astype(object), errors='coerce')
+
+
 @dataclass
 class TransactionValidationRule(ABC):
     name: Union[str, None] = None
     fail_alert_services: Union[List[AlertService],None] = None
+    required_fields = None  # Transaction fields the rule reads, so batch callers can fetch only those. None if unknown.
 
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
@@ -27,14 +42,23 @@ class TransactionValidationRule(ABC):
         return self.name
 
     @abstractmethod
-    def is_broken(self, transaction: Transaction) -> bool:
-        pass
-
-    def send_alert_for_transaction(self, transaction: Transaction):
+    def is_broken(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None) -> bool:
+        """ Rules may use the context to share derived facts with other rules and the alert path """
+
+    def is_broken_batch(self, frame: pd.DataFrame) -> pd.Series:
+        """
+        Returns a boolean mask over the frame's rows (one row per transaction), True where the rule is broken.
+        Subclasses may override with a vectorized version; this fallback calls is_broken once per row.
+        """
+        transaction_class = Transaction.with_fields(frame.columns)
+        transactions = [transaction_class.from_values(row) for row in frame.itertuples(index=False, name=None)]
+        return pd.Series([bool(self.is_broken(t, TransactionValidationContext(t))) for t in transactions], index=frame.index, dtype=bool)
+
+    def send_alert_for_transaction(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
         """ If there are no fail_alert_services, this will do nothing """ 
         """ Subclasses may override """
 
-        title = body = f'{e.transaction} failed rule {self}!'
+        title = body = f'{transaction} failed rule {self}!'
         logging.info(title)
 
         # If the rule has any alert services, send alerts using them:
@@ -48,43 +72,67 @@ class TransactionValidationRule(ABC):
 
 
 class TransactionQuantityMax100(TransactionValidationRule):
-    def is_broken(self, transaction: Transaction):
+    required_fields = ('Quantity',)
+
+    def is_broken(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
         return transaction.Quantity > 100
 
+    def is_broken_batch(self, frame: pd.DataFrame) -> pd.Series:
+        return as_float(frame['Quantity']) > 100
+
 
 
 class TransactionNotFoundInLZ(TransactionValidationRule):
-    def is_broken(self, transaction: Transaction):
-        return False  # TODO: implement
-        # Query Nelson's APX txn view to supplement with attributes (portfolio code, sec symbol, ...)
-        # Query LZ txns matching trade date, portfolio code, quantity, ... 
-        # if not found, return True
+    """
+    Broken when the landing zone definitely has no matching transaction. Used by the consumer if [lz_index] enabled.
+    The landing zone identifies portfolios and securities by code, which change events lack, so those are resolved
+    via identifier_repo first.
+    """
+
+    def __init__(self, lz_index: TransactionIndex, identifier_repo: IdentifierRepository
+                    , fail_alert_services: Union[List[AlertService],None] = None):
+        super().__init__(name=None, fail_alert_services=fail_alert_services)
+        self.lz_index = lz_index
+        self.identifier_repo = identifier_repo
+
+    def is_broken(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
+        if context is None:
+            context = TransactionValidationContext(transaction)
+        return self.lz_index.contains(context.with_identifiers(self.identifier_repo)) is False
 
 # from application.exceptions import BlotterNotFoundException  # here to avoid circular reference
 
 class TransactionPostedAfterBlotterSent(TransactionValidationRule):
+    required_fields = ('TradeDate', 'SettleDate')
+
     def __init__(self, blotter_repo: BlotterRepository, fail_alert_services: Union[List[AlertService],None] = None):
         super().__init__(name=None, fail_alert_services=fail_alert_services)
         self.blotter_repo = blotter_repo
 
-    def is_broken(self, transaction: Transaction):
-        blotter = self.get_relevant_blotter(transaction)
+    def is_broken(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
+        blotter = self.get_relevant_blotter(transaction, context)
         if blotter.status in (BlotterSendStatus.IN_PROGRESS, BlotterSendStatus.SUCCESS):
             return True
         else:
             return False
         
-    def get_relevant_blotter(self, transaction: Transaction):
+    def get_relevant_blotter(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
+        """ Looks up the blotter at most once per context """
+        if context is None:
+            context = TransactionValidationContext(transaction)
+        return context.get_or_compute((self.cn, 'relevant_blotter'), lambda: self.find_relevant_blotter(context))
+
+    def find_relevant_blotter(self, context: TransactionValidationContext):
         # return BlotterSendStatus.SUCCESS  # TODO_TEST: actuall use blotter_repo
-        trade_date = transaction.TradeDate  # TODO_EH: error handling - what if there is no TradeDate?
-        settle_date = transaction.SettleDate  # TODO_EH: error handling - what if there is no SettleDate?
+        trade_date = context.transaction.TradeDate  # TODO_EH: error handling - what if there is no TradeDate?
+
+        # TODO_EH: error handling - what if there is no SettleDate?
+        return self.find_blotter(trade_date, context.settlement_criteria)
 
-        if trade_date == settle_date:
-            settlement_criteria = BlotterTradeSettlementCriteria.t_plus_zero
+    def find_blotter(self, trade_date: datetime.date, settlement_criteria: BlotterTradeSettlementCriteria) -> Union[Blotter, None]:
+        if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_zero:
             type_ = BlotterType.regular
         else:
-            # TODO_EH: Asusmption: T+1 if TD != SD ... is this assumption desirable?
-            settlement_criteria = BlotterTradeSettlementCriteria.t_plus_one
             type_ = BlotterType.amendment
 
         relevant_blotters = self.blotter_repo.get(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date)
@@ -93,16 +141,44 @@ class TransactionPostedAfterBlotterSent(TransactionValidationRule):
         else:
             # TODO_EH: is it possible / problematic if there are 2+ relevant_blotters?
             return relevant_blotters[0]
+
+    def is_broken_batch(self, frame: pd.DataFrame) -> pd.Series:
+        """ Looks up one blotter per (trade date, settlement criteria) group, rather than one per transaction """
+        # Same assumption as TransactionValidationContext.settlement_criteria: T+1 if TD != SD
+        trade_dates, settle_dates = frame['TradeDate'], frame['SettleDate']
+        if isinstance(trade_dates.dtype, pd.CategoricalDtype) or isinstance(settle_dates.dtype, pd.CategoricalDtype):
+            trade_dates, settle_dates = trade_dates.astype(object), settle_dates.astype(object)  # Categoricals only compare if their categories match
+        t_plus_zero = (trade_dates == settle_dates).fillna(False).astype(bool).rename('t_plus_zero')  # Arrow dates compare as NA to NULLs
+        mask = pd.Series(False, index=frame.index, dtype=bool)
+        for (trade_date, is_t_plus_zero), group in frame.groupby([frame['TradeDate'], t_plus_zero], sort=False, dropna=False):
+            settlement_criteria = BlotterTradeSettlementCriteria.t_plus_zero if is_t_plus_zero else BlotterTradeSettlementCriteria.t_plus_one
+            if pd.isna(trade_date):
+                logging.warning(f'{self}: no TradeDate for {len(group)} transactions; treating them as not broken')
+                continue
+            if isinstance(trade_date, datetime.datetime):
+                trade_date = trade_date.date()  # From a columnar frame's datetime64 column
+            blotter = self.find_blotter(trade_date, settlement_criteria)
+            if blotter is None:
+                logging.warning(f'{self}: no {settlement_criteria.name} blotter found for {trade_date}; treating its {len(group)} transactions as not broken')
+                continue
+            if blotter.status in (BlotterSendStatus.IN_PROGRESS, BlotterSendStatus.SUCCESS):
+                mask.loc[group.index] = True
+        return mask
             
-    def send_alert_for_transaction(self, transaction: Transaction):
+    def send_alert_for_transaction(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
         """ If there are no fail_alert_services, this will do nothing """ 
         
         title = f'Transaction posted after blotter has been sent!'
-        blotter = self.get_relevant_blotter(transaction)
+        blotter = self.get_relevant_blotter(transaction, context)
         body = f"The following transaction was posted: {transaction}   \n{blotter}"
 
-        # If the rule has any alert services, send alerts using them:
-        alert = Alert(title=title, body=body)  # TODO: different body and message?
+        # If the rule has any alert services, send alerts using them.
+        # Alerts for the same rule and blotter may be combined into one digest by the alert service.
+        alert = Alert(title=title, body=body)
+        if blotter:
+            alert.group_key = f'{self}|{blotter.trade_date}|{blotter.settlement_criteria.name}|{blotter.type_.name}'
+            alert.group_summary = str(blotter)
+            alert.detail = str(transaction)
 
         if self.fail_alert_services:
             logging.info(f'{self} sending alert {alert}')
@@ -2,29 +2,210 @@
 # core python
 from dataclasses import dataclass, field
 import logging
-from typing import Any, List
+import threading
+import time
+from typing import Any, List, Literal, Tuple, Union
+
+# pypi
+import pandas as pd
 
 # native
+from application.declarative_rules import TransactionValidationRuleSource
 from application.exceptions import TransactionValidationRuleBrokenException
+from application.validation_contexts import TransactionValidationContext
 from application.validation_rules import TransactionValidationRule
 from domain.models import Transaction
 
 
+@dataclass
+class RuleStats:
+    """ How expensive a rule has been to evaluate, and how often it has been broken """
+    rule: TransactionValidationRule
+    evaluations: int = 0
+    broken: int = 0
+    errors: int = 0  # Evaluations which raised, counted as not broken
+    total_seconds: float = 0.0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.evaluations if self.evaluations else 0.0
+
+    @property
+    def failure_rate(self) -> float:
+        # Smoothed, so rules which have never (or always) been broken still get a sensible estimate
+        return (self.broken + 1) / (self.evaluations + 2)
+
+    @property
+    def cost_per_failure(self) -> float:
+        """ Expected evaluation time spent per broken rule found. Cheapest first minimizes time to the first failure. """
+        return self.mean_seconds / self.failure_rate
+
+    def __str__(self):
+        return (f"{self.rule}: {self.evaluations} evaluations, {self.broken} broken ({self.broken / max(self.evaluations, 1):.1%}), "
+                f"{self.mean_seconds * 1e6:.0f}us mean, {self.total_seconds:.3f}s total"
+                + (f", {self.errors} errors" if self.errors else ''))
+
+
 @dataclass
 class TransactionValidator:
+    """
+    Evaluates rules against a transaction, timing each rule and counting how often it is broken.
+    In 'first_failure' mode, rules are re-ordered every reorder_every validations so that cheap rules which are
+    likely to be broken run first, and validation stops at the first broken rule.
+    In 'all_failures' mode, every rule is evaluated and all broken rules are reported together.
+    Rules from rule_source (e.g. declared in config) are checked for changes before each validation, alongside rules.
+    """
     rules: List[TransactionValidationRule] = field(default_factory=list)
+    rule_source: Union[TransactionValidationRuleSource, None] = None
+    mode: Literal['first_failure', 'all_failures'] = 'first_failure'
+    reorder_every: int = 100  # Validations between re-orderings. 0 keeps the rules in the order given.
+    report_every: int = 1000  # Validations between logging rule stats. 0 never logs them.
+    validations: int = 0
+
+    def __post_init__(self):
+        if self.mode not in ('first_failure', 'all_failures'):
+            raise ValueError(f'{self.cn}: unrecognized mode {self.mode}')
+        self.static_rules = list(self.rules)
+        self.stats = {id(r): RuleStats(r) for r in self.rules}
+        self.ordered_rules = list(self.rules)
+        self.lock = threading.Lock()  # Transactions may be validated from worker threads
+        self.refresh_rules()
 
-    def validate(self, transaction: Transaction):
+    def refresh_rules(self):
+        """ Pick up any changes to rule_source's rules """
+        if self.rule_source is None:
+            return
+        with self.lock:
+            source_rules = self.rule_source.get_rules_if_changed()
+            if source_rules is None:
+                return
+            self.rules = self.static_rules + source_rules
+            self.stats = {id(r): self.stats.get(id(r)) or RuleStats(r) for r in self.rules}
+            if self.reorder_every and self.mode == 'first_failure':
+                self.reorder()
+            else:
+                self.ordered_rules = list(self.rules)
+        logging.info(f'{self.cn}: now validating with {len(self.rules)} rules')
+
+    @property
+    def required_fields(self) -> Union[Tuple[str, ...], None]:
+        """ Fields the current rules read, or None if any rule doesn't declare its required_fields. Call refresh_rules first for the latest. """
+        fields = []
         for rule in self.rules:
-            logging.info(f'Checking rule {rule}')
-            if rule.is_broken(transaction):
-                raise TransactionValidationRuleBrokenException(rule, transaction)
+            if rule.required_fields is None:
+                return None
+            fields.extend(rule.required_fields)
+        return tuple(dict.fromkeys(fields))
+
+    def validate(self, transaction: Transaction, context: Union[TransactionValidationContext, None]=None):
+        # One context per transaction, shared by every rule (and the alert path, via the exception)
+        if context is None:
+            context = TransactionValidationContext(transaction)
+        self.refresh_rules()
+        broken_rules = []
+        timings = []
+        try:
+            for rule in self.ordered_rules:
+                logging.debug(f'Checking rule {rule}')
+                start = time.perf_counter()
+                try:
+                    is_broken, error = rule.is_broken(transaction, context), False
+                except Exception as e:
+                    # One broken rule (e.g. a bad config value) mustn't stop the others from being checked
+                    self.log_rule_error(rule, f'{transaction}', e)
+                    is_broken, error = False, True
+                timings.append((rule, time.perf_counter() - start, is_broken, error))
+                if is_broken:
+                    broken_rules.append(rule)
+                    if self.mode == 'first_failure':
+                        break
+        finally:
+            self.record(timings)
+        if broken_rules:
+            raise TransactionValidationRuleBrokenException(broken_rules[0], transaction, context, broken_rules)
+
+    def validate_batch(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Validate many transactions (one per row of the frame) in one pass, using each rule's is_broken_batch.
+        In 'first_failure' mode, each rule is only evaluated on rows which no earlier rule found broken.
+
+        :returns: Boolean frame with the same index as the input and one column per rule, True where that rule is broken.
+            Columns are keyed by each rule's position in results.attrs['rules'] (the rules at the time), rather than by
+            name, so rules which share a name don't overwrite each other.
+        """
+        self.refresh_rules()
+        with self.lock:
+            rules, ordered_rules = list(self.rules), list(self.ordered_rules)
+        positions = {id(r): i for i, r in enumerate(rules)}
+        results = pd.DataFrame(index=frame.index, columns=range(len(rules)), dtype=bool)
+        results.attrs['rules'] = rules
+        remaining = frame
+        timings = []
+        for rule in ordered_rules:
+            start = time.perf_counter()
+            try:
+                mask, errors = rule.is_broken_batch(remaining).fillna(False).astype(bool), 0
+            except Exception as e:
+                self.log_rule_error(rule, f'{len(remaining)} transactions', e)
+                mask, errors = pd.Series(False, index=remaining.index, dtype=bool), len(remaining)
+            seconds = time.perf_counter() - start
+            timings.append((rule, seconds, len(remaining), int(mask.sum()), errors))
+            logging.info(f'{self.cn}: rule {rule} broken for {int(mask.sum())} of {len(remaining)} transactions ({seconds:.3f}s)')
+            results[positions[id(rule)]] = mask.reindex(frame.index, fill_value=False)
+            if self.mode == 'first_failure':
+                remaining = remaining[~mask]
+        self.record_batch(timings)
+        return results
+
+    def record(self, timings: List[Any]):
+        with self.lock:
+            for rule, seconds, is_broken, error in timings:
+                s = self.stats.get(id(rule))
+                if s is None:
+                    continue  # Rule removed by refresh_rules while being evaluated
+                s.evaluations += 1
+                s.total_seconds += seconds
+                s.broken += is_broken
+                s.errors += error
+            self.validations += 1
+            if self.reorder_every and self.mode == 'first_failure' and self.validations % self.reorder_every == 0:
+                self.reorder()
+            report = self.report_every and self.validations % self.report_every == 0
+        if report:
+            logging.info(self.stats_report())
+
+    def record_batch(self, timings: List[Any]):
+        with self.lock:
+            for rule, seconds, evaluations, broken, errors in timings:
+                s = self.stats.get(id(rule))
+                if s is None:
+                    continue  # Rule removed by refresh_rules while being evaluated
+                s.evaluations += evaluations
+                s.total_seconds += seconds
+                s.broken += broken
+                s.errors += errors
+
+    def log_rule_error(self, rule: TransactionValidationRule, subject: str, e: Exception):
+        """ Log a rule which raised, with the traceback only the first time, since it will likely keep raising """
+        s = self.stats.get(id(rule))
+        if s is None or not s.errors:
+            logging.exception(f'{self.cn}: rule {rule} raised on {subject}; treating it as not broken: {e}')
+        else:
+            logging.warning(f'{self.cn}: rule {rule} raised on {subject} ({s.errors} errors so far); treating it as not broken: {e}')
+
+    def reorder(self):
+        """ Order rules by expected cost per failure found. Callers must hold the lock. """
+        ordered_rules = sorted(self.rules, key=lambda r: self.stats[id(r)].cost_per_failure)
+        if ordered_rules != self.ordered_rules:
+            logging.info(f"{self.cn}: re-ordered rules to {', '.join([str(r) for r in ordered_rules])}")
+            self.ordered_rules = ordered_rules  # Replaced rather than mutated, since other threads may be iterating it
+
+    def stats_report(self) -> str:
+        return f"{self.cn} rule stats after {self.validations} validations:\n" + '\n'.join([f'  {self.stats[id(r)]}' for r in self.ordered_rules])
 
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
         return type(self).__name__
-    
-    def __str__(self):
-        return f"{self.cn}, validating transaction rules: {', '.join([str(vr) for vr in self.rules])}"
-
 
+    def __str__(self):
+        return f"{self.cn} ({self.mode}), validating transaction rules: {', '.join([str(vr) for vr in self.rules])}"
@@ -0,0 +1,85 @@
+
+# core python
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# native
+from infrastructure.message_decoders import DebeziumTransactionDecoder, FastDebeziumTransactionDecoder
+
+
+
+
+def sample_record(i: int, comment: bool=False) -> dict:
+    """ A vPortfolioTransaction-shaped row, as Debezium would publish it (dates as days since 1970-01-01) """
+    record = {
+        'PortfolioTransactionID': 1000000 + i, 'PortfolioID': 100 + i % 250, 'TranID': i, 'TransactionCode': ';' if comment else 'by',
+        'TradeDate': 19800 + i % 30, 'SettleDate': 19801 + i % 30, 'OriginalTradeDate': 19800 + i % 30, 'PostDate': 19802 + i % 30,
+        'SecurityID1': 5000 + i % 900, 'SecurityID2': None, 'Quantity': str(random.randint(1, 100000)), 'TradeAmount': '12345.67',
+        'Comment': f'Comment {i}' if comment else None, 'CustodianID': 7, 'BrokerFirmID': 42, 'IsCancel': False,
+    }
+    # Pad out to roughly the width of the real view
+    record.update({f'UserDef{n}': None for n in range(40)})
+    return record
+
+
+def sample_payloads(count: int) -> list:
+    """ Mix of creates, updates, deletes, comments and snapshot reads (an ignored op) """
+    payloads = []
+    for i in range(count):
+        comment = (i % 10 == 0)
+        op = ['c', 'c', 'c', 'u', 'd', 'r'][i % 6]
+        before = sample_record(i, comment) if op in ('u', 'd') else None
+        after = sample_record(i, comment) if op in ('c', 'u', 'r') else None
+        payloads.append(json.dumps({'schema': None, 'payload': {'op': op, 'before': before, 'after': after}}).encode('utf-8'))
+    return payloads
+
+
+def benchmark(decoder, payloads: list, rounds: int) -> float:
+    """ Returns messages/sec """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for p in payloads:
+            decoder.decode(p)
+    return (len(payloads) * rounds) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Debezium transaction decoder micro-benchmark')
+    parser.add_argument('--payload_file', '-f', type=str, help='File of recorded message values, one JSON message per line. Synthetic payloads are used if not provided.')
+    parser.add_argument('--count', '-n', type=int, default=5000, help='Number of synthetic payloads')
+    parser.add_argument('--rounds', '-r', type=int, default=5, help='Number of passes over the payloads')
+
+    args = parser.parse_args()
+
+    if args.payload_file:
+        with open(args.payload_file, 'rb') as f:
+            payloads = [line.strip() for line in f if line.strip()]
+    else:
+        payloads = sample_payloads(args.count)
+
+    decoders = [DebeziumTransactionDecoder(), FastDebeziumTransactionDecoder(json_backend='json')]
+    try:
+        decoders.append(FastDebeziumTransactionDecoder(json_backend='orjson'))
+    except RuntimeError as e:
+        print(f'Skipping orjson: {e}')
+
+    print(f'Decoding {len(payloads)} payloads x {args.rounds} rounds')
+    baseline = None
+    for decoder in decoders:
+        rate = benchmark(decoder, payloads, args.rounds)
+        baseline = baseline or rate
+        backend = decoder.loads.__module__ if hasattr(decoder, 'loads') else 'json'
+        print(f'{decoder.cn:<32} {backend:<8} {rate:>12,.0f} msgs/sec  ({rate / baseline:.2f}x)')
+
+
+
+if __name__ == '__main__':
+    main()
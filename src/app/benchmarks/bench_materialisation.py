@@ -0,0 +1,169 @@
+
+# core python
+import argparse
+from dataclasses import dataclass
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# pypi
+import pandas as pd
+from sqlalchemy import MetaData, create_engine, text
+
+# native
+from benchmarks.bench_transaction_memory import sample_rows
+from domain.models import Transaction
+from infrastructure.util.database import BaseDB, _convert_to_df
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+
+QUERY = 'SELECT * FROM vPortfolioTransaction_LW_Funds'
+
+
+@dataclass
+class SQLiteDB(BaseDB):
+    """ BaseDB over a SQLite file, so the benchmark needs no database server """
+    path: str = ''
+
+    def __post_init__(self):
+        self.engine = create_engine(f'sqlite:///{self.path}')
+        self.meta = MetaData()
+
+
+def convert_to_df_per_cell(rows, description):
+    """ The previous _convert_to_df: appends each value to its column's list, checking every row's length """
+    columns = [col_description[0] for col_description in description]
+    df_dict = {}
+    for column in columns:
+        df_dict[column] = []
+    for row in rows:
+        assert len(row) == len(columns)
+        for i, val in enumerate(row):
+            df_dict[columns[i]].append(val)
+    return pd.DataFrame(df_dict)
+
+
+def frame_to_dict_records(db: SQLiteDB) -> int:
+    """ Cursor -> DataFrame -> to_dict('records') -> Transaction(**record) """
+    records = [Transaction(**r) for r in db.execute_read(text(QUERY)).to_dict('records')]
+    return len(records)
+
+
+def frame_to_tuple_records(db: SQLiteDB) -> int:
+    """ Cursor -> DataFrame -> itertuples -> compact Transaction from_values """
+    frame = db.execute_read(text(QUERY))
+    transaction_class = Transaction.with_fields(frame.columns)
+    records = [transaction_class.from_values(row) for row in frame.itertuples(index=False, name=None)]
+    return len(records)
+
+
+def columnar_frame(db: SQLiteDB) -> int:
+    """ Cursor -> DataFrame with natively typed columns (execute_read's columnar mode), held as is """
+    frame = db.execute_read(text(QUERY), columnar=True)
+    return len(frame)
+
+
+def direct_records(db: SQLiteDB) -> int:
+    """ Cursor -> compact Transaction from_values, via BaseDB.execute_read_records """
+    return len(db.execute_read_records(text(QUERY), Transaction))
+
+
+def streamed_records(db: SQLiteDB) -> int:
+    """ As direct_records, but streamed 10000 rows at a time and not held """
+    return sum(1 for _ in db.execute_read_records(text(QUERY), Transaction, chunk_size=10000))
+
+
+def multi_query_per_cell(db: SQLiteDB) -> int:
+    cursor = sqlite3.connect(db.path).execute(QUERY)
+    return len(convert_to_df_per_cell(cursor.fetchall(), cursor.description))
+
+
+def multi_query_columnar(db: SQLiteDB) -> int:
+    cursor = sqlite3.connect(db.path).execute(QUERY)
+    return len(_convert_to_df(cursor.fetchall(), cursor.description))
+
+
+PATHS = {
+    'frame_to_dict_records': frame_to_dict_records,
+    'frame_to_tuple_records': frame_to_tuple_records,
+    'columnar_frame': columnar_frame,
+    'direct_records': direct_records,
+    'streamed_records': streamed_records,
+    'multi_query_per_cell': multi_query_per_cell,
+    'multi_query_columnar': multi_query_columnar,
+}
+
+
+def peak_memory_mb() -> float:
+    """ Peak RSS of this process so far, or if that isn't available, peak memory traced by tracemalloc """
+    if resource is None:
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1e6 if sys.platform == 'darwin' else max_rss / 1e3  # Bytes on macOS, KB elsewhere
+
+
+def create_sample_db(path: str, count: int, width: int):
+    """ A table shaped like APXDBvPortfolioTransactionLWFundsView """
+    frame = pd.DataFrame(sample_rows(count, width))
+    for column in ('Quantity', 'TradeAmount'):
+        frame[column] = frame[column].astype(float)  # SQLite has no decimal type
+    with sqlite3.connect(path) as connection:
+        frame.to_sql('vPortfolioTransaction_LW_Funds', connection, index=False)
+
+
+def run_path(path_name: str, db_path: str):
+    """ Run one path in this (fresh) process, so its peak RSS isn't inflated by the others """
+    if resource is None:
+        tracemalloc.start()
+    db = SQLiteDB(config_section='benchmark', path=db_path)
+    baseline = peak_memory_mb()
+    start = time.perf_counter()
+    count = PATHS[path_name](db)
+    elapsed = time.perf_counter() - start
+    peak = peak_memory_mb()
+    print(f'{path_name:<24} {count / elapsed:>12,.0f} rows/s  {peak:>8.1f} MB peak  {peak - baseline:>8.1f} MB above baseline')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query result materialisation benchmark: rows/sec and peak RSS per path')
+    parser.add_argument('--count', '-n', type=int, default=200000, help='Number of transactions')
+    parser.add_argument('--width', '-w', type=int, default=60, help='Number of columns per transaction')
+    parser.add_argument('--path', '-p', type=str, choices=list(PATHS), help='Run only this path, against --db_path')
+    parser.add_argument('--db_path', '-d', type=str, help='SQLite file to read (used with --path) or create (with --create)')
+    parser.add_argument('--create', '-c', action='store_true', help='Only create the SQLite file')
+
+    args = parser.parse_args()
+
+    if args.create:
+        create_sample_db(args.db_path, args.count, args.width)
+        return
+    if args.path:
+        run_path(args.path, args.db_path)
+        return
+
+    # Every step runs in its own process, since on Linux a child's peak RSS starts from its parent's at the time it was forked
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'bench_materialisation.db')
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--create', '--db_path', db_path, '--count', str(args.count)
+                            , '--width', str(args.width)], check=True)
+        print(f'Materialising {args.count} transactions of {args.width} columns'
+                f'{"" if resource else " (peak is traced Python memory, as RSS is not available)"}')
+        for path_name in PATHS:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--path', path_name, '--db_path', db_path], check=True)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+
+# core python
+import argparse
+import datetime
+from decimal import Decimal
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# native
+from domain.models import Transaction
+
+
+
+
+class NamespaceTransaction(SimpleNamespace):
+    """ The previous Transaction representation: a SimpleNamespace with a per-instance __dict__ """
+    def __str__(self):
+        return f"{self.TransactionCode} of {self.Quantity} units of {self.SecurityID1} in {self.PortfolioID} on {self.TradeDate}"
+
+
+def sample_rows(count: int, width: int) -> list:
+    """ Rows shaped like APXDBvPortfolioTransactionLWFundsView query results """
+    trade_date = datetime.date(2024, 3, 18)
+    rows = []
+    for i in range(count):
+        row = {
+            'PortfolioTransactionID': 1000000 + i, 'PortfolioID': 100 + i % 250, 'PortfolioCode': f'LW{i % 250:04d}',
+            'TransactionCode': 'by', 'TradeDate': trade_date, 'SettleDate': trade_date + datetime.timedelta(days=i % 2),
+            'SecurityID1': 5000 + i % 900, 'Quantity': Decimal(i % 1000), 'TradeAmount': Decimal('12345.67'),
+        }
+        row.update({f'Column{n}': None for n in range(width - len(row))})
+        rows.append(row)
+    return rows
+
+
+def measure(label: str, build):
+    """ Report time and memory allocated building records, excluding the row values themselves (shared by both) """
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<40} {elapsed:>7.2f}s  {current / 1e6:>8.1f} MB retained  {peak / 1e6:>8.1f} MB peak  '
+            f'{current / len(records):>7.0f} bytes/record')
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transaction representation memory/allocation benchmark')
+    parser.add_argument('--count', '-n', type=int, default=100000, help='Number of transactions')
+    parser.add_argument('--width', '-w', type=int, default=60, help='Number of columns per transaction')
+
+    args = parser.parse_args()
+
+    rows = sample_rows(args.count, args.width)
+    print(f'Building {args.count} transactions of {args.width} columns')
+
+    old = measure('SimpleNamespace Transaction(**row)', lambda: [NamespaceTransaction(**r) for r in rows])
+    del old
+
+    transaction_class = Transaction.with_fields(rows[0].keys())
+    new = measure('Compact Transaction layout(**row)', lambda: [transaction_class(**r) for r in rows])
+    del new
+
+    values = [tuple(r.values()) for r in rows]
+    new = measure('Compact Transaction from_values(row)', lambda: [transaction_class.from_values(v) for v in values])
+    del new
+
+
+
+if __name__ == '__main__':
+    main()
@@ -6,15 +6,18 @@ import json
 import logging
 import os
 import sys
+from typing import Union
 
 # Append to pythonpath
 src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(src_dir)
 
 # native
-from application.exceptions import TransactionCountMismatchException
+from application.exceptions import TransactionCountMismatchException, TransactionCountQueryFailedException
 from application.query_handlers import TransactionCountComparator
+from application.reconcilers import TransactionReconciler
 from domain.models import BlotterTradeSettlementCriteria
+from infrastructure.reports import write_reconciliation_report
 from infrastructure.services import MSTeamsAlertService
 from infrastructure.sql_repositories import APXDBTransactionRepository, LWDBBONASentTransactionRepository, APXDBFABlotterV2Repository
 from infrastructure.util.config import AppConfig
@@ -23,16 +26,84 @@ from infrastructure.util.logging import setup_logging
 
 
 
+def reconcile(repos, trade_date: datetime.date, settlement_criteria: BlotterTradeSettlementCriteria, report_path: Union[str, None]=None):
+    """ List which transactions are missing or mismatched in each repo, in a report file """
+    key_fields = tuple([f.strip() for f in AppConfig().get('reconciliation', 'key_fields', fallback='PortfolioCode,TradeDate,Quantity').split(',')])
+    compare_fields = tuple([f.strip() for f in AppConfig().get('reconciliation', 'compare_fields', fallback='SettleDate').split(',') if f.strip()])
+    chunk_size = AppConfig().getint('reconciliation', 'chunk_size', fallback=10000)
+    reconciler = TransactionReconciler(repos=repos, key_fields=key_fields, compare_fields=compare_fields, chunk_size=chunk_size)
+    differences = reconciler.reconcile(trade_date=trade_date, settlement_criteria=settlement_criteria)
+    report_path = report_path or os.path.join(AppConfig().get("logging", "base_dir"), f'reconciliation_{trade_date:%Y%m%d}_{settlement_criteria.name}.csv')
+    write_reconciliation_report(differences, key_fields, report_path)
+    logging.info(f"Reconciliation found {len(differences)} differences; see {report_path}")
+
+
+def compare_one(comparator: TransactionCountComparator, trade_date: datetime.date, settlement_criteria: BlotterTradeSettlementCriteria, args):
+    logging.info(f"Comparing transaction counts for {trade_date} {settlement_criteria.name} between the following repositories: {', '.join([r.cn for r in comparator.repos])}")
+
+    try:
+        comparator.compare(trade_date=trade_date, settlement_criteria=settlement_criteria)
+        logging.info(f"Comparison passed.")
+    except TransactionCountMismatchException as e:
+        readable_dict = {str(k): v for k, v in e.repos_counts.items()}
+        logging.info(f"Comparison failed due to differences in counts: {json.dumps(readable_dict, indent=4)}")
+    except TransactionCountQueryFailedException as e:
+        readable_dict = {str(k): v for k, v in e.repos_counts.items()}
+        readable_dict.update({str(k): f'FAILED: {v}' for k, v in e.repos_errors.items()})
+        logging.error(f"Comparison incomplete, since {len(e.repos_errors)} repositories could not be counted: {json.dumps(readable_dict, indent=4)}")
+
+    if args.reconcile:
+        reconcile(comparator.repos, trade_date, settlement_criteria, args.report_path)
+
+
+def compare_range(comparator: TransactionCountComparator, start_date: datetime.date, end_date: datetime.date, settlement_criterias, args):
+    logging.info(f"Comparing transaction counts from {start_date} to {end_date} for {', '.join([sc.name for sc in settlement_criterias])} "
+                    f"between the following repositories: {', '.join([r.cn for r in comparator.repos])}")
+    matrix = comparator.compare_range(start_date=start_date, end_date=end_date, settlement_criterias=settlement_criterias)
+
+    # Per-date pass/fail matrix. Repos which couldn't be counted show ERROR, as do the results depending on them.
+    header = f"{'TradeDate':<12}{'Settlement':<14}" + ''.join([f'{r.cn:>36}' for r in comparator.repos]) + '  Result'
+    lines = [header]
+    for c in matrix.comparisons:
+        lines.append(f"{c.trade_date.isoformat():<12}{c.settlement_criteria.name:<14}"
+                        + ''.join([f"{c.repos_counts.get(r, 'ERROR'):>36}" for r in comparator.repos]) + f"  {c.status}")
+    logging.info('Comparison matrix:\n' + '\n'.join(lines))
+
+    for repo, error in matrix.repos_errors.items():
+        logging.error(f"{repo} could not be counted, so every result is ERROR: {error}")
+    if matrix.failed:
+        logging.info(f"Comparison failed for {len(matrix.failed)} of {len(matrix.comparisons)} dates/settlement criteria: "
+                        f"{', '.join([f'{c.trade_date} {c.settlement_criteria.name}' for c in matrix.failed])}")
+    elif not matrix.repos_errors:
+        logging.info(f"Comparison passed for all {len(matrix.comparisons)} dates/settlement criteria.")
+
+    if args.reconcile:
+        repos = [r for r in comparator.repos if r not in matrix.repos_errors]
+        for c in matrix.failed:
+            reconcile(repos, c.trade_date, c.settlement_criteria)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Transaction count comparator')
-    parser.add_argument('--trade_date', '-td', type=str, required=True, help='Trade date, YYYYMMDD format')
-    parser.add_argument('--settlement_criteria', '-sc', type=int, choices=[0, 1], required=True, help='0 for T+0, 1 for T+1')
+    parser.add_argument('--trade_date', '-td', type=str, help='Trade date, YYYYMMDD format')
+    parser.add_argument('--start_date', '-sd', type=str, help='First trade date of a range, YYYYMMDD format')
+    parser.add_argument('--end_date', '-ed', type=str, help='Last trade date of a range (inclusive), YYYYMMDD format. Defaults to start_date.')
+    parser.add_argument('--settlement_criteria', '-sc', type=int, choices=[0, 1], help='0 for T+0, 1 for T+1. If not provided, compare both.')
+    parser.add_argument('--reconcile', '-r', action='store_true', help='Also list which transactions are missing or mismatched in each repository')
+    parser.add_argument('--report_path', '-rp', type=str, help='Reconciliation report path for a single date; .csv or .parquet. Defaults to a CSV in the log folder.')
     parser.add_argument('--log_level', '-l', type=str.upper, choices=['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help='Log level')
     
     args = parser.parse_args()
+    if not (args.trade_date or args.start_date):
+        parser.error('Provide --trade_date, or --start_date (and optionally --end_date)')
 
-    trade_date = datetime.datetime.strptime(args.trade_date, '%Y%m%d').date()
-    settlement_criteria = BlotterTradeSettlementCriteria.t_plus_one if args.settlement_criteria else BlotterTradeSettlementCriteria.t_plus_zero
+    parse_date = lambda d: datetime.datetime.strptime(d, '%Y%m%d').date()
+    start_date = parse_date(args.start_date or args.trade_date)
+    end_date = parse_date(args.end_date) if args.end_date else start_date
+    if args.settlement_criteria is None:
+        settlement_criterias = tuple(BlotterTradeSettlementCriteria)
+    else:
+        settlement_criterias = (BlotterTradeSettlementCriteria.t_plus_one if args.settlement_criteria else BlotterTradeSettlementCriteria.t_plus_zero,)
     
     repos = [
         APXDBTransactionRepository(),
@@ -42,18 +113,18 @@ def main():
 
     comparator = TransactionCountComparator(
         repos=repos
+        , max_workers=AppConfig().getint('comparator', 'max_workers', fallback=4)
+        , timeout_seconds=AppConfig().getfloat('comparator', 'timeout_seconds', fallback=300.0)
     )
     base_dir = AppConfig().get("logging", "base_dir")
     os.environ['APP_NAME'] = AppConfig().get("app_name", "fa_blotter_txn_counts_comparator")
     setup_logging(base_dir=base_dir, log_level_override=args.log_level)
-    logging.info(f"Comparing transaction counts for {trade_date} {settlement_criteria.name} between the following repositories: {', '.join([r.cn for r in repos])}")
 
-    try:
-        comparator.compare(trade_date=trade_date, settlement_criteria=settlement_criteria)
-        logging.info(f"Comparison passed.")
-    except TransactionCountMismatchException as e:
-        readable_dict = {str(k): v for k, v in e.repos_counts.items()}
-        logging.info(f"Comparison failed due to differences in counts: {json.dumps(readable_dict, indent=4)}")
+    if start_date == end_date and len(settlement_criterias) == 1:
+        compare_one(comparator, start_date, settlement_criterias[0], args)
+    else:
+        # One query per repo for the whole range, rather than one per date per settlement criteria
+        compare_range(comparator, start_date, end_date, settlement_criterias, args)
 
 
 
@@ -11,42 +11,100 @@ sys.path.append(src_dir)
 
 # native
 from application.event_handlers import TransactionEventHandler
-from application.validation_rules import TransactionQuantityMax100, TransactionPostedAfterBlotterSent
+from application.validation_rules import TransactionNotFoundInLZ, TransactionQuantityMax100, TransactionPostedAfterBlotterSent
 from application.validators import TransactionValidator
 from infrastructure.file_repositories import FABlotterV1BlotterRepository
 from infrastructure.message_subscribers import KafkaAPXTransactionMessageConsumer
-from infrastructure.services import MSTeamsAlertService
-from infrastructure.sql_repositories import MGMTDBHeartbeatRepository
+from infrastructure.rule_sources import ConfigTransactionValidationRuleSource
+from infrastructure.services import DigestAlertService, MSTeamsAlertService, QueuedAlertService
+from infrastructure.sql_repositories import APXDBIdentifierRepository, MGMTDBHeartbeatRepository
+from infrastructure.transaction_indexes import LZDBTransactionIndex
 from infrastructure.util.config import AppConfig
 from infrastructure.util.logging import setup_logging
+from infrastructure.util.processes import ProcessSupervisor, report_stats
 
 
 
 
+def build_consumer():
+    # Shared by the coded rules and those declared in config
+    fail_alert_services = [DigestAlertService.from_config(QueuedAlertService.from_config(
+        MSTeamsAlertService(AppConfig().get('transaction_posted_after_blotter_sent', 'ms_teams_webhook_url'))
+    ))]
+    rules = [
+        TransactionQuantityMax100(),
+        TransactionPostedAfterBlotterSent(
+            blotter_repo=FABlotterV1BlotterRepository(),
+            fail_alert_services=fail_alert_services
+        )
+    ]
+    if AppConfig().getboolean('lz_index', 'enabled', fallback=False):  # Needs the [lzdb] landing zone database
+        rules.append(TransactionNotFoundInLZ(lz_index=LZDBTransactionIndex.from_config(), identifier_repo=APXDBIdentifierRepository()
+                                                , fail_alert_services=fail_alert_services))
+    return KafkaAPXTransactionMessageConsumer(
+        event_handler = TransactionEventHandler(
+            validator=TransactionValidator(rules, rule_source=ConfigTransactionValidationRuleSource(fail_alert_services=fail_alert_services)
+            , mode=AppConfig().get('validation', 'mode', fallback='first_failure')
+            , reorder_every=AppConfig().getint('validation', 'reorder_every', fallback=100)
+            , report_every=AppConfig().getint('validation', 'report_every', fallback=1000))
+        )
+        , heartbeat_repo = MGMTDBHeartbeatRepository()
+    )
+
+
+def run_consumer(args, app_name: str):
+    """ Build a consumer and consume until interrupted, logging to a file named after app_name """
+    base_dir = AppConfig().get("logging", "base_dir")
+    os.environ['APP_NAME'] = app_name
+    setup_logging(base_dir=base_dir, log_level_override=args.log_level)
+    kafka_consumer = build_consumer()
+    logging.info(f'Consuming transactions...')
+    kafka_consumer.consume(reset_offset=args.reset_offset)
+
+
+def run_consumer_child(child_index: int, stats_queue, args, base_app_name: str):
+    """ Entry point for each child process when running with --processes. Each child gets its own log file and heartbeat name. """
+    base_dir = AppConfig().get("logging", "base_dir")
+    os.environ['APP_NAME'] = f'{base_app_name}_{child_index}'
+    setup_logging(base_dir=base_dir, log_level_override=args.log_level)
+    kafka_consumer = build_consumer()
+    report_stats(stats_queue, child_index, get_stats=lambda: {
+        'processed': kafka_consumer.messages_processed, 
+        'last_message_time': kafka_consumer.last_message_time
+    })
+    logging.info(f'Consuming transactions as child {child_index}...')
+    kafka_consumer.consume(reset_offset=args.reset_offset)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Kafka Consumer')
     parser.add_argument('--reset_offset', '-ro', action='store_true', default=False, help='Reset consumer offset to beginning')
     parser.add_argument('--log_level', '-l', type=str.upper, choices=['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help='Log level')
+    parser.add_argument('--processes', '-p', type=int, default=AppConfig().getint('kafka_consumer_lw', 'processes', fallback=1), 
+                            help='Number of consumer processes to run in the same consumer group')
     
     args = parser.parse_args()
 
-    kafka_consumer = KafkaAPXTransactionMessageConsumer(
-        event_handler = TransactionEventHandler(
-            validator=TransactionValidator([
-                TransactionQuantityMax100(),
-                TransactionPostedAfterBlotterSent(
-                    blotter_repo=FABlotterV1BlotterRepository(),
-                    fail_alert_services=[MSTeamsAlertService(AppConfig().get('transaction_posted_after_blotter_sent', 'ms_teams_webhook_url'))]
-                )
-            ])
-        )
-        , heartbeat_repo = MGMTDBHeartbeatRepository()
-    )
+    app_name = AppConfig().get("app_name", "fa_blotter_txn_validation")
+    if args.processes <= 1:
+        run_consumer(args, app_name=app_name)
+        return
+
+    # Supervise child consumer processes, logging to the base app name's log file
     base_dir = AppConfig().get("logging", "base_dir")
-    os.environ['APP_NAME'] = AppConfig().get("app_name", "fa_blotter_txn_validation")
+    os.environ['APP_NAME'] = app_name
     setup_logging(base_dir=base_dir, log_level_override=args.log_level)
-    logging.info(f'Consuming transactions...')
-    kafka_consumer.consume(reset_offset=args.reset_offset)
+    logging.info(f'Launching {args.processes} consumer processes...')
+    supervisor = ProcessSupervisor(
+        target=run_consumer_child, 
+        process_count=args.processes, 
+        args=(args, app_name),
+        restart_delay_seconds=AppConfig().getfloat('kafka_consumer_lw', 'process_restart_delay_seconds', fallback=5.0),
+        max_restart_delay_seconds=AppConfig().getfloat('kafka_consumer_lw', 'process_max_restart_delay_seconds', fallback=300.0),
+        stable_seconds=AppConfig().getfloat('kafka_consumer_lw', 'process_stable_seconds', fallback=300.0),
+        summary_interval_seconds=AppConfig().getfloat('kafka_consumer_lw', 'process_summary_interval_seconds', fallback=60.0),
+    )
+    supervisor.run()
 
 
 
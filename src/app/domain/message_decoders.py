@@ -0,0 +1,22 @@
+
+# core python
+from abc import ABC, abstractmethod
+from typing import Union
+
+# native
+from domain.events import Event
+
+
+class MessageDecoder(ABC):
+    """ Base class for decoders which turn raw message bytes into domain events """
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    @abstractmethod
+    def decode(self, message_value: bytes) -> Union[Event, None]:
+        """ 
+        Decoders must turn message bytes into an Event.
+        Returning None (rather than an Event) signifies that there is no Event to handle.
+        """
+
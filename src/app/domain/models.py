@@ -3,22 +3,124 @@
 from dataclasses import dataclass, field
 import datetime
 from enum import Enum
-from types import SimpleNamespace
-from typing import Literal
+import logging
+from operator import itemgetter
+import string
+from typing import Callable, FrozenSet, Iterable, Literal, Tuple, Union
+
+
+class CompactRecord(tuple):
+    """
+    Compact, tuple-backed record which facilitates object instance creation from dict.
+    Fields in the class's layout are stored by position (use with_fields to get a class for a particular 
+    column layout, e.g. from a view schema). Any other fields go in an overflow dict, stored as the last element.
+    Layout fields which were not provided are None.
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _field_set: FrozenSet[str] = frozenset()
+    _getter: Union[Callable, None] = None  # Gets all layout fields from a dict, in layout order
+
+    def __new__(cls, **kwargs):
+        if cls._getter and len(kwargs) == len(cls._fields) and cls._field_set.issuperset(kwargs):
+            # Fast path: exactly the layout's fields
+            return tuple.__new__(cls, (*cls._getter(kwargs), None))
+        overflow = {k: v for k, v in kwargs.items() if k not in cls._field_set}
+        return tuple.__new__(cls, (*map(kwargs.get, cls._fields), overflow or None))
 
+    @classmethod
+    def from_values(cls, values: Iterable, overflow: Union[dict, None]=None):
+        """ Create an instance from values in layout order, without going through a dict """
+        return tuple.__new__(cls, (*values, overflow))
+
+    @classmethod
+    def with_fields(cls, fields: Iterable[str]):
+        """ Get the subclass of this record type which stores the provided fields by position """
+        if cls._fields:
+            cls = cls.__base__  # Layouts are always built from the record type itself
+        fields = tuple(fields)
+        key = (cls, fields)
+        if key not in _RECORD_LAYOUTS:
+            attrs = {
+                '__slots__': (),
+                '_fields': fields,
+                '_field_set': frozenset(fields),
+                '_getter': itemgetter(*fields) if len(fields) > 1 else None,
+            }
+            hidden = []
+            for i, f in enumerate(fields):
+                # Fields which aren't identifiers, or which clash with existing attributes, are still available via to_dict
+                if isinstance(f, str) and f.isidentifier() and not hasattr(cls, f):
+                    attrs[f] = property(itemgetter(i))
+                elif isinstance(f, str) and f.isidentifier():
+                    hidden.append(f)
+            if hidden:
+                # e.g. a column named count or index would otherwise silently resolve to the tuple method
+                logging.warning(f'{cls.__name__} fields {hidden} clash with existing attributes, so are only available via to_dict')
+            _RECORD_LAYOUTS[key] = type(cls.__name__, (cls,), attrs)
+        return _RECORD_LAYOUTS[key]
+
+    def __getattr__(self, name):
+        # Only reached for fields not in the layout
+        overflow = tuple.__getitem__(self, -1)
+        if overflow is not None and name in overflow:
+            return overflow[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def to_dict(self) -> dict:
+        """ Export an instance to dict format """
+        d = dict(zip(self._fields, self))
+        overflow = tuple.__getitem__(self, -1)
+        if overflow:
+            d.update(overflow)
+        return d
+
+    def __eq__(self, other):
+        if isinstance(other, CompactRecord):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = None  # Mutable overflow; like SimpleNamespace, instances are not hashable
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join([f'{k}={v!r}' for k, v in self.to_dict().items()])})"
 
-class Transaction(SimpleNamespace):
+    def __reduce__(self):
+        cls = type(self)
+        record_type = cls.__base__ if cls._fields else cls
+        return (_restore_record, (record_type, cls._fields, tuple(self)))
+
+
+_RECORD_LAYOUTS = {}  # (record type, fields) -> layout class
+
+
+def _restore_record(record_type, fields, values):
+    layout = record_type.with_fields(fields) if fields else record_type
+    return tuple.__new__(layout, values)
+
+
+class Transaction(CompactRecord):
     """ Facilitates object instance creation from dict """
+    __slots__ = ()
+    display_format: str = '{TransactionCode} of {Quantity} units of {SecurityID1} in {PortfolioID} on {TradeDate}'  # Used by __str__
+    display_fields: Tuple[str, ...] = tuple([f for _, f, _, _ in string.Formatter().parse(display_format) if f])
+
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
         return type(self).__name__
 
     def __str__(self):
-        return f"{self.TransactionCode} of {self.Quantity} units of {self.SecurityID1} in {self.PortfolioID} on {self.TradeDate}"
+        return self.display_format.format(**{f: getattr(self, f) for f in self.display_fields})
         
 
-class TransactionComment(SimpleNamespace):
+class TransactionComment(CompactRecord):
     """ Facilitates object instance creation from dict """
+    __slots__ = ()
+
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
         return type(self).__name__
@@ -96,4 +198,7 @@ class Heartbeat:
 class Alert:
     title: str
     body: str
+    group_key: Union[str, None] = None  # Alerts with the same group key may be combined into one digest alert
+    group_summary: Union[str, None] = None  # Describes the group, e.g. the blotter, once per digest
+    detail: Union[str, None] = None  # This alert's own line in a digest, e.g. the transaction
 
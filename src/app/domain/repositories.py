@@ -2,7 +2,7 @@
 # core python
 from abc import ABC, abstractmethod
 import datetime
-from typing import List, Union
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
 
 # native
 from domain.models import Heartbeat, Transaction, Blotter, BlotterTradeSettlementCriteria, BlotterType
@@ -18,6 +18,14 @@ class HeartbeatRepository(ABC):
     def get(self, data_date: Union[datetime.date,None]=None, group: Union[str,None]=None, name: Union[str,None]=None) -> List[Heartbeat]:
         pass
 
+    def iter_get(self, data_date: Union[datetime.date,None]=None, group: Union[str,None]=None, name: Union[str,None]=None
+                    , chunk_size: int=10000) -> Iterator[Heartbeat]:
+        """
+        Get heartbeats one at a time. Subclasses should override to fetch them chunk_size at a time, so memory
+        doesn't grow with the number of heartbeats; this fallback gets them all first.
+        """
+        yield from self.get(data_date=data_date, group=group, name=name)
+
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
         return type(self).__name__
@@ -30,8 +38,41 @@ class TransactionRepository(ABC):
         pass
 
     @abstractmethod
-    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None) -> List[Transaction]:
-        pass
+    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                , columns: Union[Sequence[str],None]=None) -> List[Transaction]:
+        """ columns: fields the caller needs. Implementations may fetch only those, or all fields if not provided. """
+
+    def iter_get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                    , columns: Union[Sequence[str],None]=None, chunk_size: int=10000) -> Iterator[Transaction]:
+        """
+        Get transactions one at a time. Subclasses should override to fetch them chunk_size at a time, so memory
+        doesn't grow with the number of transactions; this fallback gets them all first.
+        """
+        yield from self.get(trade_date=trade_date, portfolio_code=portfolio_code, columns=columns)
+
+    def count(self, trade_date: Union[datetime.date,None]=None, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> int:
+        """ Count transactions. Subclasses should override with something cheaper than getting them all, where possible. """
+        transactions = self.iter_get(trade_date=trade_date, columns=('TradeDate', 'SettleDate'))
+        if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_one:
+            return sum(1 for t in transactions if t.TradeDate != t.SettleDate)
+        elif settlement_criteria == BlotterTradeSettlementCriteria.t_plus_zero:
+            return sum(1 for t in transactions if t.TradeDate == t.SettleDate)
+        return sum(1 for _ in transactions)
+
+    def count_by_trade_date(self, start_date: datetime.date, end_date: datetime.date) -> Dict[Tuple[datetime.date, BlotterTradeSettlementCriteria], int]:
+        """
+        Count transactions for every trade date from start_date to end_date (inclusive), by settlement criteria.
+        Dates without transactions may be omitted. Subclasses should override with a single query, where possible.
+        """
+        counts = {}
+        trade_date = start_date
+        while trade_date <= end_date:
+            for t in self.iter_get(trade_date=trade_date, columns=('TradeDate', 'SettleDate')):
+                settlement_criteria = (BlotterTradeSettlementCriteria.t_plus_zero if t.TradeDate == t.SettleDate
+                                        else BlotterTradeSettlementCriteria.t_plus_one)
+                counts[(trade_date, settlement_criteria)] = counts.get((trade_date, settlement_criteria), 0) + 1
+            trade_date += datetime.timedelta(days=1)
+        return counts
 
     @property
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
@@ -55,3 +96,30 @@ class BlotterRepository(ABC):
     def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
         return type(self).__name__
 
+
+class IdentifierRepository(ABC):
+    """ Resolves APX's internal portfolio and security IDs (as in change events) to the codes other systems use """
+
+    @abstractmethod
+    def get_portfolio_code(self, portfolio_id: int) -> Union[str, None]:
+        """ Returns None if there is no such portfolio """
+
+    @abstractmethod
+    def get_proprietary_symbol(self, security_id: int) -> Union[str, None]:
+        """ Returns None if there is no such security """
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+
+class TransactionIndex(ABC):
+    """ Answers whether a transaction exists somewhere, quickly enough to ask once per consumed event """
+
+    @abstractmethod
+    def contains(self, transaction: Transaction) -> Union[bool, None]:
+        """ Returns None if the transaction lacks the attributes needed to look it up """
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
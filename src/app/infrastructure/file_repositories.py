@@ -1,7 +1,11 @@
 
+from dataclasses import dataclass
 import datetime
+import logging
 import os
-from typing import List, Union
+import threading
+import time
+from typing import Dict, List, Tuple, Union
 
 from domain.models import Blotter, BlotterTradeSettlementCriteria, BlotterType, BlotterSendStatus
 from domain.repositories import BlotterRepository
@@ -9,23 +13,142 @@ from infrastructure.models import FABlotterV1BlotterFile
 from infrastructure.util.config import AppConfig
 from infrastructure.util.file import prepare_dated_file_path
 
+
+# (settlement criteria, type) combinations which have a blotter file
+BLOTTER_KINDS = [
+    (BlotterTradeSettlementCriteria.t_plus_zero, BlotterType.regular),
+    (BlotterTradeSettlementCriteria.t_plus_one, BlotterType.regular),
+    (BlotterTradeSettlementCriteria.t_plus_one, BlotterType.amendment),
+]
+
+
+@dataclass
+class CachedBlotter:
+    blotter: FABlotterV1BlotterFile
+    expires_at: Union[float, None] = None  # time.monotonic() after which to look again; None means for the rest of the day
+
+
 class FABlotterV1BlotterRepository(BlotterRepository):
+    """
+    Blotter files on the BONA notification share. Lookups are cached per (settlement_criteria, type_, trade_date):
+    sent (SUCCESS) blotters for the rest of the day, and not-yet-sent (UNKNOWN) ones for unknown_ttl_seconds.
+    If scan_interval_seconds is set, a background thread also lists the BLOTTER folders of today and of any
+    cached trade dates, so newly sent blotters show up in the cache without a per-transaction lookup.
+    """
+
+    def __init__(self, unknown_ttl_seconds: Union[float, None]=None, scan_interval_seconds: Union[float, None]=None):
+        if unknown_ttl_seconds is None:
+            unknown_ttl_seconds = AppConfig().getfloat('files', 'blotter_unknown_ttl_seconds', fallback=30.0)
+        if scan_interval_seconds is None:
+            scan_interval_seconds = AppConfig().getfloat('files', 'blotter_scan_interval_seconds', fallback=0.0)
+        self.unknown_ttl_seconds = unknown_ttl_seconds
+        self.scan_interval_seconds = scan_interval_seconds
+        self.cache: Dict[Tuple[BlotterTradeSettlementCriteria, BlotterType, datetime.date], CachedBlotter] = {}
+        self.cache_date = datetime.date.today()
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+        if self.scan_interval_seconds:
+            threading.Thread(target=self._scan_periodically, name=f'{self.cn}-scanner', daemon=True).start()
     
     def create(self, blotter: Blotter) -> int:
         raise NotImplementedError()
 
     def get(self, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None
                 , type_: Union[BlotterType,None]=None, trade_date: Union[datetime.date,None]=None) -> List[FABlotterV1BlotterFile]:
+
+        if trade_date is None:
+            trade_date = datetime.date.today()
+        key = (settlement_criteria, type_, trade_date)
+
+        with self.cache_lock:
+            self.expire_cache_if_new_day()
+            cached = self.cache.get(key)
+            if cached and (cached.expires_at is None or cached.expires_at > time.monotonic()):
+                self.hits += 1
+                return [cached.blotter]
+            self.misses += 1
+
+        blotter = self.read(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date)
+        self.cache_blotter(blotter)
+        return [blotter]
+
+    def read(self, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None
+                , type_: Union[BlotterType,None]=None, trade_date: Union[datetime.date,None]=None) -> FABlotterV1BlotterFile:
+        """ Look up the blotter file on the share, bypassing the cache """
         
         blotter_file_full_path = self.get_blotter_file_full_path(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date)
         if os.path.exists(blotter_file_full_path):
-            return [FABlotterV1BlotterFile(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date, 
+            return FABlotterV1BlotterFile(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date, 
                             status=BlotterSendStatus.SUCCESS, modified_at=datetime.datetime.fromtimestamp(os.path.getmtime(blotter_file_full_path)))
-            ]
         else:
-            return [FABlotterV1BlotterFile(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date, 
+            return FABlotterV1BlotterFile(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date, 
                             status=BlotterSendStatus.UNKNOWN)
-            ]
+
+    def cache_blotter(self, blotter: FABlotterV1BlotterFile):
+        """
+        Cache the blotter, unless the cache already has fresher information: a lookup and a scan may race, so a
+        lookup which started before the file was sent must not replace the SUCCESS entry cached by a later scan,
+        nor an older file's entry replace a newer one's. Use invalidate to drop SUCCESS entries deliberately.
+        """
+        key = (blotter.settlement_criteria, blotter.type_, blotter.trade_date)
+        expires_at = None if blotter.status == BlotterSendStatus.SUCCESS else time.monotonic() + self.unknown_ttl_seconds
+        with self.cache_lock:
+            cached = self.cache.get(key)
+            if cached and cached.blotter.status == BlotterSendStatus.SUCCESS:
+                if blotter.status != BlotterSendStatus.SUCCESS or blotter.modified_at < cached.blotter.modified_at:
+                    return
+            self.cache[key] = CachedBlotter(blotter=blotter, expires_at=expires_at)
+
+    def invalidate(self, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None
+                , type_: Union[BlotterType,None]=None, trade_date: Union[datetime.date,None]=None):
+        """ Drop cached blotters matching all of the provided criteria (or everything, if none are provided) """
+        with self.cache_lock:
+            for key in list(self.cache):
+                if ((settlement_criteria is None or key[0] == settlement_criteria)
+                        and (type_ is None or key[1] == type_) and (trade_date is None or key[2] == trade_date)):
+                    del self.cache[key]
+
+    def expire_cache_if_new_day(self):
+        """ Cache entries only last for the day. Expects cache_lock to be held. """
+        today = datetime.date.today()
+        if today != self.cache_date:
+            self.cache.clear()
+            self.cache_date = today
+
+    def scan(self):
+        """ List the BLOTTER folder of today and of each cached trade date, caching any blotter files found """
+        with self.cache_lock:
+            trade_dates = set([k[2] for k in self.cache]) | {datetime.date.today()}
+        for trade_date in trade_dates:
+            # All blotter files for a trade date live in the same folder
+            expected_file_names = {}
+            for settlement_criteria, type_ in BLOTTER_KINDS:
+                path = self.get_blotter_file_full_path(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date)
+                expected_file_names.setdefault(os.path.basename(path), []).append((settlement_criteria, type_))
+            folder = os.path.dirname(path)
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        for settlement_criteria, type_ in expected_file_names.get(entry.name, []):
+                            self.cache_blotter(FABlotterV1BlotterFile(settlement_criteria=settlement_criteria, type_=type_, 
+                                trade_date=trade_date, status=BlotterSendStatus.SUCCESS, 
+                                modified_at=datetime.datetime.fromtimestamp(entry.stat().st_mtime)))
+            except FileNotFoundError:
+                pass  # Folder is only created once something is sent that day
+        self.scans += 1
+
+    def _scan_periodically(self):
+        while True:
+            time.sleep(self.scan_interval_seconds)
+            try:
+                self.scan()
+            except Exception as e:
+                logging.exception(f'{self.cn}: failed scanning for blotters: {e}')
+
+    def cache_stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache), 'scans': self.scans}
 
     # TODO_CLEANUP: remove below once confirmed not using
     def get_blotter_file_full_path(self, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None
@@ -0,0 +1,109 @@
+
+# core python
+import datetime
+import logging
+import threading
+import time
+from typing import Callable, Tuple, Union
+
+# native
+from domain.repositories import HeartbeatRepository
+from infrastructure.util.logging import get_log_file_full_path
+
+
+class BackgroundHeartbeatScheduler:
+    """
+    Saves a heartbeat every interval_seconds from a background thread, so heartbeats neither stall nor depend on
+    the thread doing the actual work. Writes happen one at a time: if a write takes longer than the interval
+    (e.g. the DB is slow), the beats which fell due in the meantime are dropped rather than queued up.
+    """
+
+    def __init__(self, heartbeat_repo: HeartbeatRepository, group: str, name: str, interval_seconds: float=30.0,
+                    get_log: Union[Callable[[], str], None]=None, get_progress: Union[Callable[[], Tuple[int, Union[datetime.datetime, None]]], None]=None):
+        """
+        :param heartbeat_repo: Repo to save heartbeats to
+        :param group: Heartbeat group
+        :param name: Heartbeat name
+        :param interval_seconds: How often to save a heartbeat
+        :param get_log: Returns a description of what is running, for heartbeats which have a log attribute
+        :param get_progress: Returns (number of messages processed, time of the last one), so the heartbeat reflects progress
+        """
+        self.heartbeat_repo = heartbeat_repo
+        self.group = group
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.get_log = get_log
+        self.get_progress = get_progress
+        self.started_at = datetime.datetime.now()
+        self.dropped = 0
+        self.failed = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Static fields are only looked up again when the log file may have rolled over, i.e. on a new day
+        self.log_file_path_date = None
+        self.log_file_path = None
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'{self.cn}-{self.name}', daemon=True)
+        self.thread.start()
+        logging.info(f'{self.cn}: saving {self.group} {self.name} heartbeats to {self.heartbeat_repo.cn} every {self.interval_seconds}s')
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.interval_seconds)
+
+    def _run(self):
+        next_beat = time.monotonic()
+        while not self.stop_event.wait(max(next_beat - time.monotonic(), 0)):
+            start = time.monotonic()
+            self.beat()
+            elapsed = time.monotonic() - start
+
+            # Skip any beats which fell due while this one was being written
+            missed = int(elapsed // self.interval_seconds)
+            if missed:
+                self.dropped += missed
+                logging.warning(f'{self.cn}: heartbeat took {elapsed:.1f}s to save; dropped {missed} heartbeats ({self.dropped} so far)')
+            next_beat = start + (missed + 1) * self.interval_seconds
+
+    def beat(self):
+        try:
+            heartbeat_class = self.heartbeat_repo.heartbeat_class
+            kwargs = {}
+            if 'log_file_path' in getattr(heartbeat_class, '__dataclass_fields__', {}):
+                # Provide it, rather than having each heartbeat look it up from the log handlers
+                kwargs['log_file_path'] = self.cached_log_file_path()
+            hb = heartbeat_class(group=self.group, name=self.name, **kwargs)
+
+            # If it has a log attribute, populate it with something more meaningful:
+            if hasattr(hb, 'log') and self.get_log:
+                hb.log = f'HEARTBEAT => {self.get_log()}; {self.progress()}'
+
+            logging.debug(f'About to save heartbeat to {self.heartbeat_repo.cn}: {hb}')
+            self.heartbeat_repo.create(hb)
+        except Exception as e:
+            self.failed += 1
+            logging.exception(f'{self.cn}: failed to save heartbeat ({self.failed} failures so far): {e}')
+
+    def progress(self) -> str:
+        if not self.get_progress:
+            return f'up since {self.started_at:%Y-%m-%d %H:%M:%S}'
+        processed, last_message_time = self.get_progress()
+        if last_message_time is None:
+            return f'{processed} messages processed since {self.started_at:%Y-%m-%d %H:%M:%S}'
+        seconds_since = (datetime.datetime.now() - last_message_time).total_seconds()
+        return f'{processed} messages processed, last one {seconds_since:.0f}s ago at {last_message_time:%Y-%m-%d %H:%M:%S}'
+
+    def cached_log_file_path(self) -> Union[str, None]:
+        today = datetime.date.today()
+        if self.log_file_path_date != today:
+            self.log_file_path = get_log_file_full_path()
+            self.log_file_path_date = today
+        return self.log_file_path
+
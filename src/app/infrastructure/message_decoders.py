@@ -0,0 +1,157 @@
+
+# core python
+import datetime
+import json
+import logging
+from typing import Callable, Dict, Tuple, Union
+
+# pypi
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the standard library
+    orjson = None
+
+# native
+from domain.events import (TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent
+    , TransactionCommentCreatedEvent, TransactionCommentUpdatedEvent, TransactionCommentDeletedEvent
+)
+from domain.message_decoders import MessageDecoder
+from domain.models import Transaction, TransactionComment
+
+
+EPOCH = datetime.date(year=1970, month=1, day=1)
+
+
+def get_json_loads(backend: Union[str, None]=None) -> Callable[[bytes], dict]:
+    """
+    Get a JSON loads function which parses bytes directly
+
+    :param backend: 'orjson' or 'json'. If not provided, use orjson if it is installed.
+    :returns: loads function
+    """
+    if backend is None:
+        backend = 'orjson' if orjson else 'json'
+    if backend == 'orjson':
+        if not orjson:
+            raise RuntimeError('JSON backend orjson requested, but it is not installed')
+        return orjson.loads
+    elif backend == 'json':
+        return json.loads  # accepts bytes, detecting the encoding itself
+    raise RuntimeError(f'Unrecognized JSON backend: {backend}')
+
+
+class DebeziumTransactionDecoder(MessageDecoder):
+    """ Decodes Debezium change events on APX transactions, converting every record in full """
+
+    def decode(self, message_value: bytes) -> Union[TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent, None]:
+        msg_dict = json.loads(message_value.decode('utf-8'))
+        payload = msg_dict['payload']
+        before = payload['before']
+        after = payload['after']
+
+        # Dates will be in days since 1/1/1970 ... make them datetime dates:
+        if isinstance(before, dict):
+            for k, v in before.items():
+                if 'Date' in k and isinstance(v, int):
+                    before[k] = (datetime.date(year=1970, month=1, day=1) + datetime.timedelta(days=v))
+        if isinstance(after, dict):
+            for k, v in after.items():
+                if 'Date' in k and isinstance(v, int):
+                    after[k] = (datetime.date(year=1970, month=1, day=1) + datetime.timedelta(days=v))
+
+        if payload['op'] == 'c':
+            return (
+                TransactionCommentCreatedEvent(TransactionComment(**after))
+                    if after.get('TransactionCode').strip() == ';'
+                    else TransactionCreatedEvent(Transaction(**after))
+            )
+
+        elif payload['op'] == 'u':
+            return (
+                TransactionCommentUpdatedEvent(TransactionComment(**before), TransactionComment(**after))
+                    if after.get('TransactionCode').strip() == ';'
+                    else TransactionUpdatedEvent(Transaction(**before), Transaction(**after))
+            )
+
+        elif payload['op'] == 'd':
+            return (
+                TransactionCommentDeletedEvent(TransactionComment(**before))
+                    if before.get('TransactionCode').strip() == ';'
+                    else TransactionDeletedEvent(Transaction(**before))
+            )
+
+        else:
+            return None  # No event
+
+
+class FastDebeziumTransactionDecoder(MessageDecoder):
+    """
+    Decodes Debezium change events on APX transactions, doing as little work per message as possible:
+    - JSON is parsed straight from bytes, using orjson if available
+    - Which columns are dates is worked out once per column layout (the "field plan"), not once per message,
+      along with the compact Transaction layout used to store them
+    - Epoch days are converted to dates with a precomputed lookup table
+    - Ignored ops are not converted at all, and comments only get the fields they use
+    """
+    # Fields kept on TransactionComment instances
+    comment_fields = ('PortfolioID', 'TradeDate', 'TransactionCode', 'Comment')
+
+    def __init__(self, json_backend: Union[str, None]=None, date_table_end: datetime.date=datetime.date(year=2070, month=12, day=31)):
+        self.loads = get_json_loads(json_backend)
+        self.date_table = [EPOCH + datetime.timedelta(days=d) for d in range((date_table_end - EPOCH).days + 1)]
+        self.field_plans: Dict[Tuple[str, ...], Tuple[Tuple[str, ...], type]] = {}  # column names -> (date column names, Transaction layout)
+        self.comment_class = TransactionComment.with_fields(self.comment_fields)
+        self.comment_trade_date_idx = self.comment_fields.index('TradeDate')
+        logging.debug(f'{self.cn} using {self.loads.__module__} loads, with {len(self.date_table)} precomputed dates')
+
+    def to_date(self, days: int) -> datetime.date:
+        if 0 <= days < len(self.date_table):
+            return self.date_table[days]
+        return EPOCH + datetime.timedelta(days=days)
+
+    def field_plan(self, record: dict) -> Tuple[Tuple[str, ...], type]:
+        """ Get (compiling if needed) the field plan for this record's column layout """
+        columns = tuple(record)
+        plan = self.field_plans.get(columns)
+        if plan is None:
+            plan = self.field_plans[columns] = (tuple([k for k in columns if 'Date' in k]), Transaction.with_fields(columns))
+        return plan
+
+    def transaction(self, record: dict) -> Transaction:
+        date_fields, transaction_class = self.field_plan(record)
+        for k in date_fields:
+            v = record[k]
+            if type(v) is int:
+                record[k] = self.to_date(v)
+        return transaction_class.from_values(record.values())
+
+    def comment(self, record: dict) -> TransactionComment:
+        values = [record.get(k) for k in self.comment_fields]
+        if type(values[self.comment_trade_date_idx]) is int:
+            values[self.comment_trade_date_idx] = self.to_date(values[self.comment_trade_date_idx])
+        return self.comment_class.from_values(values)
+
+    def decode(self, message_value: bytes) -> Union[TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent, None]:
+        payload = self.loads(message_value)['payload']
+        op = payload['op']
+        if op == 'c':
+            after = payload['after']
+            if after.get('TransactionCode').strip() == ';':
+                return TransactionCommentCreatedEvent(self.comment(after))
+            return TransactionCreatedEvent(self.transaction(after))
+
+        elif op == 'u':
+            before, after = payload['before'], payload['after']
+            if after.get('TransactionCode').strip() == ';':
+                return TransactionCommentUpdatedEvent(self.comment(before), self.comment(after))
+            return TransactionUpdatedEvent(self.transaction(before), self.transaction(after))
+
+        elif op == 'd':
+            before = payload['before']
+            if before.get('TransactionCode').strip() == ';':
+                return TransactionCommentDeletedEvent(self.comment(before))
+            return TransactionDeletedEvent(self.transaction(before))
+
+        else:
+            return None  # No event
+
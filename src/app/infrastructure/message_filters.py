@@ -0,0 +1,113 @@
+
+# core python
+from dataclasses import dataclass, field
+import logging
+import re
+import threading
+from typing import Dict, FrozenSet, Union
+
+# native
+from infrastructure.util.config import AppConfig
+
+
+# Debezium's JSON converter writes the envelope op after the before/after records.
+# Values inside string columns have their quotes escaped, so they can't match these.
+OP_PATTERN = re.compile(rb'"op"\s*:\s*"(\w)"')
+TRANSACTION_CODE_PATTERN = re.compile(rb'"TransactionCode"\s*:\s*"([^"]*)"')
+PORTFOLIO_ID_PATTERN = re.compile(rb'"PortfolioID"\s*:\s*(\d+)')
+
+
+def _config_set(section: str, option: str, convert=str) -> FrozenSet:
+    """ Read a comma-separated config option into a frozenset """
+    value = AppConfig().get(section, option, fallback='')
+    return frozenset([convert(v.strip()) for v in value.split(',') if v.strip()])
+
+
+@dataclass
+class DebeziumTransactionPreFilter:
+    """
+    Decides from the raw message (bytes, headers and key) whether a Debezium transaction message
+    can be committed without decoding it, and counts how many messages were skipped and why.
+    Messages are only skipped when every record in them matches, e.g. both before and after of an update.
+    """
+    skip_ops: FrozenSet[str] = frozenset()
+    skip_transaction_codes: FrozenSet[str] = frozenset()
+    portfolio_allow_list: FrozenSet[int] = frozenset()  # Empty means all portfolios are allowed
+    portfolio_deny_list: FrozenSet[int] = frozenset()
+    op_header: Union[str, None] = None  # Header holding the op, if the connector adds one
+    checked: int = 0
+    skipped: Dict[str, int] = field(default_factory=dict)  # reason -> count
+
+    def __post_init__(self):
+        self.lock = threading.Lock()  # Messages may be filtered from worker threads
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    @classmethod
+    def from_config(cls, section: str='kafka_consumer_lw'):
+        """ Create from config, or return None if no pre-filtering is configured """
+        pre_filter = cls(
+            skip_ops=_config_set(section, 'pre_filter_skip_ops'),
+            skip_transaction_codes=_config_set(section, 'pre_filter_skip_transaction_codes'),
+            portfolio_allow_list=_config_set(section, 'pre_filter_portfolio_allow_list', int),
+            portfolio_deny_list=_config_set(section, 'pre_filter_portfolio_deny_list', int),
+            op_header=AppConfig().get(section, 'pre_filter_op_header', fallback=None),
+        )
+        if not (pre_filter.skip_ops or pre_filter.skip_transaction_codes or pre_filter.portfolio_allow_list or pre_filter.portfolio_deny_list):
+            return None
+        return pre_filter
+
+    def skip_reason(self, msg) -> Union[str, None]:
+        """ Returns why the message can be skipped, or None if it needs decoding """
+        value = msg.value()
+
+        if self.skip_ops:
+            op = self.header_value(msg, self.op_header)
+            if op is None:
+                match = OP_PATTERN.search(value)
+                op = match.group(1).decode() if match else None
+            if op in self.skip_ops:
+                return f'op {op}'
+
+        if self.skip_transaction_codes:
+            codes = set([c.decode().strip() for c in TRANSACTION_CODE_PATTERN.findall(value)])
+            if codes and codes <= self.skip_transaction_codes:
+                return 'transaction code'
+
+        if self.portfolio_allow_list or self.portfolio_deny_list:
+            # The key is much smaller than the value, so check it first
+            portfolio_ids = PORTFOLIO_ID_PATTERN.findall(msg.key() or b'') or PORTFOLIO_ID_PATTERN.findall(value)
+            portfolio_ids = set([int(p) for p in portfolio_ids])
+            if portfolio_ids and all([not self.is_portfolio_wanted(p) for p in portfolio_ids]):
+                return 'portfolio'
+
+        return None
+
+    def is_portfolio_wanted(self, portfolio_id: int) -> bool:
+        if portfolio_id in self.portfolio_deny_list:
+            return False
+        return (not self.portfolio_allow_list) or portfolio_id in self.portfolio_allow_list
+
+    def header_value(self, msg, name: Union[str, None]) -> Union[str, None]:
+        if not name:
+            return None
+        for k, v in (msg.headers() or []):
+            if k == name and v is not None:
+                return v.decode() if isinstance(v, bytes) else v
+        return None
+
+    def should_skip(self, msg) -> bool:
+        reason = self.skip_reason(msg)
+        with self.lock:
+            self.checked += 1
+            if reason:
+                self.skipped[reason] = self.skipped.get(reason, 0) + 1
+        if reason:
+            logging.debug(f'{self.cn} skipping message at offset {msg.offset()} due to {reason}')
+        return reason is not None
+
+    def __str__(self):
+        return f"{self.cn}: skipped {sum(self.skipped.values())} of {self.checked} messages checked {self.skipped}"
+
@@ -1,122 +1,373 @@
 
 # core python
-import json
+from collections import deque
 from abc import ABC, abstractmethod
 import datetime
 import logging
 import os
+import threading
+import time
 from typing import List, Type, Union
 
 # pypi
-from confluent_kafka import Consumer, OFFSET_BEGINNING, OFFSET_END
+from confluent_kafka import Consumer, KafkaException, TopicPartition, OFFSET_BEGINNING, OFFSET_END
 
 # native
-from domain.events import (Event, TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent
-    , TransactionCommentCreatedEvent, TransactionCommentUpdatedEvent, TransactionCommentDeletedEvent
-)
+from domain.events import Event, TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent
 from domain.event_handlers import EventHandler
 from domain.message_brokers import MessageBroker
 from domain.message_subscribers import MessageSubscriber
-from domain.models import Transaction, TransactionComment
 from domain.repositories import HeartbeatRepository
 
+from infrastructure.heartbeats import BackgroundHeartbeatScheduler
 from infrastructure.message_brokers import KafkaBroker
+from infrastructure.message_filters import DebeziumTransactionPreFilter
+from infrastructure.message_decoders import DebeziumTransactionDecoder, FastDebeziumTransactionDecoder
 from infrastructure.util.config import AppConfig
 from infrastructure.util.logging import get_log_file_name
+from infrastructure.util.workers import KeyedWorkerPool
 
 
 class DeserializationError(Exception):
     pass
 
 
+class PartitionOffsetTracker:
+    """
+    Tracks in-flight offsets per topic partition, so that the offset committed for a partition only
+    moves forward once every earlier offset in that partition has been completed
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # Offsets may be completed from worker threads
+        self.in_flight = {}  # (topic, partition) -> deque of offsets, in the order consumed
+        self.results = {}  # (topic, partition, offset) -> should_commit, for completed offsets
+        self.next_offsets = {}  # (topic, partition) -> next offset to commit
+        self.committed_offsets = {}  # (topic, partition) -> last offset committed
+
+    def track(self, msg):
+        with self.lock:
+            self.in_flight.setdefault((msg.topic(), msg.partition()), deque()).append(msg.offset())
+
+    def complete(self, msg, should_commit: bool):
+        key = (msg.topic(), msg.partition())
+        with self.lock:
+            offsets = self.in_flight.get(key)
+            if offsets is None:
+                return  # Partition was revoked while this message was being processed
+            self.results[(*key, msg.offset())] = should_commit
+
+            # Advance past every contiguous completed offset at the front of the partition
+            while offsets and (*key, offsets[0]) in self.results:
+                offset = offsets.popleft()
+                if self.results.pop((*key, offset)):
+                    self.next_offsets[key] = offset + 1
+
+    def committable(self) -> List[TopicPartition]:
+        """
+        Offsets which have advanced since the last call. These are considered committed once returned,
+        unless commit_failed is called for them, in which case they are returned again by the next call.
+        """
+        with self.lock:
+            offsets = [TopicPartition(topic, partition, offset) for (topic, partition), offset in self.next_offsets.items()
+                        if self.committed_offsets.get((topic, partition)) != offset]
+            for tp in offsets:
+                self.committed_offsets[(tp.topic, tp.partition)] = tp.offset
+            return offsets
+
+    def commit_failed(self, partitions: List[TopicPartition]):
+        """ Offsets returned by committable which failed to commit, so should be retried """
+        with self.lock:
+            for p in partitions:
+                key = (p.topic, p.partition)
+                if self.committed_offsets.get(key) == p.offset:
+                    del self.committed_offsets[key]
+
+    def forget(self, partitions: List[TopicPartition]):
+        with self.lock:
+            for p in partitions:
+                key = (p.topic, p.partition)
+                for offset in self.in_flight.pop(key, []):
+                    self.results.pop((*key, offset), None)
+                self.next_offsets.pop(key, None)
+                self.committed_offsets.pop(key, None)
+
+
 
 class KafkaMessageConsumer(MessageSubscriber):
     def __init__(self, topics, event_handler, heartbeat_repo: Union[HeartbeatRepository,None]=None):
         super().__init__(message_broker=KafkaBroker(), topics=topics, event_handler=event_handler)
         self.config = dict(self.message_broker.config)
         self.config.update(AppConfig().parser['kafka_consumer'])
+        self.config['on_commit'] = self.on_commit
         logging.info(f'Creating KafkaMessageConsumer with config: {self.config}')
         self.consumer = Consumer(self.config)
         self.heartbeat_repo = heartbeat_repo
+        self.offset_tracker = None  # Only used when consuming in batches or concurrently
+        self.worker_pool = None  # Only used when consuming concurrently
+        self.held_messages = {}  # (topic, partition) -> deque of (key, work item) waiting for queue space
+        self.heartbeat_scheduler = None
+        self.pre_filter = None  # Optionally skips messages which can be committed without decoding
+        self.messages_processed = 0
+        self.last_message_time = None
 
     def consume(self, reset_offset: bool=False):
         
         logging.info(f'Consuming from topics: {self.topics}')
 
         self.reset_offset = reset_offset
-        self.consumer.subscribe(self.topics, on_assign=self.on_assign)
+        self.consumer.subscribe(self.topics, on_assign=self.on_assign, on_revoke=self.on_revoke)
+        self.start_heartbeat()
 
         try:
-            sleep_secs = int(AppConfig().get('kafka_consumer_lw', 'sleep_seconds', fallback=0))
-            while True:
-                msg = self.consumer.poll(5.0)
-                if msg is None:
-                    # Initial message consumption may take up to
-                    # `session.timeout.ms` for the consumer group to
-                    # rebalance and start consuming
-                    logging.info("Waiting...")
-                    
-                    # Save heartbeat
-                    if self.heartbeat_repo:
-                        # Log file name provides a meaningful name, if app_name is not found
-                        app_name = os.environ.get('APP_NAME') or get_log_file_name()
-                        if not app_name:
-                            # Still not found? Default to class name:
-                            app_name = self.cn
-
-                        # Create heartbeat 
-                        hb = self.heartbeat_repo.heartbeat_class(group='LW-FA-BLOTTER-TXN-VAL', name=app_name)
-
-                        # If it has a log attribute, populate it with something more meaningful:
-                        if hasattr(hb, 'log'):
-                            hb.log = f"HEARTBEAT => {self.cn} consuming {', '.join(self.topics)} messages from {self.config['bootstrap.servers']}; using event handler {self.event_handler}"
-
-                        # Now we have the heartbeat ready to save. Save it: 
-                        logging.debug(f'About to save heartbeat to {self.heartbeat_repo.cn}: {hb}')
-                        res = self.heartbeat_repo.create(hb)
-
-                elif msg.error():
-                    logging.info(f"ERROR: {msg.error()}")
-                elif msg.value() is not None:
-                    # logging.info(f"Consuming message: {msg.value()}")
-                    should_commit = True  # commit at the end, unless this gets overridden below
-                    try:
-                        event = self.deserialize(msg.value())
-
-                        if event is None:
-                            # A deserialize method returning None means the kafka message
-                            # does not meet criteria for representing an Event that needs handling.
-                            # Therefore if reaching here we should simply commit offset.
-                            self.consumer.commit(message=msg)
-                            continue
-                        
-                        # If reaching here, we have an Event that should be handled:
-                        # logging.info(f"Handling {event}")
-                        should_commit = self.event_handler.handle(event)
-                        # logging.info(f"Done handling {event}")
-                
-                    except Exception as e:
-                        if isinstance(e, DeserializationError):
-                            logging.info(f'Exception while deserializing: {e}')
-                            should_commit = self.event_handler.handle_deserialization_error(e)
-                        else:
-                            logging.info(e)  # TODO: any more valuable logging?
-                    
-                    # Commit, unless we should not based on above results
-                    if should_commit:
-                        self.consumer.commit(message=msg)
-                        logging.info("Done committing offset")
-                    else:
-                        logging.info("Not committing offset, likely due to the most recent exception")
-
+            # Batch size of 1 (the default) means message-at-a-time consumption
+            batch_size = AppConfig().getint('kafka_consumer_lw', 'batch_size', fallback=1)
+            # Worker count of 0 (the default) means all messages are handled on this thread
+            worker_count = AppConfig().getint('kafka_consumer_lw', 'worker_count', fallback=0)
+            if worker_count > 0:
+                self.consume_concurrently(worker_count=worker_count, batch_size=batch_size)
+            elif batch_size > 1:
+                self.consume_batches(batch_size=batch_size)
+            else:
+                self.consume_messages()
 
         except KeyboardInterrupt:
             pass
         finally:
             # Leave group and commit final offsets
             logging.info(f'Committing offset and closing {self.cn}...\n\n\n')
+            if self.heartbeat_scheduler:
+                self.heartbeat_scheduler.stop()
+            if self.worker_pool:
+                self.worker_pool.stop()
+            if self.offset_tracker:
+                self.commit_offsets(asynchronous=False)
+            if self.pre_filter:
+                logging.info(f'{self.pre_filter}')
             self.consumer.close()
 
+    def consume_messages(self):
+        """ Poll one message at a time, committing each message's offset after handling it """
+        sleep_secs = AppConfig().getint('kafka_consumer_lw', 'sleep_seconds', fallback=0)
+        while True:
+            msg = self.consumer.poll(5.0)
+            if msg is None:
+                # Initial message consumption may take up to
+                # `session.timeout.ms` for the consumer group to
+                # rebalance and start consuming
+                logging.info("Waiting...")
+
+            elif msg.error():
+                logging.info(f"ERROR: {msg.error()}")
+            elif msg.value() is not None:
+                # logging.info(f"Consuming message: {msg.value()}")
+                should_commit = self.process_message(msg)
+
+                # Commit, unless we should not based on above results
+                if should_commit:
+                    self.consumer.commit(message=msg)
+                    logging.info("Done committing offset")
+                else:
+                    logging.info("Not committing offset, likely due to the most recent exception")
+
+    def consume_batches(self, batch_size: int):
+        """ 
+        Pull up to batch_size messages at a time, and commit the highest contiguous offset per partition
+        once per batch (or once per commit_interval_seconds, if configured) rather than once per message
+        """
+        max_latency_secs = AppConfig().getfloat('kafka_consumer_lw', 'batch_max_latency_seconds', fallback=5.0)
+        commit_interval_secs = AppConfig().getfloat('kafka_consumer_lw', 'commit_interval_seconds', fallback=0)
+        logging.info(f'Consuming in batches of up to {batch_size} messages, waiting up to {max_latency_secs}s per batch '
+                        f'and committing every {commit_interval_secs}s')
+
+        self.offset_tracker = PartitionOffsetTracker()
+        last_commit_time = time.monotonic()
+        while True:
+            msgs = self.consumer.consume(num_messages=batch_size, timeout=max_latency_secs)
+            if not msgs:
+                logging.info("Waiting...")
+
+            for msg in msgs:
+                if msg.error():
+                    logging.info(f"ERROR: {msg.error()}")
+                    continue
+                self.offset_tracker.track(msg)
+                if msg.value() is None:
+                    # Nothing to handle, and (as with message-at-a-time) not committed on its own
+                    self.offset_tracker.complete(msg, should_commit=False)
+                    continue
+                should_commit = self.process_message(msg)
+                if not should_commit:
+                    logging.info("Not committing offset, likely due to the most recent exception")
+                self.offset_tracker.complete(msg, should_commit=should_commit)
+
+            if time.monotonic() - last_commit_time >= commit_interval_secs:
+                self.commit_offsets()
+                last_commit_time = time.monotonic()
+
+    def consume_concurrently(self, worker_count: int, batch_size: int):
+        """
+        Hand messages to a pool of worker threads keyed by partition (or by partition and event ordering key, 
+        if worker_key is 'portfolio'), so ordering holds per key while unrelated keys are handled in parallel.
+        Partitions whose worker queue is full are paused until their held messages fit again.
+        """
+        queue_size = AppConfig().getint('kafka_consumer_lw', 'worker_queue_size', fallback=100)
+        self.worker_key = AppConfig().get('kafka_consumer_lw', 'worker_key', fallback='partition')
+        max_latency_secs = AppConfig().getfloat('kafka_consumer_lw', 'batch_max_latency_seconds', fallback=5.0)
+        commit_interval_secs = AppConfig().getfloat('kafka_consumer_lw', 'commit_interval_seconds', fallback=0)
+        logging.info(f'Consuming with {worker_count} workers keyed by {self.worker_key}, each queueing up to {queue_size} messages')
+
+        self.offset_tracker = PartitionOffsetTracker()
+        self.worker_pool = KeyedWorkerPool(worker_count=worker_count, queue_size=queue_size, 
+                                            target=self.process_work_item, name=f'{self.cn}-worker')
+        last_commit_time = time.monotonic()
+        while True:
+            self.resubmit_held_messages()
+
+            # Don't block for long while there are held messages waiting for queue space
+            msgs = self.consumer.consume(num_messages=batch_size, timeout=(0.1 if self.held_messages else max_latency_secs))
+            if not msgs and not self.held_messages:
+                logging.info("Waiting...")
+
+            for msg in msgs:
+                if msg.error():
+                    logging.info(f"ERROR: {msg.error()}")
+                    continue
+                self.offset_tracker.track(msg)
+                if msg.value() is None:
+                    self.offset_tracker.complete(msg, should_commit=False)
+                    continue
+
+                tp = (msg.topic(), msg.partition())
+                key, item = self.work_item(msg)
+                if tp in self.held_messages:
+                    # Keep the partition's order: queue up behind messages already held
+                    self.held_messages[tp].append((key, item))
+                elif not self.worker_pool.submit(key, item):
+                    logging.info(f'Worker queue full; pausing {msg.topic()}[{msg.partition()}]')
+                    self.consumer.pause([TopicPartition(*tp)])
+                    self.held_messages[tp] = deque([(key, item)])
+
+            if time.monotonic() - last_commit_time >= commit_interval_secs:
+                self.commit_offsets()
+                last_commit_time = time.monotonic()
+
+    def work_item(self, msg):
+        """ Returns the worker pool key and work item for a message """
+        if self.pre_filter and self.pre_filter.should_skip(msg):
+            # No event to handle, so the worker will simply let the offset be committed
+            return (msg.topic(), msg.partition()), (msg, None, True)
+        if self.worker_key == 'portfolio':
+            # The ordering key lives inside the payload, so deserialize here rather than on the worker
+            try:
+                event = self.deserialize(msg.value())
+            except Exception:
+                # Let the worker re-raise and handle this the same way as any other message
+                return (msg.topic(), msg.partition()), (msg, None, False)
+            return (msg.topic(), msg.partition(), self.event_ordering_key(event)), (msg, event, True)
+        return (msg.topic(), msg.partition()), (msg, None, False)
+
+    def process_work_item(self, item):
+        msg, event, deserialized = item
+        should_commit = self.process_message(msg, event=event, deserialized=deserialized)
+        if not should_commit:
+            logging.info("Not committing offset, likely due to the most recent exception")
+        self.offset_tracker.complete(msg, should_commit=should_commit)
+
+    def resubmit_held_messages(self):
+        """ Move held messages onto worker queues as space frees up, resuming partitions once they are clear """
+        for tp, held in list(self.held_messages.items()):
+            while held and self.worker_pool.submit(*held[0]):
+                held.popleft()
+            if not held:
+                del self.held_messages[tp]
+                logging.info(f'Resuming {tp[0]}[{tp[1]}]')
+                self.consumer.resume([TopicPartition(*tp)])
+
+    def event_ordering_key(self, event: Union[Event, None]):
+        """ 
+        Events with the same ordering key (within a partition) are handled in order when consuming concurrently
+        with worker_key 'portfolio'. Subclasses may override; by default the whole partition is one key.
+        """
+        return None
+
+    def process_message(self, msg, event: Union[Event, None]=None, deserialized: bool=False) -> bool:
+        """ 
+        Deserialize (unless already deserialized) and handle a single message. 
+        Returns whether its offset should be committed. 
+        """
+        should_commit = True  # commit at the end, unless this gets overridden below
+        try:
+            if not deserialized:
+                if self.pre_filter and self.pre_filter.should_skip(msg):
+                    event = None
+                else:
+                    event = self.deserialize(msg.value())
+
+            if event is None:
+                # A deserialize method returning None means the kafka message
+                # does not meet criteria for representing an Event that needs handling.
+                # Therefore if reaching here we should simply commit offset.
+                should_commit = True
+            else:
+                # If reaching here, we have an Event that should be handled:
+                # logging.info(f"Handling {event}")
+                should_commit = self.event_handler.handle(event)
+                # logging.info(f"Done handling {event}")
+    
+        except Exception as e:
+            if isinstance(e, DeserializationError):
+                logging.info(f'Exception while deserializing: {e}')
+                should_commit = self.event_handler.handle_deserialization_error(e)
+            else:
+                logging.info(e)  # TODO: any more valuable logging?
+
+        self.messages_processed += 1
+        self.last_message_time = datetime.datetime.now()
+        return should_commit
+
+    def commit_offsets(self, asynchronous: bool=True):
+        """ Commit the highest contiguous completed offset of each partition, if any have advanced """
+        offsets = self.offset_tracker.committable()
+        if not offsets:
+            return
+        try:
+            self.consumer.commit(offsets=offsets, asynchronous=asynchronous)
+        except KafkaException as e:
+            logging.warning(f'{self.cn}: failed to commit offsets, will retry: {e}')
+            self.offset_tracker.commit_failed(offsets)
+            return
+        logging.info(f"{'Requested' if asynchronous else 'Done'} committing offsets: {', '.join([f'{tp.topic}[{tp.partition}]@{tp.offset}' for tp in offsets])}")
+
+    def on_commit(self, err, partitions: List[TopicPartition]):
+        """ Commit result callback (called from poll/consume). Failed offsets are retried by the next commit_offsets. """
+        failed = [p for p in partitions if err is not None or p.error is not None]
+        if not failed:
+            return
+        logging.warning(f"{self.cn}: failed to commit {', '.join([f'{tp.topic}[{tp.partition}]@{tp.offset}' for tp in failed])}: {err}; will retry")
+        if self.offset_tracker:
+            self.offset_tracker.commit_failed(failed)
+
+    def start_heartbeat(self):
+        """ Save heartbeats from a background thread, so they reflect progress rather than idleness """
+        if not self.heartbeat_repo:
+            return
+
+        # Log file name provides a meaningful name, if app_name is not found
+        app_name = os.environ.get('APP_NAME') or get_log_file_name()
+        if not app_name:
+            # Still not found? Default to class name:
+            app_name = self.cn
+
+        self.heartbeat_scheduler = BackgroundHeartbeatScheduler(
+            heartbeat_repo=self.heartbeat_repo,
+            group='LW-FA-BLOTTER-TXN-VAL',
+            name=app_name,
+            interval_seconds=AppConfig().getfloat('kafka_consumer_lw', 'heartbeat_interval_seconds', fallback=30.0),
+            get_log=lambda: f"{self.cn} consuming {', '.join(self.topics)} messages from {self.config['bootstrap.servers']}; using event handler {self.event_handler}",
+            get_progress=lambda: (self.messages_processed, self.last_message_time),
+        )
+        self.heartbeat_scheduler.start()
+
     def on_assign(self, consumer, partitions):
         if self.reset_offset:
             for p in partitions:
@@ -124,6 +375,16 @@ class KafkaMessageConsumer(MessageSubscriber):
                 p.offset = OFFSET_BEGINNING
             consumer.assign(partitions)
 
+    def on_revoke(self, consumer, partitions):
+        # Flush anything completed for the revoked partitions before another consumer takes them over
+        if self.worker_pool:
+            for p in partitions:
+                self.held_messages.pop((p.topic, p.partition), None)
+            self.worker_pool.join()
+        if self.offset_tracker:
+            self.commit_offsets(asynchronous=False)
+            self.offset_tracker.forget(partitions)
+
     @abstractmethod
     def deserialize(self, message_value: bytes) -> Union[Event, None]:
         """ 
@@ -142,44 +403,26 @@ class KafkaAPXTransactionMessageConsumer(KafkaMessageConsumer):
         """ Creates a KafkaMessageConsumer to consume new/changed apxdb transactions/comments with the provided event handler """
         super().__init__(event_handler=event_handler, heartbeat_repo=heartbeat_repo, topics=[AppConfig().get('kafka_topics', 'apxdb_transaction')])
 
-    def deserialize(self, message_value: bytes) -> Union[TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent]:
-        msg_dict = json.loads(message_value.decode('utf-8'))
-        payload = msg_dict['payload']
-        before = payload['before']
-        after = payload['after']
-
-        # Dates will be in days since 1/1/1970 ... make them datetime dates:
-        if isinstance(before, dict):
-            for k, v in before.items():
-                if 'Date' in k and isinstance(v, int):
-                    before[k] = (datetime.date(year=1970, month=1, day=1) + datetime.timedelta(days=v))
-        if isinstance(after, dict):
-            for k, v in after.items():
-                if 'Date' in k and isinstance(v, int):
-                    after[k] = (datetime.date(year=1970, month=1, day=1) + datetime.timedelta(days=v))
-
-        if payload['op'] == 'c':
-            return (
-                TransactionCommentCreatedEvent(TransactionComment(**after)) 
-                    if after.get('TransactionCode').strip() == ';' 
-                    else TransactionCreatedEvent(Transaction(**after))
-            )
-
-        elif payload['op'] == 'u':
-            return (
-                TransactionCommentUpdatedEvent(TransactionComment(**before), TransactionComment(**after))
-                    if after.get('TransactionCode').strip() == ';' 
-                    else TransactionUpdatedEvent(Transaction(**before), Transaction(**after))
-            )
-
-        elif payload['op'] == 'd':
-            return (
-                TransactionCommentDeletedEvent(TransactionComment(**before)) 
-                    if before.get('TransactionCode').strip() == ';' 
-                    else TransactionDeletedEvent(Transaction(**before))
-            )
-
+        # The fast decoder is the default; the standard decoder converts every record in full
+        if AppConfig().get('kafka_consumer_lw', 'decoder', fallback='fast') == 'standard':
+            self.decoder = DebeziumTransactionDecoder()
         else:
-            return None  # No event
+            self.decoder = FastDebeziumTransactionDecoder(json_backend=AppConfig().get('kafka_consumer_lw', 'json_backend', fallback=None))
+        logging.info(f'{self.cn} decoding messages with {self.decoder.cn}')
 
+        self.pre_filter = DebeziumTransactionPreFilter.from_config()
+        if self.pre_filter:
+            logging.info(f'{self.cn} pre-filtering messages with {self.pre_filter!r}')
+
+    def event_ordering_key(self, event: Union[Event, None]):
+        """ Order by portfolio: transactions in different portfolios may be handled in parallel """
+        record = None
+        for attr in ('transaction', 'transaction_after', 'comment', 'comment_after'):
+            record = getattr(event, attr, None)
+            if record is not None:
+                break
+        return getattr(record, 'PortfolioID', None)
+
+    def deserialize(self, message_value: bytes) -> Union[TransactionCreatedEvent, TransactionUpdatedEvent, TransactionDeletedEvent]:
+        return self.decoder.decode(message_value)
 
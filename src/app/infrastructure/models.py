@@ -2,6 +2,7 @@
 # core python
 from dataclasses import dataclass, field
 import datetime
+import functools
 import os
 import socket
 
@@ -13,6 +14,18 @@ from infrastructure.util.logging import get_log_file_full_path
 
 
 
+@functools.lru_cache(maxsize=None)
+def get_run_host() -> str:
+    """ Host name doesn't change while running, so only look it up once """
+    return socket.gethostname().upper()
+
+
+@functools.lru_cache(maxsize=None)
+def get_login() -> str:
+    """ Login doesn't change while running, so only look it up once """
+    return os.getlogin()
+
+
 @dataclass
 class MGMTDBHeartbeat(Heartbeat):
     log: str = 'HEARTBEAT'
@@ -29,12 +42,12 @@ class MGMTDBHeartbeat(Heartbeat):
             , 'log': self.log
             , 'log_file_path': self.log_file_path
             , 'run_type': 'INFO'
-            , 'run_host': socket.gethostname().upper()
+            , 'run_host': get_run_host()
             , 'run_status':9000
             , 'run_status_text':'HEARTBEAT'
             , 'is_complete': 0
             , 'is_success': 0
-            , 'asofuser': f"{os.getlogin()}_{os.environ.get('APP_NAME') or os.path.basename(__file__)}"
+            , 'asofuser': f"{get_login()}_{os.environ.get('APP_NAME') or os.path.basename(__file__)}"
         })
         return base_instance_dict
 
@@ -0,0 +1,45 @@
+
+# core python
+import csv
+import logging
+import os
+from typing import List, Sequence
+
+# pypi
+import pandas as pd
+
+# native
+from application.reconcilers import ReconciliationDifference
+
+
+def reconciliation_report_rows(differences: List[ReconciliationDifference], key_fields: Sequence[str]) -> List[dict]:
+    """ One row per differing key: the key fields, status, where it is missing/mismatched, and the count per repo """
+    rows = []
+    for d in differences:
+        row = dict(zip(key_fields, d.key))
+        row['status'] = d.status
+        row['missing_from'] = '; '.join(d.missing_from)
+        row['mismatched_in'] = '; '.join(d.mismatched_in)
+        row.update({f'count in {repo}': n for repo, n in d.counts.items()})
+        rows.append(row)
+    return rows
+
+
+def write_reconciliation_report(differences: List[ReconciliationDifference], key_fields: Sequence[str], file_path: str) -> str:
+    """
+    Write the differences to CSV, or to Parquet if file_path ends with .parquet (which needs pyarrow or fastparquet)
+
+    :returns: file_path
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    rows = reconciliation_report_rows(differences, key_fields)
+    if file_path.lower().endswith('.parquet'):
+        pd.DataFrame(rows).to_parquet(file_path, index=False)
+    else:
+        fieldnames = list(key_fields) + ['status', 'missing_from', 'mismatched_in'] + (list(rows[0])[len(key_fields) + 3:] if rows else [])
+        with open(file_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+    logging.info(f'Wrote {len(rows)} reconciliation differences to {file_path}')
+    return file_path
@@ -0,0 +1,68 @@
+
+# core python
+import logging
+from typing import Dict, List, Tuple, Union
+
+# native
+from application.declarative_rules import DeclarativeRule, RuleDefinition, TransactionValidationRuleSource
+from domain.services import AlertService
+from infrastructure.util.config import AppConfig
+
+
+class ConfigTransactionValidationRuleSource(TransactionValidationRuleSource):
+    """
+    Rules declared in config sections named rule:<name>, e.g.
+
+        [rule:quantity_max_1000]
+        field = Quantity
+        broken_when = gt
+        value = 1000
+
+        [rule:denied_portfolios]
+        field = PortfolioID
+        broken_when = in
+        values = 123, 456
+        enabled = true
+
+    Values are read as numbers, ISO dates (e.g. 2024-01-31) or strings; gt / ge / lt / le need a number or date.
+    The config file is re-read when it changes on disk, so rules can be added, changed or disabled without a restart.
+    Rules whose definition hasn't changed keep the same compiled instance (and so their validator stats).
+    """
+    section_prefix = 'rule:'
+
+    def __init__(self, fail_alert_services: Union[List[AlertService],None] = None):
+        self.fail_alert_services = fail_alert_services
+        self.snapshot = None
+        self.definitions: Union[Tuple[RuleDefinition, ...], None] = None
+        self.rules: Dict[RuleDefinition, DeclarativeRule] = {}
+
+    def read_definitions(self, parser) -> Tuple[RuleDefinition, ...]:
+        definitions = []
+        for section in parser.sections():
+            if not section.startswith(self.section_prefix):
+                continue
+            if not parser.getboolean(section, 'enabled', fallback=True):
+                continue
+            definitions.append(RuleDefinition.from_options(section[len(self.section_prefix):], dict(parser.items(section))))
+        return tuple(definitions)
+
+    def get_rules_if_changed(self) -> Union[List[DeclarativeRule], None]:
+        config = AppConfig()
+        if config.snapshot is self.snapshot:
+            return None
+        self.snapshot = config.snapshot
+
+        try:
+            definitions = self.read_definitions(config.parser)
+        except Exception as e:
+            if self.definitions is None:
+                raise
+            logging.exception(f'{self.cn}: keeping the current rules, since the changed ones are invalid: {e}')
+            return None
+        if definitions == self.definitions:
+            return None
+
+        self.definitions = definitions
+        self.rules = {d: self.rules.get(d) or DeclarativeRule(d, fail_alert_services=self.fail_alert_services) for d in definitions}
+        logging.info(f"{self.cn}: loaded {len(definitions)} rules:" + ''.join([f'\n  {d}' for d in definitions]))
+        return list(self.rules.values())
@@ -1,28 +1,307 @@
 
-from dataclasses import dataclass
+import atexit
+from dataclasses import dataclass, field
+import datetime
+import json
 import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Union
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from domain.models import Alert
 from domain.services import AlertService
+from infrastructure.util.config import AppConfig
 
 
 @dataclass
 class MSTeamsAlertService(AlertService):
     webhook_url: str
-    
+    timeout_seconds: float = 10.0
+    pool_size: int = 4
+
+    def __post_init__(self):
+        # Reuse connections to the webhook, rather than opening a new one per alert
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
     def send_alert(self, alert: Alert) -> int:
         message = {
             'title': alert.title.replace('\\','\\\\'),
             'text': alert.body.replace('\\','\\\\')
         }
         logging.info(f'Sending Teams alert to {self.webhook_url}:'+'\n\n'+alert.title+'\n\n'+alert.body+'\n')
-        response = requests.post(self.webhook_url, json=message)
-        
+        response = self.session.post(self.webhook_url, json=message, timeout=self.timeout_seconds)
+
         # Returning 1 means 1 row was "saved", i.e. success
         if response.ok:
             return 1
         else:
-            return 0  # TODO_EH: logging? throw exception? 
+            logging.warning(f'Teams alert failed with HTTP {response.status_code}: {response.text[:200]}')
+            return 0
+
+
+@dataclass
+class QueuedAlertService(AlertService):
+    """
+    Sends alerts via another AlertService from background workers, so send_alert returns as soon as the alert
+    is queued. Failed sends are retried with jittered exponential backoff. Alerts which still fail (or which
+    don't fit in the queue) are appended to a spool file, which is replayed the next time this service starts.
+    """
+    service: AlertService
+    queue_size: int = 1000
+    worker_count: int = 2
+    max_attempts: int = 5
+    backoff_seconds: float = 1.0
+    spool_file_path: Union[str, None] = None
+    sent: int = 0
+    spooled: int = 0
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    @classmethod
+    def from_config(cls, service: AlertService, section: str='alerts'):
+        spool_dir = AppConfig().get(section, 'spool_dir', fallback=None) or AppConfig().get('logging', 'base_dir', fallback='.')
+        app_name = os.environ.get('APP_NAME') or service.__class__.__name__
+        return cls(
+            service=service,
+            queue_size=AppConfig().getint(section, 'queue_size', fallback=1000),
+            worker_count=AppConfig().getint(section, 'worker_count', fallback=2),
+            max_attempts=AppConfig().getint(section, 'max_attempts', fallback=5),
+            backoff_seconds=AppConfig().getfloat(section, 'backoff_seconds', fallback=1.0),
+            spool_file_path=os.path.join(spool_dir, f'{app_name}.alert_spool.jsonl'),
+        )
+
+    def __post_init__(self):
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.spool_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name=f'{self.cn}-{i}', daemon=True) for i in range(self.worker_count)]
+        for t in self.threads:
+            t.start()
+        atexit.register(self.close)
+        self.replay_spool()
+
+    def send_alert(self, alert: Alert) -> int:
+        """ Queue the alert. Returns 1 once queued; the alert is spooled instead if the queue is full. """
+        try:
+            self.queue.put_nowait(alert)
+            return 1
+        except queue.Full:
+            logging.warning(f'{self.cn}: queue full; spooling alert {alert.title}')
+            self.spool(alert)
+            return 0
+
+    def _run(self):
+        while True:
+            alert = self.queue.get()
+            try:
+                self.send_with_retries(alert)
+            except Exception as e:
+                logging.exception(f'{self.cn}: unexpected error sending alert {alert.title}: {e}')
+                self.spool(alert)
+            finally:
+                self.queue.task_done()
+
+    def send_with_retries(self, alert: Alert):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self.service.send_alert(alert):
+                    self.sent += 1
+                    return
+                logging.warning(f'{self.cn}: attempt {attempt} of {self.max_attempts} to send alert {alert.title} failed')
+            except Exception as e:
+                logging.warning(f'{self.cn}: attempt {attempt} of {self.max_attempts} to send alert {alert.title} failed: {e}')
+            if attempt < self.max_attempts:
+                time.sleep(self.backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+        self.spool(alert)
+
+    def spool(self, alert: Alert):
+        if not self.spool_file_path:
+            logging.error(f'{self.cn}: dropping alert {alert.title}, since there is no spool file')
+            return
+        with self.spool_lock:
+            with open(self.spool_file_path, 'a') as f:
+                f.write(json.dumps({'title': alert.title, 'body': alert.body, 'spooled_at': datetime.datetime.now().isoformat()}) + '\n')
+            self.spooled += 1
+        logging.warning(f'{self.cn}: spooled alert {alert.title} to {self.spool_file_path}')
+
+    def replay_spool(self):
+        """
+        Queue any alerts spooled by a previous run, as many as fit in the queue without waiting (so startup never waits
+        on sending them). The rest stay in the spool for the next replay.
+        """
+        if not self.spool_file_path:
+            return
+        replay_file_path = f'{self.spool_file_path}.replaying'
+        # A previous run may have died between moving the spool aside and removing it: replay that first
+        if os.path.exists(replay_file_path) and self.replay_file(replay_file_path):
+            return  # Queue full
+        if not os.path.exists(self.spool_file_path):
+            return
+        with self.spool_lock:
+            os.replace(self.spool_file_path, replay_file_path)
+        self.replay_file(replay_file_path)
+
+    def replay_file(self, replay_file_path: str) -> int:
+        """
+        Queue the alerts in a spool file which has been moved aside, put any which don't fit in the queue back in the
+        spool, then remove it. Returns how many were put back.
+        """
+        with open(replay_file_path, 'r') as f:
+            lines = [line for line in f if line.strip()]
+        queued = 0
+        for line in lines:
+            a = json.loads(line)
+            try:
+                self.queue.put_nowait(Alert(title=a['title'], body=a['body']))
+            except queue.Full:
+                break
+            queued += 1
+        left = lines[queued:]
+        if left:
+            with self.spool_lock:
+                with open(self.spool_file_path, 'a') as f:
+                    f.writelines([line if line.endswith('\n') else line + '\n' for line in left])
+        logging.info(f'{self.cn}: replayed {queued} spooled alerts from {replay_file_path}'
+                        + (f'; {len(left)} left in the spool, since the queue is full' if left else ''))
+        os.remove(replay_file_path)
+        return len(left)
+
+    def close(self, timeout_seconds: float=30.0):
+        """ Give queued alerts a chance to be sent, then spool whatever is left """
+        deadline = time.monotonic() + timeout_seconds
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        while True:
+            try:
+                self.spool(self.queue.get_nowait())
+            except queue.Empty:
+                break
+
+
+@dataclass
+class AlertDigest:
+    """ Alerts with the same group key received within one window """
+    first_alert: Alert
+    opened_at: float  # time.monotonic()
+    details: list = field(default_factory=list)
+    count: int = 0
+    suppressed: int = 0  # Alerts beyond max_details, only counted
+
+
+@dataclass
+class DigestAlertService(AlertService):
+    """
+    Coalesces alerts via another AlertService: the first alert for a group key (e.g. rule and blotter) opens a
+    window, and alerts for the same group within window_seconds are combined into one digest alert listing
+    each alert's detail. Each digest lists at most max_details alerts; beyond that they are only counted.
+    At most max_digests_per_window digests (0 for no limit) are sent per window: the rest stay open, keep
+    collecting alerts, and are sent in a later window. A window with a single alert sends that alert unchanged.
+    Alerts without a group key are sent immediately, and close() sends everything regardless of the limit.
+    This way the number of alerts sent scales with incidents rather than with affected transactions.
+    """
+    service: AlertService
+    window_seconds: float = 60.0
+    max_details: int = 50
+    max_digests_per_window: int = 10
+    received: int = 0
+    digests_sent: int = 0
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    @classmethod
+    def from_config(cls, service: AlertService, section: str='alerts') -> AlertService:
+        """ Wrap the service, or return it unchanged if digest_window_seconds is 0 """
+        window_seconds = AppConfig().getfloat(section, 'digest_window_seconds', fallback=60.0)
+        if window_seconds <= 0:
+            return service
+        return cls(service=service, window_seconds=window_seconds,
+                    max_details=AppConfig().getint(section, 'digest_max_details', fallback=50),
+                    max_digests_per_window=AppConfig().getint(section, 'digest_max_per_window', fallback=10))
+
+    def __post_init__(self):
+        self.digests = {}  # group key -> AlertDigest
+        self.lock = threading.Lock()
+        self.window_started_at = time.monotonic()
+        self.window_sent = 0  # Digests sent since window_started_at
+        self.window_held_back = False  # Whether held back digests have been logged this window
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=self.cn, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def send_alert(self, alert: Alert) -> int:
+        """ Add the alert to its group's digest. Returns 1 once accepted. """
+        if alert.group_key is None:
+            return self.service.send_alert(alert)
+        with self.lock:
+            self.received += 1
+            digest = self.digests.get(alert.group_key)
+            if digest is None:
+                digest = self.digests[alert.group_key] = AlertDigest(first_alert=alert, opened_at=time.monotonic())
+            digest.count += 1
+            if len(digest.details) < self.max_details:
+                digest.details.append(alert.detail or alert.body)
+            else:
+                digest.suppressed += 1
+        return 1
+
+    def _run(self):
+        while not self.stop_event.wait(min(self.window_seconds / 4, 1.0)):
+            try:
+                self.flush(time.monotonic() - self.window_seconds)
+            except Exception as e:
+                logging.exception(f'{self.cn}: unexpected error flushing digests: {e}')
+
+    def flush(self, opened_before: Union[float, None]=None):
+        """ Send digests for windows opened before opened_before (monotonic time), or all of them if not provided """
+        with self.lock:
+            due = sorted((k for k, d in self.digests.items() if opened_before is None or d.opened_at <= opened_before),
+                            key=lambda k: self.digests[k].opened_at)
+            if opened_before is not None and self.max_digests_per_window > 0:
+                now = time.monotonic()
+                if now - self.window_started_at >= self.window_seconds:
+                    self.window_started_at, self.window_sent, self.window_held_back = now, 0, False
+                allowed = max(self.max_digests_per_window - self.window_sent, 0)
+                if len(due) > allowed and not self.window_held_back:
+                    self.window_held_back = True
+                    logging.warning(f'{self.cn}: {len(due) - allowed} digests held back until the next window '
+                                        f'(limit {self.max_digests_per_window} per window)')
+                due = due[:allowed]
+                self.window_sent += len(due)
+            digests = [self.digests.pop(k) for k in due]
+        for d in digests:
+            alert = self.digest_alert(d)
+            if d.count > 1:
+                logging.info(f'{self.cn}: sending digest of {d.count} alerts ({d.suppressed} suppressed) for {d.first_alert.group_key}')
+                self.digests_sent += 1
+            self.service.send_alert(alert)
+
+    def digest_alert(self, digest: AlertDigest) -> Alert:
+        first = digest.first_alert
+        if digest.count == 1:
+            return first
+        lines = [f'{digest.count} alerts in the last {self.window_seconds:g}s:'] + [f'- {d}' for d in digest.details]
+        if digest.suppressed:
+            lines.append(f'... and {digest.suppressed} more, not listed')
+        if first.group_summary:
+            lines.append(first.group_summary)
+        return Alert(title=f'{first.title} ({digest.count} alerts)', body='   \n'.join(lines), group_key=first.group_key,
+                        group_summary=first.group_summary)
+
+    def close(self):
+        """ Send whatever is waiting, rather than losing it """
+        self.stop_event.set()
+        self.flush()
 
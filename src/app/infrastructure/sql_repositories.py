@@ -1,17 +1,52 @@
 
 # core python
 import datetime
+import itertools
 import logging
-from typing import List, Union
+import threading
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
 
 # pypi
 import pandas as pd
 
 # native
-from domain.models import Heartbeat, Transaction
-from domain.repositories import HeartbeatRepository, TransactionRepository
+from domain.models import BlotterTradeSettlementCriteria, Heartbeat, Transaction
+from domain.repositories import HeartbeatRepository, IdentifierRepository, TransactionRepository
 from infrastructure.models import MGMTDBHeartbeat
-from infrastructure.sql_tables import MGMTDBMonitorTable, LWDBNotificationTable, APXDBvPortfolioTransactionView, APXDBvPortfolioTransactionLWFundsView
+from infrastructure.sql_tables import MGMTDBMonitorTable, LWDBNotificationTable, APXDBvPortfolioTransactionView, APXDBvPortfolioTransactionLWFundsView, APXDBvPortfolioView, APXDBvSecurityVariantView, LZDBTransactionTable
+from infrastructure.util.database import decategorize, to_columnar
+
+
+
+def settlement_count(query_result: pd.DataFrame, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> int:
+    """ Pick the count for settlement_criteria (or the total, if not provided) from a count_same_day query result """
+    if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_zero:
+        query_result = query_result[query_result['same_day'] == 1]
+    elif settlement_criteria == BlotterTradeSettlementCriteria.t_plus_one:
+        query_result = query_result[query_result['same_day'] == 0]
+    return int(query_result['transaction_count'].sum())
+
+
+def settlement_mask(frame: pd.DataFrame, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> pd.Series:
+    """ Which rows of a transactions frame meet settlement_criteria (all, if not provided). Vectorized on columnar frames. """
+    trade_dates, settle_dates = decategorize(frame['TradeDate']), decategorize(frame['SettleDate'])
+    if settlement_criteria == BlotterTradeSettlementCriteria.t_plus_zero:
+        return (trade_dates == settle_dates).fillna(False).astype(bool)
+    elif settlement_criteria == BlotterTradeSettlementCriteria.t_plus_one:
+        return (trade_dates != settle_dates).fillna(False).astype(bool)
+    return pd.Series(True, index=frame.index, dtype=bool)
+
+
+def settlement_counts_by_date(query_result: pd.DataFrame) -> Dict[Tuple[datetime.date, BlotterTradeSettlementCriteria], int]:
+    """ Convert a count_same_day query result to (trade date, settlement criteria) -> count """
+    trade_dates = pd.to_datetime(query_result['TradeDate']).dt.date
+    counts = {}
+    for trade_date, same_day, transaction_count in zip(trade_dates, query_result['same_day'], query_result['transaction_count']):
+        settlement_criteria = BlotterTradeSettlementCriteria.t_plus_zero if int(same_day) == 1 else BlotterTradeSettlementCriteria.t_plus_one
+        counts[(trade_date, settlement_criteria)] = counts.get((trade_date, settlement_criteria), 0) + int(transaction_count)
+    return counts
+
+
 
 
 
@@ -23,19 +58,50 @@ class LWDBBONASentTransactionRepository(TransactionRepository):
     def create(self, transaction: Transaction) -> int:
         raise NotImplementedError("Cannot write to {self.cn}")
 
-    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None) -> List[Transaction]:
-        query_result = pd.concat([
-            self.table.read(scenario='CUSTODIAN.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code),
-            self.table.read(scenario='SSCNET.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code),
-        ])
+    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                , columns: Union[Sequence[str],None]=None) -> List[Transaction]:
+        # Compact transactions, laid out per the query result columns, built straight from the result rows:
+        transactions = (
+            self.table.read(scenario='CUSTODIAN.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns, record_class=Transaction)
+            + self.table.read(scenario='SSCNET.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns, record_class=Transaction)
+        )
         # TODO: filter for transactions in LW Fund portfolios only
         # query_result = self.table.read(scenario='CUSTODIAN.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code)
-        
-        # Convert to dict:
-        query_result_dicts = query_result.to_dict('records')
-
-        transactions = [Transaction(**qrd) for qrd in query_result_dicts]
         return transactions
+
+    def get_frame(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None, columns: Union[Sequence[str],None]=None
+                    , settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None, columnar: bool=False) -> pd.DataFrame:
+        """
+        Get transactions as a frame with one row per transaction
+
+        :param columnar: Set to get natively typed columns, which are much smaller and faster to filter than Python objects
+        """
+        frame = pd.concat([
+            self.table.read(scenario='CUSTODIAN.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns, columnar=columnar),
+            self.table.read(scenario='SSCNET.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns, columnar=columnar),
+        ], ignore_index=True)
+        if columnar:
+            # Strings dictionary-encoded differently per scenario (and Arrow decimals of different precision) are objects
+            # again once concatenated, so convert them back the way the table's reads did
+            frame = to_columnar(frame, backend=self.table._database.columnar_backend)
+        return frame[settlement_mask(frame, settlement_criteria)] if settlement_criteria else frame
+
+    def iter_get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                    , columns: Union[Sequence[str],None]=None, chunk_size: int=10000) -> Iterator[Transaction]:
+        return itertools.chain(
+            self.table.read(scenario='CUSTODIAN.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns
+                                , chunk_size=chunk_size, record_class=Transaction),
+            self.table.read(scenario='SSCNET.PRIMARY', status='Sent', trade_date=trade_date, portfolio_code=portfolio_code, columns=columns
+                                , chunk_size=chunk_size, record_class=Transaction),
+        )
+
+    def count(self, trade_date: Union[datetime.date,None]=None, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> int:
+        query_result = self.table.count_same_day(scenarios=['CUSTODIAN.PRIMARY', 'SSCNET.PRIMARY'], status='Sent', trade_date=trade_date)
+        return settlement_count(query_result, settlement_criteria)
+
+    def count_by_trade_date(self, start_date: datetime.date, end_date: datetime.date) -> Dict[Tuple[datetime.date, BlotterTradeSettlementCriteria], int]:
+        query_result = self.table.count_same_day(scenarios=['CUSTODIAN.PRIMARY', 'SSCNET.PRIMARY'], status='Sent', start_date=start_date, end_date=end_date)
+        return settlement_counts_by_date(query_result)
         
     def __str__(self):
         return 'Transactions sent via BONA gateway'
@@ -49,14 +115,30 @@ class APXDBTransactionRepository(TransactionRepository):
     def create(self, transaction: Transaction) -> int:
         raise NotImplementedError("Cannot write to {self.cn}")
 
-    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None) -> List[Transaction]:
-        query_result = self.table.read(trade_date=trade_date)
-        
-        # Convert to dict:
-        query_result_dicts = query_result.to_dict('records')
+    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                , columns: Union[Sequence[str],None]=None) -> List[Transaction]:
+        # Compact transactions, laid out per the query result columns, built straight from the result rows:
+        return self.table.read(trade_date=trade_date, columns=columns, record_class=Transaction)
 
-        transactions = [Transaction(**qrd) for qrd in query_result_dicts]
-        return transactions
+    def get_frame(self, trade_date: Union[datetime.date,None]=None, columns: Union[Sequence[str],None]=None
+                    , settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None, columnar: bool=False) -> pd.DataFrame:
+        """
+        Get transactions as a frame with one row per transaction, e.g. for batch validation
+
+        :param columnar: Set to get natively typed columns, which are much smaller and faster to filter than Python objects
+        """
+        frame = self.table.read(trade_date=trade_date, columns=columns, columnar=columnar)
+        return frame[settlement_mask(frame, settlement_criteria)] if settlement_criteria else frame
+
+    def iter_get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                    , columns: Union[Sequence[str],None]=None, chunk_size: int=10000) -> Iterator[Transaction]:
+        return self.table.read(trade_date=trade_date, columns=columns, chunk_size=chunk_size, record_class=Transaction)
+
+    def count(self, trade_date: Union[datetime.date,None]=None, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> int:
+        return settlement_count(self.table.count_same_day(trade_date=trade_date), settlement_criteria)
+
+    def count_by_trade_date(self, start_date: datetime.date, end_date: datetime.date) -> Dict[Tuple[datetime.date, BlotterTradeSettlementCriteria], int]:
+        return settlement_counts_by_date(self.table.count_same_day(start_date=start_date, end_date=end_date))
         
     def __str__(self):
         return 'Transactions posted to APX'
@@ -69,19 +151,99 @@ class APXDBFABlotterV2Repository(TransactionRepository):
     def create(self, transaction: Transaction) -> int:
         raise NotImplementedError("Cannot write to {self.cn}")
 
-    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None) -> List[Transaction]:
-        query_result = self.table.read(trade_date=trade_date)
-        
-        # Convert to dict:
-        query_result_dicts = query_result.to_dict('records')
+    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                , columns: Union[Sequence[str],None]=None) -> List[Transaction]:
+        # Compact transactions, laid out per the query result columns, built straight from the result rows:
+        return self.table.read(trade_date=trade_date, columns=columns, record_class=Transaction)
 
-        transactions = [Transaction(**qrd) for qrd in query_result_dicts]
-        return transactions
+    def iter_get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                    , columns: Union[Sequence[str],None]=None, chunk_size: int=10000) -> Iterator[Transaction]:
+        return self.table.read(trade_date=trade_date, columns=columns, chunk_size=chunk_size, record_class=Transaction)
+
+    def count(self, trade_date: Union[datetime.date,None]=None, settlement_criteria: Union[BlotterTradeSettlementCriteria,None]=None) -> int:
+        return settlement_count(self.table.count_same_day(trade_date=trade_date), settlement_criteria)
+
+    def count_by_trade_date(self, start_date: datetime.date, end_date: datetime.date) -> Dict[Tuple[datetime.date, BlotterTradeSettlementCriteria], int]:
+        return settlement_counts_by_date(self.table.count_same_day(start_date=start_date, end_date=end_date))
         
     def __str__(self):
         return 'Transactions slated for FA Blotter v2'
 
 
+class APXDBIdentifierRepository(IdentifierRepository):
+    """
+    Portfolio codes and proprietary symbols from APX, each queried once and then cached, since they hardly ever change.
+    IDs which aren't found aren't cached, so they are found once they are created.
+    """
+
+    def __init__(self):
+        # Created per instance rather than on import, like LZDBTransactionRepository's table
+        self.portfolio_view = APXDBvPortfolioView()
+        self.security_view = APXDBvSecurityVariantView()
+        self.portfolio_codes: Dict[int, str] = {}
+        self.proprietary_symbols: Dict[int, str] = {}
+        self.lock = threading.Lock()  # Transactions may be validated from worker threads
+
+    def get_portfolio_code(self, portfolio_id: int) -> Union[str, None]:
+        return self.lookup(self.portfolio_codes, portfolio_id
+                            , lambda: self.portfolio_view.read(portfolio_id=portfolio_id, columns=('PortfolioCode',)), 'PortfolioCode')
+
+    def get_proprietary_symbol(self, security_id: int) -> Union[str, None]:
+        return self.lookup(self.proprietary_symbols, security_id
+                            , lambda: self.security_view.read(security_id=security_id, columns=('ProprietarySymbol',)), 'ProprietarySymbol')
+
+    def lookup(self, cache: Dict[int, str], key: int, read: Callable[[], pd.DataFrame], column: str) -> Union[str, None]:
+        with self.lock:
+            value = cache.get(key)
+        if value is not None:
+            return value
+        frame = read()
+        if not len(frame) or pd.isna(frame[column].iloc[0]):
+            logging.debug(f'{self.cn}: no {column} for {key}')
+            return None
+        value = str(frame[column].iloc[0]).strip()
+        with self.lock:
+            cache[key] = value
+        return value
+
+    def __str__(self):
+        return 'Portfolio and security identifiers in APX'
+
+
+""" LZDB """
+
+class LZDBTransactionRepository(TransactionRepository):
+    def __init__(self):
+        # Created per instance rather than on import, so apps which don't use the landing zone don't need its config
+        self.table = LZDBTransactionTable()
+
+    def create(self, transaction: Transaction) -> int:
+        raise NotImplementedError("Cannot write to {self.cn}")
+
+    def get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None, security: Union[str,None]=None
+                , quantity=None, modified_after=None, columns: Union[Sequence[str],None]=None) -> List[Transaction]:
+        """ Get transactions, optionally only those modified after a high water mark (see high_water_mark_field) """
+        # Compact transactions, laid out per the query result columns, built straight from the result rows:
+        return self.table.read(trade_date=trade_date, portfolio_code=portfolio_code, security=security, quantity=quantity
+                                , modified_after=modified_after, columns=columns, record_class=Transaction)
+
+    def iter_get(self, trade_date: Union[datetime.date,None]=None, portfolio_code: Union[str,None]=None
+                    , columns: Union[Sequence[str],None]=None, chunk_size: int=10000) -> Iterator[Transaction]:
+        return self.table.read(trade_date=trade_date, portfolio_code=portfolio_code, columns=columns, chunk_size=chunk_size, record_class=Transaction)
+
+    @property
+    def security_field(self) -> str:
+        return self.table.security_column
+
+    @property
+    def high_water_mark_field(self) -> str:
+        return self.table.high_water_mark_column
+
+    def __str__(self):
+        return 'Transactions in the landing zone'
+
+
+
 """ MGMTDB """
 
 class MGMTDBHeartbeatRepository(HeartbeatRepository):
@@ -119,17 +281,14 @@ class MGMTDBHeartbeatRepository(HeartbeatRepository):
         return row_cnt
 
     def get(self, data_date: Union[datetime.date,None]=None, group: Union[str,None]=None, name: Union[str,None]=None) -> List[Heartbeat]:
-        # Query table - returns result into df:
-        query_result = self.table.read(scenario=self.table.base_scenario, data_date=data_date, run_group=group, run_name=name, run_type='INFO', run_status_text='HEARTBEAT')
-        
-        # Convert to dict:
-        query_result_dicts = query_result.to_dict('records')
-
-        # Create list of heartbeats
-        heartbeats = [self.heartbeat_class.from_dict(qrd) for qrd in query_result_dicts]
-
-        # Return result heartbeats list
-        return heartbeats
+        # Query table - heartbeats are built straight from the result rows:
+        return self.table.read(scenario=self.table.base_scenario, data_date=data_date, run_group=group, run_name=name, run_type='INFO'
+                                , run_status_text='HEARTBEAT', record_class=self.heartbeat_class)
+
+    def iter_get(self, data_date: Union[datetime.date,None]=None, group: Union[str,None]=None, name: Union[str,None]=None
+                    , chunk_size: int=10000) -> Iterator[Heartbeat]:
+        return self.table.read(scenario=self.table.base_scenario, data_date=data_date, run_group=group, run_name=name, run_type='INFO'
+                                , run_status_text='HEARTBEAT', chunk_size=chunk_size, record_class=self.heartbeat_class)
 
     @classmethod
     def readable_name(self):
@@ -11,30 +11,65 @@ from infrastructure.util.table import BaseTable, ScenarioTable
 
 
 
+def same_day_counts_stmt(table_def):
+	"""
+	Count rows grouped by TradeDate and by whether TradeDate = SettleDate, i.e. T+0 vs T+1
+
+	:return: Statement selecting columns TradeDate, same_day (1 or 0) and transaction_count
+	"""
+	# Literals rather than bound parameters, since SQL Server won't match parameterised SELECT and GROUP BY expressions
+	same_day = sql.case((table_def.c.TradeDate == table_def.c.SettleDate, sql.literal_column('1')), else_=sql.literal_column('0'))
+	return (
+		sql.select(table_def.c.TradeDate, same_day.label('same_day'), sql.func.count().label('transaction_count'))
+		.select_from(table_def)
+		.group_by(table_def.c.TradeDate, same_day)
+	)
+
+
+
 """ LWDB """
 
 class LWDBNotificationTable(ScenarioTable):
 	config_section = 'lwdb'
 	table_name = 'notification'
 
-	def read(self, scenario=None, status=None, data_date=None, trade_date=None, portfolio_code=None, lw_id=None):
+	filter_columns = {'scenario': 'scenario', 'status': 'status', 'data_date': 'data_dt', 'trade_date': 'TradeDate'
+						, 'portfolio_code': 'PortfolioCode', 'lw_id': 'ProprietarySymbol'}
+
+	def read(self, scenario=None, status=None, data_date=None, trade_date=None, portfolio_code=None, lw_id=None, columns=None, chunk_size=None, record_class=None, columnar=False):
 		"""
 		Read all entries, optionally with criteria
 
-		:return: DataFrame
+		:param columns: Column names to select. Defaults to all.
+		:param chunk_size: If provided, stream the results chunk_size rows at a time
+		:param record_class: If provided, return records of this class rather than DataFrames
+		:param columnar: Set to get natively typed columns (e.g. dates, decimals, dictionary-encoded strings) rather than Python objects
+		:return: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
+		"""
+		return self.read_where(columns=columns, chunk_size=chunk_size, record_class=record_class, columnar=columnar, scenario=(scenario or self.base_scenario), status=status, data_date=data_date
+								, trade_date=trade_date, portfolio_code=portfolio_code, lw_id=lw_id)
+
+	def count_same_day(self, scenarios=None, status=None, trade_date=None, portfolio_code=None, start_date=None, end_date=None):
 		"""
-		stmt = sql.select(self.table_def)
-		stmt = stmt.where(self.c.scenario == (scenario or self.base_scenario))
+		Count entries, optionally with criteria, grouped by TradeDate and whether TradeDate = SettleDate
+
+		:param scenarios: Scenarios to count together. Defaults to the base scenario.
+		:param start_date: First trade date to count (inclusive)
+		:param end_date: Last trade date to count (inclusive)
+		:return: DataFrame with columns TradeDate, same_day and transaction_count
+		"""
+		stmt = same_day_counts_stmt(self.table_def)
+		stmt = stmt.where(self.c.scenario.in_(scenarios or [self.base_scenario]))
 		if status is not None:
 			stmt = stmt.where(self.c.status == status)
-		if data_date is not None:
-			stmt = stmt.where(self.c.data_dt == data_date)
 		if trade_date is not None:
 			stmt = stmt.where(self.c.TradeDate == trade_date)
+		if start_date is not None:
+			stmt = stmt.where(self.c.TradeDate >= start_date)
+		if end_date is not None:
+			stmt = stmt.where(self.c.TradeDate <= end_date)
 		if portfolio_code is not None:
 			stmt = stmt.where(self.c.PortfolioCode == portfolio_code)
-		if lw_id is not None:
-			stmt = stmt.where(self.c.ProprietarySymbol == lw_id)
 		return self.execute_read(stmt)
 
 
@@ -46,32 +81,140 @@ class APXDBvPortfolioTransactionView(BaseTable):
 	schema = 'AdvApp'
 	table_name = 'vPortfolioTransaction'
 
-	def read(self, trade_date=None):
+	filter_columns = {'trade_date': 'TradeDate'}
+
+	def read(self, trade_date=None, columns=None, chunk_size=None, record_class=None, columnar=False):
 		"""
 		Read all entries, optionally with criteria
 
-		:return: DataFrame
+		:param columns: Column names to select. Defaults to all.
+		:param chunk_size: If provided, stream the results chunk_size rows at a time
+		:param record_class: If provided, return records of this class rather than DataFrames
+		:param columnar: Set to get natively typed columns (e.g. dates, decimals, dictionary-encoded strings) rather than Python objects
+		:return: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
 		"""
-		stmt = sql.select(self.table_def)
+		return self.read_where(columns=columns, chunk_size=chunk_size, record_class=record_class, columnar=columnar, trade_date=trade_date)
+
+	def count_same_day(self, trade_date=None, start_date=None, end_date=None):
+		"""
+		Count entries, optionally with criteria, grouped by TradeDate and whether TradeDate = SettleDate
+
+		:param start_date: First trade date to count (inclusive)
+		:param end_date: Last trade date to count (inclusive)
+		:return: DataFrame with columns TradeDate, same_day and transaction_count
+		"""
+		stmt = same_day_counts_stmt(self.table_def)
 		if trade_date is not None:
 			stmt = stmt.where(self.c.TradeDate == trade_date)
+		if start_date is not None:
+			stmt = stmt.where(self.c.TradeDate >= start_date)
+		if end_date is not None:
+			stmt = stmt.where(self.c.TradeDate <= end_date)
 		return self.execute_read(stmt)
 
 class APXDBvPortfolioTransactionLWFundsView(BaseTable):
 	config_section = 'apxdb_lwp'
 	table_name = 'vPortfolioTransaction_LW_Funds'
+	cache_results = True  # Read by several repositories with the same filters
+
+	filter_columns = {'trade_date': 'TradeDate'}
 
-	def read(self, trade_date=None):
+	def read(self, trade_date=None, columns=None, chunk_size=None, record_class=None, columnar=False):
 		"""
 		Read all entries, optionally with criteria
 
-		:return: DataFrame
+		:param columns: Column names to select. Defaults to all.
+		:param chunk_size: If provided, stream the results chunk_size rows at a time
+		:param record_class: If provided, return records of this class rather than DataFrames
+		:param columnar: Set to get natively typed columns (e.g. dates, decimals, dictionary-encoded strings) rather than Python objects
+		:return: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
+		"""
+		return self.read_where(columns=columns, chunk_size=chunk_size, record_class=record_class, columnar=columnar, trade_date=trade_date)
+
+	def count_same_day(self, trade_date=None, start_date=None, end_date=None):
+		"""
+		Count entries, optionally with criteria, grouped by TradeDate and whether TradeDate = SettleDate
+
+		:param start_date: First trade date to count (inclusive)
+		:param end_date: Last trade date to count (inclusive)
+		:return: DataFrame with columns TradeDate, same_day and transaction_count
 		"""
-		stmt = sql.select(self.table_def)
+		stmt = same_day_counts_stmt(self.table_def)
 		if trade_date is not None:
 			stmt = stmt.where(self.c.TradeDate == trade_date)
+		if start_date is not None:
+			stmt = stmt.where(self.c.TradeDate >= start_date)
+		if end_date is not None:
+			stmt = stmt.where(self.c.TradeDate <= end_date)
 		return self.execute_read(stmt)
 
+class APXDBvPortfolioView(BaseTable):
+	config_section = 'apxdb'
+	schema = 'AdvApp'
+	table_name = 'vPortfolio'
+
+	filter_columns = {'portfolio_id': 'PortfolioID'}
+
+	def read(self, portfolio_id=None, columns=None):
+		"""
+		Read all entries, optionally with criteria
+
+		:param columns: Column names to select. Defaults to all.
+		:return: DataFrame
+		"""
+		return self.read_where(columns=columns, portfolio_id=portfolio_id)
+
+class APXDBvSecurityVariantView(BaseTable):
+	config_section = 'apxdb'
+	schema = 'AdvApp'
+	table_name = 'vSecurityVariant'
+
+	filter_columns = {'security_id': 'SecurityID'}
+
+	def read(self, security_id=None, columns=None):
+		"""
+		Read all entries, optionally with criteria
+
+		:param columns: Column names to select. Defaults to all.
+		:return: DataFrame
+		"""
+		return self.read_where(columns=columns, security_id=security_id)
+
+
+
+""" LZDB """
+
+class LZDBTransactionTable(BaseTable):
+	config_section = 'lzdb'
+	table_name = 'Transaction'
+	security_column = 'ProprietarySymbol'  # How the landing zone identifies securities
+	high_water_mark_column = 'ModifiedAt'  # Increases whenever a row is inserted or updated
+
+	def read(self, trade_date=None, portfolio_code=None, security=None, quantity=None, modified_after=None, columns=None, chunk_size=None, record_class=None):
+		"""
+		Read all entries, optionally with criteria
+
+		:param modified_after: Only rows modified after this high water mark
+		:param columns: Column names to select. Defaults to all.
+		:param chunk_size: If provided, stream the results chunk_size rows at a time
+		:param record_class: If provided, return records of this class rather than DataFrames
+		:return: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
+		"""
+		stmt = sql.select(*self.projection(columns))
+		if trade_date is not None:
+			stmt = stmt.where(self.c.TradeDate == trade_date)
+		if portfolio_code is not None:
+			stmt = stmt.where(self.c.PortfolioCode == portfolio_code)
+		if security is not None:
+			stmt = stmt.where(self.c[self.security_column] == security)
+		if quantity is not None:
+			stmt = stmt.where(self.c.Quantity == quantity)
+		if modified_after is not None:
+			stmt = stmt.where(self.c[self.high_water_mark_column] > modified_after)
+		if record_class is not None:
+			return self.execute_read_records(stmt, record_class, chunk_size=chunk_size)
+		return self.execute_read(stmt, chunk_size=chunk_size)
+
 
 
 """ MGMTDB """
@@ -80,42 +223,30 @@ class MGMTDBMonitorTable(ScenarioTable):
 	config_section = 'mgmtdb'
 	table_name = 'monitor'
 
-	def read(self, scenario=None, data_date=None, run_group=None, run_name=None, run_type=None, run_host=None, run_status_text=None):
+	filter_columns = {'scenario': 'scenario', 'data_date': 'data_dt', 'run_group': 'run_group', 'run_name': 'run_name'
+						, 'run_type': 'run_type', 'run_host': 'run_host', 'run_status_text': 'run_status_text'}
+
+	def read(self, scenario=None, data_date=None, run_group=None, run_name=None, run_type=None, run_host=None, run_status_text=None, columns=None, chunk_size=None, record_class=None):
 		"""
 		Read all entries, optionally with criteria
 
-		:return: DataFrame
+		:param columns: Column names to select. Defaults to all.
+		:param chunk_size: If provided, stream the results chunk_size rows at a time
+		:param record_class: If provided, return records of this class rather than DataFrames
+		:return: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
 		"""
-		stmt = sql.select(self.table_def)
-		if scenario is not None:
-			stmt = stmt.where(self.c.scenario == scenario)
-		if data_date is not None:
-			stmt = stmt.where(self.c.data_dt == data_date)
-		if run_group is not None:
-			stmt = stmt.where(self.c.run_group == run_group)
-		if run_name is not None:
-			stmt = stmt.where(self.c.run_name == run_name)
-		if run_type is not None:
-			stmt = stmt.where(self.c.run_type == run_type)
-		if run_host is not None:
-			stmt = stmt.where(self.c.run_host == run_host)
-		if run_status_text is not None:
-			stmt = stmt.where(self.c.run_status_text == run_status_text)
-		return self.execute_read(stmt)
+		return self.read_where(columns=columns, chunk_size=chunk_size, record_class=record_class, scenario=scenario, data_date=data_date, run_group=run_group, run_name=run_name
+								, run_type=run_type, run_host=run_host, run_status_text=run_status_text)
 
-	def read_for_date(self, data_date):
+	def read_for_date(self, data_date, columns=None):
 		"""
 		Read all entries for a specific date
 
 		:param data_date: The data date
+		:param columns: Column names to select. Defaults to all.
 		:returns: DataFrame
 		"""
-		stmt = (
-			sql.select(self.table_def)
-			.where(self.c.data_dt == data_date)
-		)
-		data = self.execute_read(stmt)
-		return data
+		return self.read_where(columns=columns, data_date=data_date)
 
 
 
@@ -0,0 +1,180 @@
+
+# core python
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import datetime
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Set, Tuple, Union
+
+# native
+from domain.models import Transaction
+from domain.repositories import TransactionIndex
+from infrastructure.util.config import AppConfig
+
+if TYPE_CHECKING:  # Imported when needed, so the index can be used without the landing zone database configured
+    from infrastructure.sql_repositories import LZDBTransactionRepository
+
+
+@dataclass
+class TradeDateIndex:
+    """ Keys of every landing zone transaction for one trade date """
+    trade_date: datetime.date
+    keys: Set[Tuple] = field(default_factory=set)
+    high_water_mark: Any = None
+    refreshed_at: float = 0.0  # time.monotonic()
+
+
+class LZDBTransactionIndex(TransactionIndex):
+    """
+    In-memory index of landing zone transactions keyed by (TradeDate, PortfolioCode, security, Quantity), so
+    checking a transaction is a hash probe rather than a query:
+    - A trade date's transactions are loaded in bulk the first time it is probed
+    - Every refresh_interval_seconds, only rows modified after the date's high water mark are queried and added
+    - At most max_dates trade dates are held; the least recently probed is evicted first
+    - On a miss, a targeted query checks whether the transaction arrived since the last refresh
+    Loads and refreshes query outside the lock (which only guards looking up and swapping in a date's index), one at a
+    time per trade date; probes of a date being refreshed use its current index meanwhile.
+    Rows which are updated or deleted in the landing zone leave their previous key in the index until the date is evicted.
+    """
+
+    def __init__(self, repo: 'LZDBTransactionRepository', max_dates: int=5, refresh_interval_seconds: float=30.0
+                    , transaction_security_field: str='ProprietarySymbol'):
+        """
+        :param repo: Landing zone transactions
+        :param max_dates: Most trade dates to hold in memory at once
+        :param refresh_interval_seconds: How often to query for new/changed rows of a trade date being probed
+        :param transaction_security_field: Field of probed transactions holding the security, as the landing zone identifies it
+        """
+        self.repo = repo
+        self.max_dates = max_dates
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.transaction_security_field = transaction_security_field
+        self.dates: OrderedDict[datetime.date, TradeDateIndex] = OrderedDict()  # Least recently probed first
+        self.lock = threading.Lock()  # Transactions may be validated from worker threads
+        self.loading: Dict[datetime.date, threading.Lock] = {}  # Held while a trade date is loaded or refreshed
+        self.hits = 0
+        self.misses = 0
+        self.fallback_hits = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, repo: Union['LZDBTransactionRepository', None]=None, section: str='lz_index'):
+        from infrastructure.sql_repositories import LZDBTransactionRepository
+        return cls(
+            repo=repo or LZDBTransactionRepository(),
+            max_dates=AppConfig().getint(section, 'max_dates', fallback=5),
+            refresh_interval_seconds=AppConfig().getfloat(section, 'refresh_interval_seconds', fallback=30.0),
+            transaction_security_field=AppConfig().get(section, 'transaction_security_field', fallback='ProprietarySymbol'),
+        )
+
+    def key(self, transaction: Transaction, security_field: str) -> Union[Tuple, None]:
+        """ Normalized key, so values from the DB and from change events compare equal. None if any part is missing. """
+        trade_date = getattr(transaction, 'TradeDate', None)
+        portfolio_code = getattr(transaction, 'PortfolioCode', None)
+        security = getattr(transaction, security_field, None)
+        quantity = getattr(transaction, 'Quantity', None)
+        if trade_date is None or portfolio_code is None or security is None or quantity is None:
+            return None
+        if isinstance(trade_date, datetime.datetime):
+            trade_date = trade_date.date()
+        return (trade_date, str(portfolio_code).strip(), str(security).strip(), round(float(quantity), 8))
+
+    def contains(self, transaction: Transaction) -> Union[bool, None]:
+        key = self.key(transaction, self.transaction_security_field)
+        if key is None:
+            logging.debug(f'{self.cn}: cannot look up a transaction which lacks some of TradeDate, PortfolioCode, {self.transaction_security_field} or Quantity')
+            return None
+
+        date_index = self.trade_date_index(key[0])
+        if key in date_index.keys:
+            self.hits += 1
+            return True
+
+        # Miss: it may have landed since the last refresh
+        self.misses += 1
+        found = self.repo.get(trade_date=key[0], portfolio_code=key[1], security=key[2], quantity=getattr(transaction, 'Quantity'), columns=self.columns)
+        if found:
+            self.fallback_hits += 1
+            with self.lock:
+                date_index.keys.add(key)
+            return True
+        return False
+
+    def is_fresh(self, date_index: TradeDateIndex) -> bool:
+        return time.monotonic() - date_index.refreshed_at < self.refresh_interval_seconds
+
+    def trade_date_index(self, trade_date: datetime.date) -> TradeDateIndex:
+        with self.lock:
+            date_index = self.dates.get(trade_date)
+            if date_index is not None:
+                self.dates.move_to_end(trade_date)
+                if self.is_fresh(date_index):
+                    return date_index
+            loading = self.loading.setdefault(trade_date, threading.Lock())
+
+        if date_index is None:
+            loading.acquire()  # Nothing to probe until it's loaded
+        elif not loading.acquire(blocking=False):
+            return date_index  # Another thread is refreshing it, and misses are re-checked anyway
+        try:
+            with self.lock:
+                date_index = self.dates.get(trade_date)
+            if date_index is not None and self.is_fresh(date_index):
+                return date_index  # Loaded or refreshed by another thread meanwhile
+            date_index = self.load(trade_date) if date_index is None else self.refresh(date_index)
+            with self.lock:
+                self.dates[trade_date] = date_index
+                self.dates.move_to_end(trade_date)
+                while len(self.dates) > self.max_dates:
+                    evicted, _ = self.dates.popitem(last=False)
+                    self.loading.pop(evicted, None)
+                    self.evictions += 1
+                    logging.info(f'{self.cn}: evicted {evicted} to stay within {self.max_dates} trade dates')
+            return date_index
+        finally:
+            loading.release()
+
+    def load(self, trade_date: datetime.date) -> TradeDateIndex:
+        """ Bulk load every transaction for the trade date """
+        date_index = TradeDateIndex(trade_date=trade_date, refreshed_at=time.monotonic())
+        self.add(date_index, self.repo.iter_get(trade_date=trade_date, columns=self.columns))
+        self.loads += 1
+        logging.info(f'{self.cn}: loaded {len(date_index.keys)} {trade_date} transactions, up to {date_index.high_water_mark}')
+        return date_index
+
+    def refresh(self, date_index: TradeDateIndex) -> TradeDateIndex:
+        """ A copy of the date's index plus transactions modified since its high water mark, to swap in for it """
+        refreshed = TradeDateIndex(trade_date=date_index.trade_date, keys=set(date_index.keys)
+                                    , high_water_mark=date_index.high_water_mark, refreshed_at=time.monotonic())
+        if refreshed.high_water_mark is None:
+            transactions = self.repo.get(trade_date=refreshed.trade_date, columns=self.columns)  # Nothing loaded yet to measure from
+        else:
+            transactions = self.repo.get(trade_date=refreshed.trade_date, modified_after=refreshed.high_water_mark, columns=self.columns)
+        self.add(refreshed, transactions)
+        self.refreshes += 1
+        logging.debug(f'{self.cn}: refreshed {refreshed.trade_date} with {len(transactions)} transactions, up to {refreshed.high_water_mark}')
+        return refreshed
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """ The only columns the index needs from the landing zone """
+        return ('TradeDate', 'PortfolioCode', self.repo.security_field, 'Quantity', self.repo.high_water_mark_field)
+
+    def add(self, date_index: TradeDateIndex, transactions):
+        security_field, high_water_mark_field = self.repo.security_field, self.repo.high_water_mark_field
+        for t in transactions:
+            key = self.key(t, security_field)
+            if key is not None:
+                date_index.keys.add(key)
+            high_water_mark = getattr(t, high_water_mark_field, None)
+            if high_water_mark is not None and (date_index.high_water_mark is None or high_water_mark > date_index.high_water_mark):
+                date_index.high_water_mark = high_water_mark
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'fallback_hits': self.fallback_hits, 'loads': self.loads
+                , 'refreshes': self.refreshes, 'evictions': self.evictions, 'dates': len(self.dates)
+                , 'keys': sum([len(d.keys) for d in list(self.dates.values())])}
@@ -1,8 +1,84 @@
-
 from configparser import ConfigParser
 from dataclasses import dataclass
 import os
 import socket
+import threading
+import time
+
+
+# How often a config snapshot checks whether its file has changed on disk
+MTIME_CHECK_INTERVAL_SECONDS = 1.0
+
+_UNSET = object()  # Distinguishes "no fallback" from a fallback of None
+
+
+class ConfigSnapshot:
+    """
+    A config file parsed once and shared process-wide, until the file's mtime changes.
+    Looked-up values (including int/float/bool conversions) are cached. Treat as read-only.
+    """
+
+    def __init__(self, config_file_path: str):
+        self.config_file_path = config_file_path
+        self.mtime = self.get_mtime()
+        self.checked_at = time.monotonic()
+        self.parser = ConfigParser()
+        self.parser.read(config_file_path)
+        self.values = {}  # (converter, section, option, fallback) -> value
+
+    def get_mtime(self):
+        try:
+            return os.path.getmtime(self.config_file_path)
+        except OSError:
+            return None  # Missing file; ConfigParser.read ignores it too
+
+    def is_stale(self) -> bool:
+        """ Whether the file has changed since parsing. Only actually checks once per MTIME_CHECK_INTERVAL_SECONDS. """
+        now = time.monotonic()
+        if now - self.checked_at < MTIME_CHECK_INTERVAL_SECONDS:
+            return False
+        self.checked_at = now
+        return self.get_mtime() != self.mtime
+
+    def get(self, section: str, option: str, converter=None, fallback=_UNSET):
+        key = (converter, section, option, fallback)
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+
+        if fallback is _UNSET:
+            value = self.parser.get(section, option)
+        elif self.parser.has_option(section, option):
+            value = self.parser.get(section, option)
+        else:
+            # Like ConfigParser, fallbacks are returned as-is, without conversion
+            self.values[key] = fallback
+            return fallback
+
+        if converter is bool:
+            value = self.parser.getboolean(section, option)
+        elif converter is not None:
+            value = converter(value)
+        self.values[key] = value
+        return value
+
+
+_SNAPSHOTS = {}  # config file path -> ConfigSnapshot
+_SNAPSHOTS_LOCK = threading.Lock()
+
+
+def get_config_snapshot(config_file_path: str) -> ConfigSnapshot:
+    """ Get the current snapshot of a config file, (re)parsing it only if new or changed on disk """
+    snapshot = _SNAPSHOTS.get(config_file_path)
+    if snapshot is None or snapshot.is_stale():
+        with _SNAPSHOTS_LOCK:
+            # Another thread may have just reloaded it
+            current = _SNAPSHOTS.get(config_file_path)
+            if current is None or current is snapshot:
+                current = _SNAPSHOTS[config_file_path] = ConfigSnapshot(config_file_path)
+            snapshot = current
+    return snapshot
 
 
 @dataclass
@@ -11,16 +87,32 @@ class AppConfig:
     config_file_path: str = os.path.join(os.path.abspath(__file__), os.pardir, os.pardir, os.pardir, 'config.ini')
 
     def __post_init__(self):
-        # Now create parser
-        self.parser = ConfigParser()
-        self.parser.read(self.config_file_path)
+        # Now get the (shared) parsed config
+        self.snapshot = get_config_snapshot(self.config_file_path)
+        self.parser = self.snapshot.parser
 
     def get(self, *args, **kwargs):
         """ Syntactic sugar to facilitate AppConfig().get(...) rather than AppConfig().parser.get(...) """
+        if len(args) == 2 and kwargs.keys() <= {'fallback'}:
+            try:
+                return self.snapshot.get(*args, **kwargs)
+            except TypeError:
+                pass  # Unhashable fallback; can't be cached
         return self.parser.get(*args, **kwargs)
 
+    def getint(self, section: str, option: str, fallback=_UNSET):
+        """ Like get, but converted to int (once, then cached) """
+        return self.snapshot.get(section, option, converter=int, fallback=fallback)
+
+    def getfloat(self, section: str, option: str, fallback=_UNSET):
+        """ Like get, but converted to float (once, then cached) """
+        return self.snapshot.get(section, option, converter=float, fallback=fallback)
+
+    def getboolean(self, section: str, option: str, fallback=_UNSET):
+        """ Like get, but converted to bool using ConfigParser's rules (once, then cached) """
+        return self.snapshot.get(section, option, converter=bool, fallback=fallback)
+
     def __str__(self):
         with open(self.config_file_path, 'r') as f:
             config_file_content = f.read()
         return config_file_content
-
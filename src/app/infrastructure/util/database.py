@@ -9,7 +9,11 @@ import weakref
 
 # pypi
 import pandas as pd
-from sqlalchemy import MetaData, create_engine, sql
+from sqlalchemy import MetaData, create_engine, event, sql
+try:
+    import pyarrow
+except ImportError:  # pyarrow is optional; columnar reads fall back to typed NumPy columns
+    pyarrow = None
 
 # native
 from infrastructure.util.config import AppConfig
@@ -99,6 +103,14 @@ def get_engine(config_section: str):
             engine_args['pool_timeout'] = int(sqlalchemy_pool_timeout)
             logging.debug('SQLAlchemy engine creation: adding pool timeout {}'.format(engine_args['pool_timeout']))
         engine = create_engine(**engine_args)
+
+        # Server-side query timeout, so a hung query raises rather than blocking its thread (and process exit) forever
+        query_timeout_seconds = AppConfig().getint(config_section, 'query_timeout_seconds', fallback=0)
+        if query_timeout_seconds:
+            def set_query_timeout(dbapi_connection, connection_record):
+                dbapi_connection.timeout = query_timeout_seconds  # pyodbc: seconds before a query is cancelled
+            event.listen(engine, 'connect', set_query_timeout)
+            logging.debug(f'SQLAlchemy engine creation: adding query timeout {query_timeout_seconds}s')
         _DB_ENGINE_CACHE[key] = engine
 
     return _DB_ENGINE_CACHE[key]
@@ -157,14 +169,22 @@ class BaseDB(object):
         self.engine = get_engine(self.config_section)
         self.meta = get_metadata(self.config_section)
 
-    def execute_read(self, sql_stmt, log_query=False):
+    @property
+    def columnar_backend(self) -> str:
+        """ 'pyarrow' or 'numpy': what columnar reads convert to. See to_columnar. """
+        return AppConfig().get(self.config_section, 'columnar_backend', fallback='pyarrow' if pyarrow else 'numpy')
+
+    def execute_read(self, sql_stmt, log_query=False, params=None, chunk_size=None, columnar=False):
         """
         Safely execute a SELECT statement. Execution is done in a transaction that is not
         committed to handle the case when an insert statement is passed by mistake
 
         :param sql_stmt: SqlAlchemy statement
         :param log_query: Set to log compiled query
-        :return: Pandas DataFrame with results
+        :param params: Values for the statement's bind parameters, if any
+        :param chunk_size: If provided, stream the results rather than materialising them all at once
+        :param columnar: Set to convert columns of Python objects to native types. See to_columnar.
+        :return: Pandas DataFrame with results, or if chunk_size is provided, an iterator of DataFrames of up to chunk_size rows
         """
         if log_query:
             logging.info('=== SQL START ===')
@@ -176,12 +196,69 @@ class BaseDB(object):
         # TODO: revisit this ... is this ok?
         # sql_stmt = sql_stmt.with_hint()
 
+        if chunk_size is not None:
+            return self._execute_read_chunks(sql_stmt, params, chunk_size, columnar)
+
         # Create transaction to run statement in and don't commit for failsafe
         with self.engine.begin() as connection:
-            data = pd.read_sql_query(sql_stmt, connection, coerce_float=False)
+            data = pd.read_sql_query(sql_stmt, connection, params=params, coerce_float=False)
 
+        if columnar:
+            data = to_columnar(data, backend=self.columnar_backend)
         return data
 
+    def execute_read_records(self, sql_stmt, record_class, params=None, field_map=None, chunk_size=None):
+        """
+        Execute a SELECT statement like execute_read, but build record_class instances straight from the result rows,
+        skipping the DataFrame. See record_factory.
+
+        :param sql_stmt: SqlAlchemy statement
+        :param record_class: Class of record to build for each row
+        :param params: Values for the statement's bind parameters, if any
+        :param field_map: Column name -> record field name, for columns named differently from their fields
+        :param chunk_size: If provided, stream the results, fetching chunk_size rows at a time
+        :return: List of records, or if chunk_size is provided, an iterator of records
+        """
+        if chunk_size is not None:
+            return self._execute_read_records_chunks(sql_stmt, record_class, params, field_map, chunk_size)
+
+        with self.engine.begin() as connection:
+            result = connection.execute(sql_stmt, params or {})
+            make_record = record_factory(record_class, result.keys(), field_map)
+            return list(map(make_record, result))
+
+    def _execute_read_records_chunks(self, sql_stmt, record_class, params, field_map, chunk_size):
+        with self.engine.begin() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(sql_stmt, params or {})
+            make_record = record_factory(record_class, result.keys(), field_map)
+            for rows in result.partitions():
+                yield from map(make_record, rows)
+
+    def _execute_read_chunks(self, sql_stmt, params, chunk_size, columnar=False):
+        """
+        Stream results, chunk_size rows at a time, using a server-side cursor where the driver supports one
+        (otherwise rows are still fetched chunk_size at a time). The connection is held until the iterator is exhausted or closed.
+        With columnar, a column which is all NULL in a chunk gets its type from an earlier chunk; until a chunk has a
+        value for it (e.g. if it is all NULL in the first chunk), it is left as objects.
+        """
+        with self.engine.begin() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(sql_stmt, params or {})
+            columns = list(result.keys())
+            backend = self.columnar_backend if columnar else None
+            dtypes = {}  # Column -> its type in the latest chunk which had values for it
+            for rows in result.partitions():
+                chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=False)
+                if not columnar:
+                    yield chunk
+                    continue
+                chunk = to_columnar(chunk, backend=backend)
+                for column in chunk.columns:
+                    if chunk[column].dtype != object:
+                        dtypes[column] = chunk[column].dtype
+                    elif column in dtypes and chunk[column].isna().all():
+                        chunk[column] = chunk[column].astype(dtypes[column])
+                yield chunk
+
     def execute_write(self, sql_stmt, log_query=False, commit=None):
         """
         Execute an INSERT, UPDATE, or DELETE statement. Execution is done in a transaction and
@@ -215,6 +292,80 @@ class BaseDB(object):
         return data
 
 
+def to_columnar(frame, backend='numpy', dictionary_max_ratio=0.5):
+    """
+    Convert columns of boxed Python objects, as read with coerce_float=False, to native column types so that
+    filtering and comparing them (e.g. TradeDate == SettleDate) is vectorized:
+    - Decimals become float64 (numpy) or Arrow decimals (pyarrow)
+    - Dates and datetimes become datetime64 (numpy) or Arrow dates/timestamps (pyarrow)
+    - Integers and booleans with NULLs become nullable Int64 / boolean (numpy) or Arrow integers/booleans (pyarrow)
+    - Strings become categoricals (i.e. dictionary-encoded) where at most dictionary_max_ratio of values are distinct,
+      otherwise string columns
+    Columns which are already typed, or hold mixed types, are left as they are.
+
+    :param frame: DataFrame to convert. Not modified.
+    :param backend: 'numpy' or 'pyarrow' (which needs pyarrow installed)
+    :param dictionary_max_ratio: Most distinct values per row for a string column to be dictionary-encoded
+    :returns: DataFrame
+    """
+    if backend == 'pyarrow' and pyarrow is None:
+        raise ImportError('Columnar reads with the pyarrow backend need pyarrow installed')
+
+    converted = {}
+    for column in frame.columns:
+        values = frame[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            continue
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred == 'string':
+            if values.nunique() <= dictionary_max_ratio * len(values):
+                converted[column] = values.astype('category')
+            elif values.dtype == object:
+                converted[column] = values.astype(pd.ArrowDtype(pyarrow.string()) if backend == 'pyarrow' else 'string')
+        elif values.dtype != object:
+            continue
+        elif backend == 'pyarrow':
+            if inferred in ('decimal', 'date', 'datetime', 'integer', 'boolean', 'floating'):
+                converted[column] = pd.Series(pd.arrays.ArrowExtensionArray(pyarrow.array(values, from_pandas=True)), index=values.index)
+        elif inferred == 'decimal' or inferred == 'floating':
+            converted[column] = pd.to_numeric(values, errors='coerce').astype('float64')
+        elif inferred in ('date', 'datetime'):
+            converted[column] = pd.to_datetime(values)
+        elif inferred == 'integer':
+            converted[column] = values.astype('Int64')
+        elif inferred == 'boolean':
+            converted[column] = values.astype('boolean')
+
+    if converted:
+        frame = frame.copy(deep=False)
+        for column, values in converted.items():
+            frame[column] = values
+    return frame
+
+
+def decategorize(values):
+    """ Undo to_columnar's dictionary encoding of a column, e.g. to compare it with another column (categoricals only compare if their categories match) """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(values.cat.categories.dtype)
+    return values
+
+
+def record_factory(record_class, columns, field_map=None):
+    """
+    Precompute how to build a record_class instance from a row with these columns
+
+    :param record_class: Either a compact record type (see domain.models.CompactRecord), which is laid out per the
+        columns and built from each row as is, or a class with a from_dict classmethod
+    :param columns: Column names, in row order
+    :param field_map: Column name -> record field name, for columns named differently from their fields
+    :returns: Function taking a row and returning a record
+    """
+    fields = tuple([(field_map or {}).get(c, c) for c in columns])
+    if hasattr(record_class, 'with_fields'):
+        return record_class.with_fields(fields).from_values
+    return lambda row: record_class.from_dict(dict(zip(fields, row)))
+
+
 def _convert_to_df(rows, description):
     """
     Convert pyodbc result to dataframe
@@ -226,19 +377,12 @@ def _convert_to_df(rows, description):
     # Description is a list of tuples. Each tuple is of the form (column name, type code,
     # display size, internal size, precision, scale, nullable). Extract just column names
     columns = [col_description[0] for col_description in description]
+    if rows and len(rows[0]) != len(columns):
+        raise ValueError(f'Rows have {len(rows[0])} values but there are {len(columns)} columns')
 
-    # Create dict that we can turn into a dataframe
-    df_dict = {}
-    for column in columns:
-        df_dict[column] = []
-
-    # Go through each row and add the values to the dict
-    for row in rows:
-        assert len(row) == len(columns)
-        for i, val in enumerate(row):
-            df_dict[columns[i]].append(val)
-
-    return pd.DataFrame(df_dict)
+    # Transpose rows to columns in one pass, rather than appending value by value
+    values = zip(*rows) if rows else [[] for _ in columns]
+    return pd.DataFrame({column: list(column_values) for column, column_values in zip(columns, values)})
 
 
 def execute_multi_query(conn, query_str):
@@ -0,0 +1,151 @@
+"""
+Process related utils
+"""
+
+# core python
+from dataclasses import dataclass, field
+import datetime
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+
+def report_stats(stats_queue: multiprocessing.Queue, child_index: int, get_stats: Callable[[], dict], interval_seconds: float=30.0):
+    """
+    Start a daemon thread in a child process which periodically sends its stats to the supervising parent
+
+    :param stats_queue: Queue shared with the parent ProcessSupervisor
+    :param child_index: Index of this child process
+    :param get_stats: Returns a dict of stats. Should include 'processed', the number of messages processed so far.
+    :param interval_seconds: How often to report
+    :return: The started thread
+    """
+    def _report():
+        while True:
+            time.sleep(interval_seconds)
+            stats = dict(get_stats())
+            stats.update({'child_index': child_index, 'reported_at': datetime.datetime.now()})
+            stats_queue.put(stats)
+
+    t = threading.Thread(target=_report, name=f'stats-reporter-{child_index}', daemon=True)
+    t.start()
+    return t
+
+
+@dataclass
+class ProcessSupervisor:
+    """
+    Start process_count child processes running target(child_index, stats_queue, *args), restart any which exit,
+    and periodically log a health/throughput summary based on the stats they report via report_stats.
+    A child is restarted restart_delay_seconds after it exits, doubling (up to max_restart_delay_seconds) each time it
+    exits again within stable_seconds of starting, so one which can't start (e.g. bad config, DB down) isn't restarted
+    in a tight loop. Restarts are scheduled rather than waited for, so the other children are still supervised meanwhile.
+    """
+    target: Callable
+    process_count: int
+    args: tuple = ()
+    restart_delay_seconds: float = 5.0
+    max_restart_delay_seconds: float = 300.0
+    stable_seconds: float = 300.0  # Uptime after which a child's restart delay goes back to restart_delay_seconds
+    summary_interval_seconds: float = 60.0
+    processes: Dict[int, multiprocessing.Process] = field(default_factory=dict)
+    restarts: Dict[int, int] = field(default_factory=dict)
+    stats: Dict[int, dict] = field(default_factory=dict)
+    started_at: Dict[int, float] = field(default_factory=dict)  # time.monotonic()
+    restart_delays: Dict[int, float] = field(default_factory=dict)  # Delay before each child's latest restart
+    next_restart_at: Dict[int, float] = field(default_factory=dict)  # time.monotonic(), for children waiting to restart
+
+    @property
+    def cn(self):  # Class name. Avoids having to print/log type(self).__name__.
+        return type(self).__name__
+
+    def run(self):
+        """ Supervise children until interrupted """
+        self.stats_queue = multiprocessing.Queue()
+        for i in range(self.process_count):
+            self.start_child(i)
+
+        last_summary_time = time.monotonic()
+        last_summary_processed = 0
+        try:
+            while True:
+                self.drain_stats(timeout=1.0)
+
+                # Schedule restarts of children which have exited, and restart those which are due
+                now = time.monotonic()
+                for i, p in list(self.processes.items()):
+                    if p.is_alive():
+                        continue
+                    if i not in self.next_restart_at:
+                        delay = self.restart_delay(i, now)
+                        self.next_restart_at[i] = now + delay
+                        logging.warning(f'{self.cn}: child {i} (PID {p.pid}) exited with code {p.exitcode} after '
+                                            f'{now - self.started_at[i]:.0f}s; restarting in {delay:g}s')
+                    elif now >= self.next_restart_at[i]:
+                        del self.next_restart_at[i]
+                        self.restarts[i] = self.restarts.get(i, 0) + 1
+                        self.start_child(i)
+
+                if time.monotonic() - last_summary_time >= self.summary_interval_seconds:
+                    elapsed = time.monotonic() - last_summary_time
+                    last_summary_processed = self.log_summary(elapsed, last_summary_processed)
+                    last_summary_time = time.monotonic()
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def restart_delay(self, child_index: int, now: float) -> float:
+        """ How long to wait before restarting a child which has just exited, doubling while it keeps exiting soon after starting """
+        previous = self.restart_delays.get(child_index)
+        if previous is None or now - self.started_at[child_index] >= self.stable_seconds:
+            delay = self.restart_delay_seconds
+        else:
+            delay = min(previous * 2, self.max_restart_delay_seconds)
+        self.restart_delays[child_index] = delay
+        return delay
+
+    def start_child(self, child_index: int):
+        p = multiprocessing.Process(target=self.target, args=(child_index, self.stats_queue, *self.args), name=f'child-{child_index}')
+        p.start()
+        self.processes[child_index] = p
+        self.started_at[child_index] = time.monotonic()
+        logging.info(f'{self.cn}: started child {child_index} with PID {p.pid}')
+
+    def drain_stats(self, timeout: float):
+        """ Wait up to timeout for the first report, then collect whatever else has been reported """
+        try:
+            stats = self.stats_queue.get(timeout=timeout)
+            while True:
+                self.stats[stats['child_index']] = stats
+                stats = self.stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def log_summary(self, elapsed_seconds: float, previous_processed: int) -> int:
+        """ Log health and throughput across children. Returns the total processed, for the next summary. """
+        now = datetime.datetime.now()
+        total_processed = sum([s.get('processed', 0) for s in self.stats.values()])
+        rate = max(total_processed - previous_processed, 0) / elapsed_seconds if elapsed_seconds else 0
+        lines = [f'{self.cn}: {sum([p.is_alive() for p in self.processes.values()])}/{self.process_count} children alive, '
+                    f'{total_processed} messages processed ({rate:.1f}/s over the last {elapsed_seconds:.0f}s)']
+        for i, p in sorted(self.processes.items()):
+            s = self.stats.get(i, {})
+            reported_ago = f"{(now - s['reported_at']).total_seconds():.0f}s ago" if 'reported_at' in s else 'never'
+            state = 'alive' if p.is_alive() else f'dead, restarting in {max(self.next_restart_at.get(i, 0) - time.monotonic(), 0):.0f}s'
+            lines.append(f'    child {i}: PID {p.pid}, {state}, {self.restarts.get(i, 0)} restarts, '
+                            f"{s.get('processed', 0)} processed, last message at {s.get('last_message_time')}, last reported {reported_ago}")
+        logging.info('\n'.join(lines))
+        return total_processed
+
+    def stop(self, timeout_seconds: float=30.0):
+        logging.info(f'{self.cn}: stopping {len(self.processes)} children...')
+        for p in self.processes.values():
+            p.join(timeout=timeout_seconds)
+            if p.is_alive():
+                logging.warning(f'{self.cn}: child PID {p.pid} did not exit; terminating')
+                p.terminate()
@@ -0,0 +1,80 @@
+"""
+Query result cache related utils
+"""
+
+# core python
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+
+class QueryResultCache:
+    """
+    Caches query results for ttl_seconds, holding at most max_entries (least recently used are evicted first).
+    Concurrent requests for the same key while it is being loaded wait for that one load, rather than each querying.
+    Failed loads are not cached.
+    """
+
+    def __init__(self, ttl_seconds: float=60.0, max_entries: int=32, name: str='query cache'):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.name = name
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()  # key -> (expires at, result), least recently used first
+        self.in_flight = {}  # key -> Future of the load in progress
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """ Get the cached result for key, or call load (once, however many threads ask at the same time) """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                is_loader = False
+            else:
+                future = self.in_flight[key] = Future()
+                self.misses += 1
+                is_loader = True
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            result = load()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        future.set_result(result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'evictions': self.evictions, 'size': len(self.entries)}
+
+    def __str__(self):
+        return f'{self.name}: {self.stats()}'
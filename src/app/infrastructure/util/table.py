@@ -17,9 +17,13 @@ from sqlalchemy.exc import IntegrityError
 from infrastructure.util.database import BaseDB
 from infrastructure.util.file import prepare_file_path, get_unc_path
 from infrastructure.util.config import AppConfig
+from infrastructure.util.query_cache import QueryResultCache
 
 
 
+_RESULT_CACHES = {}  # table class -> QueryResultCache, for classes which set cache_results
+
+
 BULK_INSERT_STMT = r"""
 BULK INSERT {}
 FROM '{}'
@@ -37,12 +41,23 @@ class BaseTable(object):
     Base class for representations of database tables. Given a database and table name, this class
     will reflect the table and then provide accessors to the columns and a generic query function.
     Custom or complex sql queries can use table_def to build the query.
+
+    Subclasses may set cache_results to share read results between all instances of the class for cache_ttl_seconds
+    (overridable via query_cache_ttl_seconds in the config section). Identical concurrent reads then make one round trip.
+
+    Subclasses may list the equality filters their reads accept in filter_columns, and read through read_where, which
+    builds one parameterised statement template per combination of projected columns and filters used, then reuses it.
     """
     config_section = None
     schema = 'dbo'
     table_name = None
     is_rotatable = False
     _database = None
+    cache_results = False
+    cache_ttl_seconds = 60.0
+    cache_max_entries = 32
+    filter_columns = {}  # Filter (bind parameter) name -> column name, for read_where
+    field_map = {}  # Column name -> record field name, for reads which build records (see execute_read_records)
 
     def __init__(self):
         """
@@ -66,6 +81,10 @@ class BaseTable(object):
         else:
             self.table_def = self.create_table_def()
 
+        # Statement templates, built on first use. See read_where.
+        self._templates = {}  # (columns, filter names) -> statement
+        self._compiled_templates = {}  # id(statement) -> (statement, compiled SQL)
+
     def create_table_def(self):
         """
         Function to create table def if table is not in metadata. Override this function to provide
@@ -93,16 +112,113 @@ class BaseTable(object):
         """
         return self._database.execute_write(sql_stmt, commit=commit)
 
-    def execute_read(self, sql_stmt):
+    def execute_read(self, sql_stmt, params=None, hint=True, chunk_size=None, columnar=False):
         """
         Syntactic sugar to aviod table.database.execute...
 
         :param sql_stmt: Statement to execute
-        :returns: Dataframe of results
+        :param params: Values for the statement's bind parameters, e.g. for a statement template
+        :param hint: Whether to add the NOLOCK hint. Statement templates already have it.
+        :param chunk_size: If provided, stream the results chunk_size rows at a time. Streamed results are never cached.
+        :param columnar: Set to get natively typed columns rather than Python objects. See database.py::to_columnar
+        :returns: Dataframe of results, or if chunk_size is provided, an iterator of DataFrames
         """
 
-        sql_stmt = sql_stmt.with_hint(self.table_def, text='WITH (NOLOCK)')
-        return self._database.execute_read(sql_stmt)
+        if hint:
+            sql_stmt = sql_stmt.with_hint(self.table_def, text='WITH (NOLOCK)')
+        if chunk_size is not None or not self.cache_results:
+            return self._database.execute_read(sql_stmt, params=params, chunk_size=chunk_size, columnar=columnar)
+
+        key = self.cache_key(sql_stmt, params) + (('columnar',) if columnar else ())
+        result = self.result_cache().get_or_load(key, lambda: self._database.execute_read(sql_stmt, params=params, columnar=columnar))
+        # Shallow copy, so callers adding or dropping columns don't affect the cached result
+        return result.copy(deep=False)
+
+    def execute_read_records(self, sql_stmt, record_class, params=None, hint=True, chunk_size=None):
+        """
+        Like execute_read, but returns record_class instances built straight from the result rows, named per field_map
+
+        :returns: List of records, or if chunk_size is provided, an iterator of records
+        """
+        if hint:
+            sql_stmt = sql_stmt.with_hint(self.table_def, text='WITH (NOLOCK)')
+        if chunk_size is not None or not self.cache_results:
+            return self._database.execute_read_records(sql_stmt, record_class, params=params, field_map=self.field_map, chunk_size=chunk_size)
+
+        key = self.cache_key(sql_stmt, params) + (record_class,)
+        result = self.result_cache().get_or_load(key, lambda: self._database.execute_read_records(sql_stmt, record_class, params=params, field_map=self.field_map))
+        # Copy the list, so callers adding or removing records don't affect the cached result
+        return list(result)
+
+    def result_cache(self) -> QueryResultCache:
+        """ Get the result cache shared by all instances of this class """
+        cache = _RESULT_CACHES.get(type(self))
+        if cache is None:
+            cache = _RESULT_CACHES.setdefault(type(self), QueryResultCache(
+                ttl_seconds=AppConfig().getfloat(self.config_section, 'query_cache_ttl_seconds', fallback=self.cache_ttl_seconds),
+                max_entries=AppConfig().getint(self.config_section, 'query_cache_max_entries', fallback=self.cache_max_entries),
+                name=f'{type(self).__name__} result cache',
+            ))
+        return cache
+
+    def cache_key(self, sql_stmt, params=None):
+        """ The statement as compiled for this database, plus its bound parameters """
+        template = self._compiled_templates.get(id(sql_stmt))
+        if template is not None and template[0] is sql_stmt:
+            compiled_sql, bound = template[1], (params or {})
+        else:
+            compiled = sql_stmt.compile(dialect=self._database.engine.dialect)
+            compiled_sql, bound = str(compiled), compiled.construct_params(params)
+        bound = tuple(sorted([(k, tuple(v) if isinstance(v, list) else v) for k, v in bound.items()]))
+        return (self.config_section, compiled_sql, bound)
+
+    def projection(self, columns=None):
+        """
+        What to select: the whole table if columns is not provided, otherwise just those columns.
+        Columns the table doesn't have are skipped, since callers may ask several tables for the same columns, but
+        logged as a warning, since anything which needs them will fail later.
+        """
+        if columns is None:
+            return [self.table_def]
+        selected = [self.c[c] for c in columns if c in self.c]
+        if len(selected) < len(columns):
+            logging.warning(f'{self.table_name} lacks columns {[c for c in columns if c not in self.c]}; not selecting them')
+        return selected or [self.table_def]
+
+    def template(self, columns=None, filter_names=()):
+        """
+        Get (building once) the statement selecting columns where each filter's column equals its bind parameter
+
+        :param columns: Column names to select, or None for all
+        :param filter_names: Names from filter_columns
+        :returns: Statement, with the NOLOCK hint
+        """
+        key = (None if columns is None else tuple(columns), tuple(filter_names))
+        stmt = self._templates.get(key)
+        if stmt is None:
+            stmt = sql.select(*self.projection(columns))
+            for name in filter_names:
+                stmt = stmt.where(self.c[self.filter_columns[name]] == sql.bindparam(name))
+            stmt = self._templates[key] = stmt.with_hint(self.table_def, text='WITH (NOLOCK)')
+            self._compiled_templates[id(stmt)] = (stmt, str(stmt.compile(dialect=self._database.engine.dialect)))
+        return stmt
+
+    def read_where(self, columns=None, chunk_size=None, record_class=None, columnar=False, **filters):
+        """
+        Read rows matching every filter which isn't None, via a statement template
+
+        :param columns: Column names to select, or None for all
+        :param chunk_size: If provided, stream the results chunk_size rows at a time
+        :param record_class: If provided, return records of this class rather than DataFrames. See execute_read_records.
+        :param columnar: Set to get DataFrames with natively typed columns. See execute_read.
+        :param filters: Filter name (see filter_columns) -> value
+        :returns: DataFrame, or if chunk_size is provided, an iterator of DataFrames (or records, if record_class is provided)
+        """
+        params = {k: v for k, v in filters.items() if v is not None}
+        stmt = self.template(columns, tuple(sorted(params)))
+        if record_class is not None:
+            return self.execute_read_records(stmt, record_class, params=params, hint=False, chunk_size=chunk_size)
+        return self.execute_read(stmt, params=params, hint=False, chunk_size=chunk_size, columnar=columnar)
 
     def read(self):
         """
@@ -0,0 +1,72 @@
+"""
+Worker thread related utils
+"""
+
+# core python
+import logging
+import queue
+import threading
+from typing import Any, Callable, Hashable
+
+
+_STOP = object()  # Sentinel telling a worker thread to exit
+
+
+class KeyedWorkerPool:
+    """
+    Pool of worker threads, each with its own bounded queue. Items submitted with the same key always go to
+    the same worker, so they are processed in the order submitted. Items with different keys may be processed in parallel.
+    """
+
+    def __init__(self, worker_count: int, queue_size: int, target: Callable[[Any], Any], name: str='worker'):
+        """
+        Create and start the worker threads
+
+        :param worker_count: Number of worker threads
+        :param queue_size: Max number of items waiting per worker. Once full, submit returns False.
+        :param target: Function each worker calls for every item it receives
+        :param name: Prefix for worker thread names
+        """
+        self.target = target
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(worker_count)]
+        self.threads = [threading.Thread(target=self._run, args=(q,), name=f'{name}-{i}', daemon=True)
+                        for i, q in enumerate(self.queues)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, key: Hashable, item: Any) -> bool:
+        """
+        Queue an item for the worker which owns the key, without blocking
+
+        :return: True if queued, False if that worker's queue is full
+        """
+        q = self.queues[hash(key) % len(self.queues)]
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def join(self):
+        """ Block until every item submitted so far has been processed """
+        for q in self.queues:
+            q.join()
+
+    def stop(self):
+        """ Process whatever is already queued, then stop the worker threads """
+        for q in self.queues:
+            q.put(_STOP)
+        for t in self.threads:
+            t.join()
+
+    def _run(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                self.target(item)
+            except Exception as e:
+                logging.exception(f'{threading.current_thread().name} failed processing {item}: {e}')
+            finally:
+                q.task_done()
@@ -0,0 +1,93 @@
+
+# core python
+import datetime
+from decimal import Decimal
+import os
+import sys
+import unittest
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# pypi
+import pandas as pd
+
+# native
+from application.declarative_rules import DeclarativeRule, RuleDefinition
+from application.validation_rules import TransactionPostedAfterBlotterSent, TransactionQuantityMax100
+from domain.models import Blotter, BlotterSendStatus
+from domain.repositories import BlotterRepository
+from infrastructure.util.database import pyarrow, to_columnar
+
+
+class SentBlotterRepository(BlotterRepository):
+    """ Every blotter was sent on SENT_DATE; there are none for other dates """
+    SENT_DATE = datetime.date(2024, 1, 2)
+
+    def create(self, blotter: Blotter) -> int:
+        raise NotImplementedError
+
+    def get(self, settlement_criteria=None, type_=None, trade_date=None):
+        if trade_date != self.SENT_DATE:
+            return []
+        return [Blotter(settlement_criteria=settlement_criteria, type_=type_, trade_date=trade_date, status=BlotterSendStatus.SUCCESS)]
+
+
+def sample_frame() -> pd.DataFrame:
+    """ Rows as read with coerce_float=False (Decimals, dates, padded codes), with NULLs in every column """
+    d1, d2 = datetime.date(2024, 1, 1), SentBlotterRepository.SENT_DATE
+    return pd.DataFrame({
+        'Quantity': [Decimal('150.5'), None, Decimal('3'), Decimal('1000.25'), None],
+        'TradeDate': [d1, d2, None, d2, d2],
+        'SettleDate': [d1, d2, d2, None, d2],
+        'TransactionCode': ['by  ', None, 'sl', 'wd', 'by'],
+        'PortfolioID': [1, 2, None, 4, 5],
+    })
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestBatchRulesOnArrowColumns(unittest.TestCase):
+    """ Each batch rule, on a frame converted with the pyarrow backend, gives the same mask as on plain objects """
+
+    def setUp(self):
+        self.objects = sample_frame()
+        self.columnar = to_columnar(self.objects, backend='pyarrow')
+
+    def assert_mask(self, rule, expected):
+        for name, frame in (('objects', self.objects), ('pyarrow', self.columnar)):
+            with self.subTest(rule=str(rule), frame=name):
+                mask = rule.is_broken_batch(frame)
+                self.assertTrue(mask.index.equals(frame.index))
+                self.assertEqual(mask.fillna(False).astype(bool).tolist(), expected)
+
+    def test_columns_are_arrow(self):
+        self.assertIsInstance(self.columnar['Quantity'].dtype, pd.ArrowDtype)
+        self.assertIsInstance(self.columnar['TradeDate'].dtype, pd.ArrowDtype)
+
+    def test_quantity_max_100(self):
+        self.assert_mask(TransactionQuantityMax100(), [True, False, False, True, False])
+
+    def test_posted_after_blotter_sent(self):
+        # Row 2 has no TradeDate; row 3 has no SettleDate, so is T+1, and T+1 blotters were sent too
+        self.assert_mask(TransactionPostedAfterBlotterSent(blotter_repo=SentBlotterRepository()), [False, True, False, True, True])
+
+    def test_declarative_comparison(self):
+        rule = DeclarativeRule(RuleDefinition.from_options('quantity_max_1000', {'field': 'Quantity', 'broken_when': 'gt', 'value': '1000'}))
+        self.assert_mask(rule, [False, False, False, True, False])
+
+    def test_declarative_date_comparison(self):
+        rule = DeclarativeRule(RuleDefinition.from_options('traded_this_year', {'field': 'TradeDate', 'broken_when': 'ge', 'value': '2024-01-02'}))
+        self.assert_mask(rule, [False, True, False, True, True])
+
+    def test_declarative_string_comparison(self):
+        rule = DeclarativeRule(RuleDefinition.from_options('buys', {'field': 'TransactionCode', 'broken_when': 'eq', 'value': 'by'}))
+        self.assert_mask(rule, [True, False, False, False, True])
+
+    def test_declarative_membership(self):
+        rule = DeclarativeRule(RuleDefinition.from_options('denied_portfolios', {'field': 'PortfolioID', 'broken_when': 'in', 'values': '2, 4'}))
+        self.assert_mask(rule, [False, True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+
+# core python
+import datetime
+from decimal import Decimal
+import json
+import os
+import sys
+import unittest
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# native
+from application.validation_contexts import TransactionValidationContext
+from application.validation_rules import TransactionNotFoundInLZ
+from domain.models import Transaction
+from domain.repositories import IdentifierRepository
+from infrastructure.message_decoders import FastDebeziumTransactionDecoder
+from infrastructure.transaction_indexes import LZDBTransactionIndex
+
+
+TRADE_DATE = datetime.date(2024, 3, 18)
+EPOCH_DAYS = (TRADE_DATE - datetime.date(1970, 1, 1)).days
+
+
+class LandingZoneRepository:
+    """ Stands in for LZDBTransactionRepository: the landing zone holds one transaction, LW0100's 250 of ABC """
+    security_field = 'ProprietarySymbol'
+    high_water_mark_field = 'ModifiedAt'
+
+    def __init__(self):
+        self.transactions = [Transaction(TradeDate=TRADE_DATE, PortfolioCode='LW0100', ProprietarySymbol='ABC'
+                                            , Quantity=Decimal('250'), ModifiedAt=1)]
+
+    def iter_get(self, trade_date=None, columns=None):
+        return iter([t for t in self.transactions if t.TradeDate == trade_date])
+
+    def get(self, trade_date=None, portfolio_code=None, security=None, quantity=None, modified_after=None, columns=None):
+        return [t for t in self.transactions if t.TradeDate == trade_date and (portfolio_code is None or t.PortfolioCode == portfolio_code)
+                    and (security is None or t.ProprietarySymbol == security) and (quantity is None or t.Quantity == Decimal(quantity))
+                    and (modified_after is None or t.ModifiedAt > modified_after)]
+
+
+class APXIdentifiers(IdentifierRepository):
+    """ Stands in for APXDBIdentifierRepository, counting lookups """
+
+    def __init__(self):
+        self.portfolio_codes = {100: 'LW0100', 101: 'LW0101'}
+        self.proprietary_symbols = {5000: 'ABC'}
+        self.lookups = 0
+
+    def get_portfolio_code(self, portfolio_id):
+        self.lookups += 1
+        return self.portfolio_codes.get(portfolio_id)
+
+    def get_proprietary_symbol(self, security_id):
+        self.lookups += 1
+        return self.proprietary_symbols.get(security_id)
+
+
+def debezium_transaction(portfolio_id: int, security_id: int, quantity: str) -> Transaction:
+    """ A transaction as the consumer gets it: decoded from a Debezium create event, so with IDs rather than codes """
+    after = {'PortfolioTransactionID': 1, 'PortfolioID': portfolio_id, 'TransactionCode': 'by', 'TradeDate': EPOCH_DAYS
+                , 'SettleDate': EPOCH_DAYS + 1, 'SecurityID1': security_id, 'Quantity': quantity}
+    message = json.dumps({'schema': None, 'payload': {'op': 'c', 'before': None, 'after': after}}).encode('utf-8')
+    return FastDebeziumTransactionDecoder(json_backend='json').decode(message).transaction
+
+
+class TestTransactionNotFoundInLZ(unittest.TestCase):
+
+    def setUp(self):
+        self.identifiers = APXIdentifiers()
+        self.rule = TransactionNotFoundInLZ(lz_index=LZDBTransactionIndex(LandingZoneRepository()), identifier_repo=self.identifiers)
+
+    def test_event_lacks_landing_zone_identifiers(self):
+        transaction = debezium_transaction(100, 5000, '250')
+        self.assertIsNone(getattr(transaction, 'PortfolioCode', None))
+        self.assertIsNone(getattr(transaction, 'ProprietarySymbol', None))
+
+    def test_missing_transaction_is_broken(self):
+        self.assertTrue(self.rule.is_broken(debezium_transaction(101, 5000, '250')))
+
+    def test_landed_transaction_is_not_broken(self):
+        self.assertFalse(self.rule.is_broken(debezium_transaction(100, 5000, '250')))
+
+    def test_unresolvable_security_is_not_broken(self):
+        # Without the security's symbol the index can't tell either way
+        self.assertFalse(self.rule.is_broken(debezium_transaction(101, 9999, '250')))
+
+    def test_identifiers_resolved_once_per_context(self):
+        context = TransactionValidationContext(debezium_transaction(101, 5000, '250'))
+        self.assertTrue(self.rule.is_broken(context.transaction, context))
+        self.assertTrue(self.rule.is_broken(context.transaction, context))
+        self.assertEqual(self.identifiers.lookups, 2)
+        self.assertEqual(context.with_identifiers(self.identifiers).PortfolioCode, 'LW0101')
+
+
+if __name__ == '__main__':
+    unittest.main()
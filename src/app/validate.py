@@ -0,0 +1,82 @@
+
+# core python
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+# Append to pythonpath
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(src_dir)
+
+# native
+from application.validation_contexts import TransactionValidationContext
+from application.validation_rules import TransactionQuantityMax100, TransactionPostedAfterBlotterSent
+from application.validators import TransactionValidator
+from domain.models import Transaction
+from infrastructure.file_repositories import FABlotterV1BlotterRepository
+from infrastructure.rule_sources import ConfigTransactionValidationRuleSource
+from infrastructure.services import DigestAlertService, MSTeamsAlertService, QueuedAlertService
+from infrastructure.sql_repositories import APXDBTransactionRepository
+from infrastructure.util.config import AppConfig
+from infrastructure.util.logging import setup_logging
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch transaction validator: validates every transaction for a trade date in one pass')
+    parser.add_argument('--trade_date', '-td', type=str, required=True, help='Trade date, YYYYMMDD format')
+    parser.add_argument('--mode', '-m', type=str, choices=['first_failure', 'all_failures'], default='all_failures', help='Stop at the first broken rule per transaction, or report every broken rule')
+    parser.add_argument('--send_alerts', '-a', action='store_true', help='Send alerts for broken rules, as the consumer would')
+    parser.add_argument('--log_level', '-l', type=str.upper, choices=['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help='Log level')
+
+    args = parser.parse_args()
+
+    trade_date = datetime.datetime.strptime(args.trade_date, '%Y%m%d').date()
+
+    base_dir = AppConfig().get("logging", "base_dir")
+    os.environ['APP_NAME'] = AppConfig().get("app_name", "transaction_batch_validator", fallback='transaction_batch_validator')
+    setup_logging(base_dir=base_dir, log_level_override=args.log_level)
+
+    fail_alert_services = None
+    if args.send_alerts:
+        fail_alert_services = [DigestAlertService.from_config(QueuedAlertService.from_config(
+            MSTeamsAlertService(AppConfig().get('transaction_posted_after_blotter_sent', 'ms_teams_webhook_url'))
+        ))]
+    validator = TransactionValidator([
+        TransactionQuantityMax100(),
+        TransactionPostedAfterBlotterSent(blotter_repo=FABlotterV1BlotterRepository(), fail_alert_services=fail_alert_services),
+    ], rule_source=ConfigTransactionValidationRuleSource(fail_alert_services=fail_alert_services), mode=args.mode)
+
+    repo = APXDBTransactionRepository()
+    logging.info(f"Validating {trade_date} transactions from {repo.cn} with {validator}")
+    validator.refresh_rules()
+    columns = validator.required_fields
+    if columns is not None:
+        columns = tuple(dict.fromkeys(columns + Transaction.display_fields))  # Broken transactions are logged
+    frame = repo.get_frame(trade_date=trade_date, columns=columns, columnar=True)
+    results = validator.validate_batch(frame)
+
+    rules = results.attrs['rules']
+    broken = results.any(axis=1)
+    logging.info(f"{int(broken.sum())} of {len(frame)} transactions broke at least one rule: "
+                    f"{', '.join([f'{rules[c]} {int(results[c].sum())}' for c in results.columns])}")
+
+    transaction_class = Transaction.with_fields(frame.columns)
+    for idx, row in zip(frame.index[broken], frame[broken].itertuples(index=False, name=None)):
+        transaction = transaction_class.from_values(row)
+        broken_rules = [rules[c] for c in results.columns if results.at[idx, c]]
+        logging.info(f"{transaction} broke {', '.join([str(r) for r in broken_rules])}")
+        if args.send_alerts:
+            context = TransactionValidationContext(transaction)
+            for rule in broken_rules:
+                rule.send_alert_for_transaction(transaction, context)
+
+    logging.info(validator.stats_report())
+
+
+
+if __name__ == '__main__':
+    main()